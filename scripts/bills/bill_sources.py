@@ -0,0 +1,150 @@
+"""
+Scraper output can be read from a directory or straight from the .zip / .tar.gz archive the
+scrapers publish, without extracting it to disk first.
+
+Every source lists its members once and keeps the names sorted, so finding the files with a
+given prefix (jurisdiction, bill, vote_event) is a binary search instead of another directory scan.
+
+source = open_source("pa.zip")
+bill_files = source.names_by_prefix("bill")
+for bill_file, item in zip(bill_files, source.parse_items(bill_files)):
+    # item is a path for directories and the member's contents for archives
+    ...
+source.close()
+"""
+import os
+import logging
+import tarfile
+import zipfile
+from bisect import bisect_left
+from datetime import datetime
+
+log = logging.getLogger(__name__)
+
+ZIP_SUFFIXES = (".zip",)
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz")
+
+
+def is_archive(path: str) -> bool:
+    return os.path.isfile(path) and path.endswith(ZIP_SUFFIXES + TAR_SUFFIXES)
+
+
+class PrefixIndex:
+    """Sorted member names, queried by prefix"""
+
+    def __init__(self, names):
+        self.names = sorted(names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def with_prefix(self, prefix: str) -> list:
+        start = bisect_left(self.names, prefix)
+        end = start
+        while end < len(self.names) and self.names[end].startswith(prefix):
+            end += 1
+        return self.names[start:end]
+
+
+def index_members(archive_path: str, members) -> dict:
+    """
+    Members by file name from (member path, info) pairs. Members can be inside a top level folder, but
+    two different paths with the same file name would shadow each other so that is an error
+    """
+    by_name = {}
+    paths = {}
+    for member_path, info in members:
+        name = os.path.basename(member_path)
+        if paths.setdefault(name, member_path) != member_path:
+            raise RuntimeError(f"{archive_path} has more than one {name}: {paths[name]} and {member_path}")
+        # A path that appears twice in a tar is an updated copy, the last one wins like when extracting
+        by_name[name] = info
+    return by_name
+
+
+class DirectorySource:
+    def __init__(self, path: str):
+        self.path = path
+        self.stats = {}
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    self.stats[entry.name] = entry.stat()
+        self.index = PrefixIndex(self.stats)
+
+    def names_by_prefix(self, prefix: str) -> list:
+        return self.index.with_prefix(prefix)
+
+    def read(self, name: str) -> bytes:
+        with open(os.path.join(self.path, name), "rb") as file:
+            return file.read()
+
+    def parse_items(self, names: list):
+        # Parse workers read the files themselves, only the paths are sent over
+        return [os.path.join(self.path, name) for name in names]
+
+    def manifest_path(self, name: str) -> str:
+        return os.path.abspath(os.path.join(self.path, name))
+
+    def fingerprint(self, name: str) -> tuple:
+        stat = self.stats[name]
+        return stat.st_size, stat.st_mtime
+
+    def close(self):
+        pass
+
+
+class ZipSource(DirectorySource):
+    def __init__(self, path: str):
+        self.path = path
+        self.archive = zipfile.ZipFile(path)
+        self.members = index_members(
+            path, ((info.filename, info) for info in self.archive.infolist() if not info.is_dir())
+        )
+        self.index = PrefixIndex(self.members)
+
+    def read(self, name: str) -> bytes:
+        return self.archive.read(self.members[name])
+
+    def parse_items(self, names: list):
+        # Read lazily so only the chunks being parsed are held in memory
+        return (self.read(name) for name in names)
+
+    def fingerprint(self, name: str) -> tuple:
+        info = self.members[name]
+        return info.file_size, datetime(*info.date_time).timestamp()
+
+    def close(self):
+        self.archive.close()
+
+
+class TarSource(ZipSource):
+    def __init__(self, path: str):
+        self.path = path
+        # Seekable mode (not "r|*") so members can be read after the index is built
+        self.archive = tarfile.open(path, "r:*")
+        self.members = index_members(path, ((info.name, info) for info in self.archive.getmembers() if info.isfile()))
+        self.index = PrefixIndex(self.members)
+
+    def names_by_prefix(self, prefix: str) -> list:
+        # Archive order rather than name order - a compressed tar can only be read efficiently front
+        # to back, going backwards means decompressing from the start again
+        return sorted(self.index.with_prefix(prefix), key=lambda name: self.members[name].offset_data)
+
+    def read(self, name: str) -> bytes:
+        with self.archive.extractfile(self.members[name]) as member:
+            return member.read()
+
+    def fingerprint(self, name: str) -> tuple:
+        info = self.members[name]
+        return info.size, float(info.mtime)
+
+
+def open_source(path: str):
+    if os.path.isdir(path):
+        return DirectorySource(path)
+    if not is_archive(path):
+        raise RuntimeError(f"Expected a directory or a {ZIP_SUFFIXES + TAR_SUFFIXES} archive, got {path}")
+    source = ZipSource(path) if path.endswith(ZIP_SUFFIXES) else TarSource(path)
+    log.info(f"Indexed {len(source.index)} files in {path}")
+    return source
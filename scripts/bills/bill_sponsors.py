@@ -0,0 +1,130 @@
+"""
+Resolves Bill.sponsorships to people and keeps them in the bill_sponsor table, so "bills sponsored
+by X" is an index lookup on person_id instead of a JSONB scan plus name matching on every read.
+
+Sponsor names go through the same RosterIndex as voter names (see vote_matching.py), so they are
+matched once at ingest and the resolutions are cached along with the vote ones.
+
+"sponsorships": [
+{
+  "name": "Camera Bartolotta",
+  "entity_type": "person",
+  "organization_id": null,
+  "person_id": "~{\"name\": \"Camera Bartolotta\"}",
+  "primary": true,
+  "classification": "primary"
+},
+
+Bills ingested before bill_sponsor existed can be backfilled with:
+python -m scripts.bills.bill_sponsors
+"""
+import logging
+from sqlalchemy import delete, insert
+from sqlmodel import select
+
+from ..database.database import get_session
+from ..database.models import Bill, BillSponsor
+from ..logging_config import setup_logging
+from .vote_matching import load_roster_index
+
+log = logging.getLogger(__name__)
+
+# Bills read per query when backfilling
+BACKFILL_BATCH_SIZE = 500
+
+
+def _bill_chamber(bill_row):
+    # Sponsors are (almost always) members of the chamber the bill was introduced in
+    from_organization = bill_row.get("from_organization") or {}
+    return from_organization.get("classification")
+
+
+def sponsor_rows(bill_row, roster) -> list:
+    """bill_sponsor rows for a bills row dict, sponsors that can't be matched to a person are left out"""
+    sponsorships = [
+        sponsorship for sponsorship in bill_row.get("sponsorships") or []
+        if sponsorship.get("entity_type", "person") == "person" and sponsorship.get("name")
+    ]
+    if not sponsorships:
+        return []
+
+    # Some scrapers already have the person id, those are only trusted when the person is in the roster -
+    # bill_sponsor references people, so an id for someone that isn't loaded (retired, not yet loaded, ...)
+    # would fail the whole batch. The rest are matched by name
+    def known_person_id(sponsorship):
+        person_id = sponsorship.get("person_id") or ""
+        if person_id.startswith("ocd-person/"):
+            if person_id in roster:
+                return person_id
+            log.warning(f"Sponsor {sponsorship['name']} of bill {bill_row['id']} has person id {person_id} "
+                        f"which isn't in the roster, matching by name")
+        return None
+
+    known_person_ids = [known_person_id(s) for s in sponsorships]
+    names = [s["name"] for s, person_id in zip(sponsorships, known_person_ids) if person_id is None]
+    person_ids = roster.match_many(names, _bill_chamber(bill_row)) if names else {}
+
+    rows = {}
+    for sponsorship, person_id in zip(sponsorships, known_person_ids):
+        if person_id is None:
+            person_id = person_ids[sponsorship["name"]]
+        if person_id is None:
+            log.debug(f"Could not find person for sponsor {sponsorship['name']} of bill {bill_row['id']}")
+            continue
+        classification = sponsorship.get("classification") or ""
+        rows[(person_id, classification)] = dict(
+            bill_id=bill_row["id"],
+            person_id=person_id,
+            primary=bool(sponsorship.get("primary")),
+            classification=classification,
+        )
+    return list(rows.values())
+
+
+def replace_bill_sponsors(session, roster, bill_rows: list) -> int:
+    """
+    Replaces the bill_sponsor rows of the given bills. Meant as the on_flush of the bill
+    BatchUpserter, through partial(replace_bill_sponsors, session, roster)
+    """
+    bill_ids = [row["id"] for row in bill_rows]
+    rows = [sponsor for row in bill_rows for sponsor in sponsor_rows(row, roster)]
+
+    session.execute(delete(BillSponsor).where(BillSponsor.bill_id.in_(bill_ids)))
+    if rows:
+        session.execute(insert(BillSponsor), rows)
+    session.commit()
+    return len(rows)
+
+
+def backfill_bill_sponsors(session) -> int:
+    """Rebuilds bill_sponsor for every bill, one jurisdiction (roster) at a time"""
+    total = 0
+    jurisdiction_area_ids = session.exec(select(Bill.jurisdiction_area_id).distinct()).all()
+    for jurisdiction_area_id in jurisdiction_area_ids:
+        roster = load_roster_index(session, jurisdiction_area_id)
+        last_id = ""
+        while True:
+            bills = session.exec(
+                select(Bill.id, Bill.from_organization, Bill.sponsorships)
+                .where(Bill.jurisdiction_area_id == jurisdiction_area_id, Bill.id > last_id)
+                .order_by(Bill.id)
+                .limit(BACKFILL_BATCH_SIZE)
+            ).all()
+            if not bills:
+                break
+            total += replace_bill_sponsors(session, roster, [bill._asdict() for bill in bills])
+            last_id = bills[-1].id
+        roster.save_resolutions(session)
+        log.info(f"Backfilled {total} bill sponsors, done with {jurisdiction_area_id}")
+    return total
+
+
+def main():
+    with get_session() as session:
+        total = backfill_bill_sponsors(session)
+    log.info(f"Wrote {total} bill sponsors")
+
+
+if __name__ == "__main__":
+    setup_logging()
+    main()
@@ -0,0 +1,150 @@
+"""
+Ingests many per-jurisdiction scraper outputs in one run, e.g. the nightly 50 state refresh:
+
+root/
+  pa/jurisdiction_*.json, bill_*.json, vote_event_*.json, ...
+  wi/...
+  tx.zip (or .tar.gz)
+
+Jurisdictions are ingested concurrently by a thread pool. The threads share one engine (and its
+connection pool), one process pool for json parsing and a cache of people rosters so each
+jurisdiction's roster is only queried once.
+
+Usage:
+python -m scripts.bills.bills_batch <root> --jurisdiction-workers 4
+"""
+import os
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from ..database.database import get_engine, get_session
+from ..logging_config import setup_logging
+from ..json_codec import dumps as json_dumps
+from .bills_state import ingest_bill_data
+from .bill_sources import is_archive
+from .vote_matching import RosterCache
+
+log = logging.getLogger(__name__)
+
+# Jurisdictions ingested at the same time - each holds one db connection
+JURISDICTION_WORKERS = 4
+
+
+def _has_jurisdiction_file(directory: str) -> bool:
+    return any(name.startswith("jurisdiction") for name in os.listdir(directory))
+
+
+def find_bill_data_paths(root: str) -> list:
+    """
+    Sub directories of root that contain a jurisdiction file and archives in root,
+    biggest first so the long poles start early
+    """
+    paths = []
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if is_archive(path):
+            paths.append((os.path.getsize(path), path))
+        elif os.path.isdir(path) and _has_jurisdiction_file(path):
+            paths.append((sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file()), path))
+    return [path for _, path in sorted(paths, reverse=True)]
+
+
+def _ingest_path(engine, path, workers, executor, roster_cache, full, compact_votes) -> dict:
+    with get_session(engine) as session:
+        return ingest_bill_data(session, path, workers, executor=executor, roster_cache=roster_cache, full=full,
+                                compact_votes=compact_votes)
+
+
+def ingest_batch(root: str, jurisdiction_workers: int = JURISDICTION_WORKERS, workers: int = None, full=False,
+                 compact_votes=False) -> list:
+    """
+    Returns one summary per directory / archive. A failing jurisdiction doesn't stop the others,
+    its summary has an "error" instead of counts.
+    """
+    paths = find_bill_data_paths(root)
+    if not paths:
+        raise RuntimeError(f"No jurisdiction directories or archives found in {root}")
+    log.info(f"Ingesting {len(paths)} jurisdictions from {root}")
+
+    engine = get_engine(pool_size=jurisdiction_workers)
+    roster_cache = RosterCache()
+    workers = workers or os.cpu_count()
+
+    summaries = []
+    # Forking once the jurisdiction threads are running can copy a lock another thread holds (logging,
+    # the engine's pool) into the child where it never gets released. forkserver children are forked
+    # from a clean single threaded server process instead
+    parse_context = multiprocessing.get_context("forkserver")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=parse_context) as parse_executor, \
+            ThreadPoolExecutor(max_workers=jurisdiction_workers) as jurisdiction_executor:
+        futures = {
+            jurisdiction_executor.submit(
+                _ingest_path, engine, path, workers, parse_executor, roster_cache, full, compact_votes
+            ): path
+            for path in paths
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                summary = future.result()
+                log.info(f"Finished {path}: {summary['bills']} bills, {summary['vote_events']} vote events "
+                         f"in {summary['seconds']}s")
+            except Exception as e:
+                log.exception(f"Failed to ingest {path}")
+                summary = {"path": path, "error": str(e)}
+            summaries.append(summary)
+
+    engine.dispose()
+    return sorted(summaries, key=lambda summary: summary["path"])
+
+
+def log_summaries(summaries: list):
+    log.info(f"{'path':<40} {'jurisdiction':<45} {'bills':>8} {'votes':>8} {'skipped':>8} {'people':>7} {'secs':>8}")
+    for summary in summaries:
+        name = os.path.basename(summary["path"])
+        if "error" in summary:
+            log.info(f"{name:<40} FAILED: {summary['error']}")
+            continue
+        log.info(
+            f"{name:<40} {summary['jurisdiction_area_id']:<45} {summary['bills']:>8} {summary['vote_events']:>8} "
+            f"{summary['skipped_vote_events']:>8} {summary['people']:>7} {summary['seconds']:>8}"
+        )
+
+    succeeded = [summary for summary in summaries if "error" not in summary]
+    log.info(f"Total: {sum(summary['bills'] for summary in succeeded)} bills, "
+             f"{sum(summary['vote_events'] for summary in succeeded)} vote events, "
+             f"{len(summaries) - len(succeeded)} failed jurisdictions")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest bills for every jurisdiction under a root directory")
+    parser.add_argument("root", type=str,
+                        help="Directory containing one bill data directory or .zip / .tar.gz archive per jurisdiction")
+    parser.add_argument("--jurisdiction-workers", type=int, default=JURISDICTION_WORKERS,
+                        help="Number of jurisdictions ingested at the same time")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of parse worker processes shared by all jurisdictions (defaults to cpu count)")
+    parser.add_argument("--full", action="store_true",
+                        help="Reprocess every file, even the ones the ingest manifest says are unchanged")
+    parser.add_argument("--compact-votes", action="store_true",
+                        help="Store vote rosters in the compact array columns instead of JSONB (see vote_codec.py)")
+    parser.add_argument("--summary-path", type=str, default=None, help="Also write the summaries to this json file")
+    args = parser.parse_args()
+
+    summaries = ingest_batch(args.root, args.jurisdiction_workers, args.workers, args.full, args.compact_votes)
+    log_summaries(summaries)
+
+    if args.summary_path:
+        with open(args.summary_path, "w") as summary_file:
+            summary_file.write(json_dumps(summaries))
+
+    failed = [summary["path"] for summary in summaries if "error" in summary]
+    if failed:
+        raise RuntimeError(f"Failed to ingest {len(failed)} jurisdictions: {failed}")
+
+
+if __name__ == "__main__":
+    setup_logging()
+    main()
@@ -1,29 +1,38 @@
-import os
 import logging
 import argparse
 import json
 import re
 from datetime import datetime, timezone
 from uuid import uuid5, NAMESPACE_OID
-from sqlmodel import select
 from collections import defaultdict
-
-from .vote_matching import replace_voter_ids, augment_persons_with_state, get_vote_chamber
-from ..database.database import upsert_dynamic, get_session
-from ..database.models import Bill, VoteEvent, Person
+from functools import partial
+
+from .vote_matching import replace_voter_ids, load_roster_index
+from .parallel_parse import parse_files
+from .vote_casts import replace_vote_casts
+from .bill_sponsors import replace_bill_sponsors
+from .vote_stats import refresh_person_vote_stats
+from .bill_sources import open_source
+from .ingest_manifest import (
+    load_manifest, split_unchanged, parse_fingerprinted, is_unchanged_content, manifest_row, record_manifest
+)
+from ..database.database import BatchUpserter, get_session
+from ..database.models import Bill, VoteEvent
+from ..database.vote_codec import compact_vote_event_row
 from ..logging_config import setup_logging
 from ..utils import convert_area_id
+from ..json_codec import loads as json_loads, parse_embedded
+from ..dates import DateDecoder, action_date_range
 
 
 log = logging.getLogger(__name__)
 
+# Remembers the date format of the federal scraper - see dates.py
+DATE_DECODER = DateDecoder()
 
 def remove_non_numeric_chars(string):
     return ''.join(filter(str.isnumeric, string))
 
-def get_files_by_prefix(prefix: str, directory: str):
-    return [os.path.join(directory, x) for x in os.listdir(directory) if x.startswith(prefix)]
-
 def create_vote_event_id(vote_event_identifier):
     uuid_value = uuid5(NAMESPACE_OID, vote_event_identifier)
     return f"ocd-vote-event/{uuid_value}"
@@ -75,6 +84,190 @@ def match_people_ids(people_data, vote_event):
     return vote_event
 
 
+def parse_bill(content: bytes, jurisdiction_area_id):
+    """
+    Builds the bills row for the contents of a bill file. Runs in a parse worker process - see parallel_parse.py
+    """
+    bill_data = json_loads(content)
+
+    if bill_data["subject"]:
+        log.info(f"Subject: {bill_data['subject']}")
+        raise RuntimeError(json.dumps(bill_data, indent=2))
+
+    first_action_date, latest_action_date = action_date_range(bill_data["actions"], DATE_DECODER)
+
+    legislative_session = remove_non_numeric_chars(bill_data["legislative_session"])
+
+    return dict(
+        id=create_bill_id(bill_data["identifier"], legislative_session, jurisdiction_area_id),
+        title=bill_data["title"],
+        canonical_id=bill_data["identifier"],
+        jurisdiction_area_id=jurisdiction_area_id,
+        jurisdiction_level="federal",
+        legislative_session=bill_data["legislative_session"],
+        from_organization=parse_embedded(bill_data["from_organization"]),
+        classification=bill_data["classification"],
+        subject=bill_data["subject"],
+        abstracts=bill_data["abstracts"],
+        other_titles=bill_data["other_titles"],
+        other_identifiers=bill_data["other_identifiers"],
+        actions=bill_data["actions"],
+        sponsorships=bill_data["sponsorships"],
+        related_bills=bill_data["related_bills"],
+        versions=bill_data["versions"],
+        documents=bill_data["documents"],
+        citations=bill_data["citations"],
+        sources=bill_data["sources"],
+        extras=bill_data["extras"],
+        latest_action_date=latest_action_date,
+        first_action_date=first_action_date,
+        updated_at=datetime.now(timezone.utc)
+    )
+
+
+def parse_vote_event(content: bytes, jurisdiction_area_id):
+    """
+    Returns (legislative session number, bill identifier, vote_events row). The votes in the
+    row still have the scraper voter ids - matching to people happens in the writer process.
+    """
+    vote_event_data = json_loads(content)
+
+    vote_bill_data = parse_embedded(vote_event_data["bill"])
+    legislative_session = remove_non_numeric_chars(vote_event_data["legislative_session"])
+    return legislative_session, vote_bill_data["identifier"], dict(
+        id=create_vote_event_id(vote_event_data["identifier"]),
+        bill_id=create_bill_id(vote_bill_data["identifier"], legislative_session, jurisdiction_area_id),
+        identifier=vote_event_data["identifier"],
+        motion_text=vote_event_data["motion_text"],
+        motion_classification=vote_event_data["motion_classification"],
+        # 2024-05-23T18:02:00+00:00
+        start_date=DATE_DECODER.decode(vote_event_data["start_date"]),
+        result=vote_event_data["result"],
+        chamber=parse_embedded(vote_event_data["organization"])["classification"],
+        legislative_session=vote_event_data["legislative_session"],
+        votes=vote_event_data["votes"],
+        counts=vote_event_data["counts"],
+        sources=vote_event_data["sources"],
+        extras=vote_event_data["extras"]
+    )
+
+
+def ingest_federal_source(session, source, workers=None, full=False, compact_votes=False):
+    """
+    There are 3 types of json files that we'll need in the source (see bill_sources.py)
+    1. Jurisdiction.json file - information about the jurisdiction relevant for the bills
+    2. Bill.json files - information about each bill
+    4. VoteEvent.json files - information about votes related to bills
+
+    There are also organization.json files and event.json files that we are not ingesting
+    at this time.
+
+    With compact_votes the vote rosters are stored in the compact array columns (see vote_codec.py).
+    """
+    # First identify the jurisdiction information for the federal bill data
+    jurisdiction_files = source.names_by_prefix("jurisdiction")
+    if len(jurisdiction_files) != 1:
+        raise RuntimeError(f"Found {len(jurisdiction_files)} jurisdiction files. Should be 1.")
+    log.info(f"Jurisdiction file: {jurisdiction_files[0]}")
+    jurisdiction_data = json_loads(source.read(jurisdiction_files[0]))
+    jurisdiction_area_id = convert_area_id(jurisdiction_data["id"])
+
+    manifest = load_manifest(session, source)
+
+    # Need to find the person ids for each sponsor and vote which unfortunately is by name. Files are
+    # re-matched whenever the roster changes, the manifest entries record the roster version
+    people_data = load_roster_index(session, jurisdiction_area_id)
+
+    bill_files = source.names_by_prefix("bill")
+    if full:
+        changed_bill_files, unchanged_bills = bill_files, []
+    else:
+        changed_bill_files, unchanged_bills = split_unchanged(source, bill_files, manifest, people_data.version)
+    log.info(f"{len(changed_bill_files)} new or modified bill files, {len(unchanged_bills)} unchanged")
+
+    # Need to match by bill ID and legislative session
+    bill_vote_mapping = defaultdict(set)
+    # Unchanged files aren't parsed so all we know about those bills is their id
+    unchanged_bill_ids = {entry.derived_id for entry in unchanged_bills}
+    bill_manifest_rows = []
+
+    # Ingest bills - parsed in worker processes, written here in batches. Each committed batch also
+    # replaces the bills' rows in bill_sponsor
+    bill_writer = BatchUpserter(session, Bill, on_flush=partial(replace_bill_sponsors, session, people_data))
+    bill_rows = parse_files(
+        partial(parse_fingerprinted, parse_bill), source.parse_items(changed_bill_files), workers,
+        jurisdiction_area_id=jurisdiction_area_id
+    )
+    for bill_file, (bill_hash, bill_row) in zip(changed_bill_files, bill_rows):
+        legislative_session = remove_non_numeric_chars(bill_row["legislative_session"])
+        bill_vote_mapping[legislative_session].add(bill_row["canonical_id"])
+        bill_manifest_rows.append(manifest_row(source, bill_file, bill_hash, bill_row["id"], people_data.version))
+        if not full and is_unchanged_content(manifest, source, bill_file, bill_hash, people_data.version):
+            log.info(f"Bill file only touched, skipping: {bill_file}")
+            continue
+
+        log.info(f"Handling bill file: {bill_file}")
+        bill_writer.add(bill_row)
+    # Votes reference bills so every bill needs to be written first
+    bill_writer.flush()
+    record_manifest(session, bill_manifest_rows)
+    log.info(f"Upserted {bill_writer.count} bills")
+
+
+    # Ingest votes
+    vote_event_files = source.names_by_prefix("vote_event")
+    if full:
+        changed_vote_event_files, unchanged_vote_events = vote_event_files, []
+    else:
+        changed_vote_event_files, unchanged_vote_events = split_unchanged(
+            source, vote_event_files, manifest, people_data.version)
+    log.info(f"{len(changed_vote_event_files)} new or modified vote event files, {len(unchanged_vote_events)} unchanged")
+
+    vote_event_manifest_rows = []
+    # Each committed batch of vote events also replaces their rows in vote_cast
+    affected_person_ids = set()
+    vote_event_writer = BatchUpserter(
+        session, VoteEvent, on_flush=partial(replace_vote_casts, session, affected_person_ids=affected_person_ids)
+    )
+    vote_event_rows = parse_files(
+        partial(parse_fingerprinted, parse_vote_event), source.parse_items(changed_vote_event_files), workers,
+        jurisdiction_area_id=jurisdiction_area_id
+    )
+    for vote_event_file, (vote_event_hash, (legislative_session, vote_bill_identifier, vote_event_row)) in zip(
+            changed_vote_event_files, vote_event_rows):
+        bill_found = (
+            vote_bill_identifier in bill_vote_mapping.get(legislative_session, ())
+            or vote_event_row["bill_id"] in unchanged_bill_ids
+        )
+        if not bill_found:
+            # Not added to the manifest so it is retried once the bill shows up
+            log.warning(f"No bill found for vote event {vote_event_file} - Bill ID: {vote_bill_identifier} - Legislative session: {legislative_session}")
+            continue
+
+        vote_event_manifest_rows.append(manifest_row(
+            source, vote_event_file, vote_event_hash, vote_event_row["id"], people_data.version))
+        if not full and is_unchanged_content(
+                manifest, source, vote_event_file, vote_event_hash, people_data.version):
+            log.info(f"Vote file only touched, skipping: {vote_event_file}")
+            continue
+
+        vote_event_row['votes'] = replace_voter_ids(
+            vote_event_row['votes'],
+            people_data,
+            vote_event_row['chamber']
+        )
+
+        if compact_votes:
+            compact_vote_event_row(vote_event_row)
+        vote_event_writer.add(vote_event_row)
+        log.info(f"Upserting vote: {vote_event_file} for bill {vote_bill_identifier}")
+    vote_event_writer.flush()
+    # Only the people whose votes were written (or unmatched) need their stats recomputed
+    refresh_person_vote_stats(session, affected_person_ids)
+    people_data.save_resolutions(session)
+    record_manifest(session, vote_event_manifest_rows)
+    log.info(f"Upserted {vote_event_writer.count} vote events")
+
 def main():
     log.info("Ingesting bills ")
 
@@ -82,138 +275,25 @@ def main():
         parser = argparse.ArgumentParser(description="Ingest bills")
 
         # Add arguments
-        parser.add_argument("bill_data_directory_path", type=str, help="Path to directory containing bill data")
+        parser.add_argument("bill_data_path", type=str,
+                            help="Path to directory (or .zip / .tar.gz archive) containing bill data")
+        parser.add_argument("--workers", type=int, default=None,
+                            help="Number of parse worker processes (defaults to cpu count, 1 parses in process)")
+        parser.add_argument("--full", action="store_true",
+                            help="Reprocess every file, even the ones the ingest manifest says are unchanged")
+        parser.add_argument("--compact-votes", action="store_true",
+                            help="Store vote rosters in the compact array columns instead of JSONB (see vote_codec.py)")
 
         # Parse the arguments
         args = parser.parse_args()
 
-        bill_data_directory_path = args.bill_data_directory_path
-        log.info(f"Bill data directory path: {bill_data_directory_path}")
-
-        """
-        There are 3 types of json files that we'll need in the directory
-        1. Jurisdiction.json file - information about the jurisdiction relevant for the bills
-        2. Bill.json files - information about each bill
-        4. VoteEvent.json files - information about votes related to bills
-        
-        There are also organization.json files and event.json files that we are not ingesting 
-        at this time.
-        """
-
-        # First identify the jurisdiction information for the federal bill data
-        jurisdiction_filepaths = get_files_by_prefix("jurisdiction", bill_data_directory_path)
-        if len(jurisdiction_filepaths) != 1:
-            raise RuntimeError(f"Found {len(jurisdiction_filepaths)} jurisdiction files. Should be 1.")
-        log.info(f"Jurisdiction file path: {jurisdiction_filepaths[0]}")
-        with open(jurisdiction_filepaths[0]) as jurisdiction_file:
-            jurisdiction_data = json.load(jurisdiction_file)
-        jurisdiction_area_id = convert_area_id(jurisdiction_data["id"])
-
-        bill_files = get_files_by_prefix("bill", bill_data_directory_path)
-
-        # Need to match by bill ID and legislative session
-        bill_vote_mapping = defaultdict(set)
-
-        # Ingest bills
-        for bill_filepath in bill_files:
-            with open(bill_filepath) as bill_file:
-                bill_data = json.load(bill_file)
-                log.info(f"Handling bill file: {bill_filepath}")
-
-                if bill_data["subject"]:
-                    log.info(f"Subject: {bill_data['subject']}")
-                    raise RuntimeError(json.dumps(bill_data, indent=2))
-
-                latest_action = max(bill_data["actions"], key=lambda x: x["date"])
-                first_action = min(bill_data["actions"], key=lambda x: x["date"])
-
-                legislative_session = remove_non_numeric_chars(bill_data["legislative_session"])
-
-                bill = Bill(
-                    id=create_bill_id(bill_data["identifier"], legislative_session, jurisdiction_area_id),
-                    title=bill_data["title"],
-                    canonical_id=bill_data["identifier"],
-                    jurisdiction_area_id=jurisdiction_area_id,
-                    jurisdiction_level="federal",
-                    legislative_session=bill_data["legislative_session"],
-                    from_organization=json.loads(bill_data["from_organization"][1:]),
-                    classification=bill_data["classification"],
-                    subject=bill_data["subject"],
-                    abstracts=bill_data["abstracts"],
-                    other_titles=bill_data["other_titles"],
-                    other_identifiers=bill_data["other_identifiers"],
-                    actions=bill_data["actions"],
-                    sponsorships=bill_data["sponsorships"],
-                    related_bills=bill_data["related_bills"],
-                    versions=bill_data["versions"],
-                    documents=bill_data["documents"],
-                    citations=bill_data["citations"],
-                    sources=bill_data["sources"],
-                    extras=bill_data["extras"],
-                    latest_action_date=datetime.strptime(latest_action["date"], "%Y-%m-%dT%H:%M:%S%z"),
-                    first_action_date=datetime.strptime(first_action["date"], "%Y-%m-%dT%H:%M:%S%z"),
-                    updated_at=datetime.now(timezone.utc)
-                )
-
-                upsert_dynamic(session, bill)
-
-
-                bill_vote_mapping[legislative_session].add(bill_data["identifier"])
-
-        # Need to find the person ids for each vote which unfortunately is by name
-        # Keeping just the name info to reduce memory pressure here but we'll need to
-        # hold all of it
-        people_data = session.exec(
-            select(
-                Person.id,
-                Person.name,
-                Person.first_name,
-                Person.last_name,
-                Person.constituent_area_id,
-                Person.chamber
-            ).where(
-                Person.jurisdiction_area_id==jurisdiction_area_id
-            )
-        ).all()
-        people_data = augment_persons_with_state(people_data)
-
-        # Ingest votes
-        vote_event_files = get_files_by_prefix("vote_event", bill_data_directory_path)
-        for vote_event_filepath in vote_event_files:
-            with open(vote_event_filepath) as vote_event_file:
-                vote_event_data = json.load(vote_event_file)
-
-                vote_bill_data = json.loads(vote_event_data["bill"][1:])
-                legislative_session = remove_non_numeric_chars(vote_event_data["legislative_session"])
-                if legislative_session in bill_vote_mapping and vote_bill_data["identifier"] in bill_vote_mapping[legislative_session]:
-                    vote_event_data['votes'] = replace_voter_ids(
-                        vote_event_data['votes'],
-                        people_data,
-                        get_vote_chamber(vote_event_data)
-                    )
-                    vote_event = VoteEvent(
-                        id=create_vote_event_id(vote_event_data["identifier"]),
-                        bill_id=create_bill_id(vote_bill_data["identifier"], legislative_session, jurisdiction_area_id),
-                        identifier=vote_event_data["identifier"],
-                        motion_text=vote_event_data["motion_text"],
-                        motion_classification=vote_event_data["motion_classification"],
-                        # 2024-05-23T18:02:00+00:00
-                        start_date=datetime.strptime(vote_event_data["start_date"], "%Y-%m-%dT%H:%M:%S%z"),
-                        result=vote_event_data["result"],
-                        chamber=json.loads(vote_event_data["organization"][1:])["classification"],
-                        legislative_session=vote_event_data["legislative_session"],
-                        votes=vote_event_data["votes"],
-                        counts=vote_event_data["counts"],
-                        sources=vote_event_data["sources"],
-                        extras=vote_event_data["extras"]
-                    )
-
-                    upsert_dynamic(session, vote_event)
-                    log.info(f"Upserted vote: {vote_event_filepath} for bill {vote_bill_data['identifier']}")
-                else:
-                    log.warning(f"No bill found for vote event {vote_event_filepath} - Bill ID: {vote_bill_data['identifier']} - Legislative session: {legislative_session}")
-
+        log.info(f"Bill data path: {args.bill_data_path}")
+        source = open_source(args.bill_data_path)
+        try:
+            ingest_federal_source(session, source, args.workers, args.full, args.compact_votes)
+        finally:
+            source.close()
 
 if __name__ == "__main__":
     setup_logging()
-    main()
\ No newline at end of file
+    main()
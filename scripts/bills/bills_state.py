@@ -1,24 +1,31 @@
-import os
 import logging
 import argparse
 import json
-from sqlmodel import select
+import time
+from functools import partial
 from datetime import datetime, timezone
 from uuid import uuid5, NAMESPACE_OID
 
-from ..database.database import upsert_dynamic, get_session
-from ..database.models import Bill, VoteEvent, Person
+from ..database.database import BatchUpserter, get_session
+from ..database.models import Bill, VoteEvent
+from ..database.vote_codec import compact_vote_event_row
 from ..logging_config import setup_logging
 from ..utils import convert_area_id
-from .vote_matching import augment_persons_with_state, replace_voter_ids, get_vote_chamber
+from ..json_codec import loads as json_loads, parse_embedded
+from ..dates import DateDecoder, action_date_range
+from .vote_matching import load_roster_index, replace_voter_ids
+from .parallel_parse import parse_files
+from .vote_casts import replace_vote_casts
+from .bill_sponsors import replace_bill_sponsors
+from .vote_stats import refresh_person_vote_stats
+from .bill_sources import open_source
+from .ingest_manifest import (
+    load_manifest, split_unchanged, parse_fingerprinted, is_unchanged_content, manifest_row, record_manifest
+)
 
 log = logging.getLogger(__name__)
 
 
-def get_files_by_prefix(prefix: str, directory: str):
-    return [os.path.join(directory, x) for x in os.listdir(directory) if x.startswith(prefix)]
-
-
 def create_vote_event_id(vote_event_identifier):
     uuid_value = uuid5(NAMESPACE_OID, vote_event_identifier)
     return f"ocd-vote-event/{uuid_value}"
@@ -32,23 +39,219 @@ def create_bill_id(canonical_id, jurisdiction_area_id):
     return f"ocd-bill/{uuid_value}"
 
 
+# Remembers the date format the state scrapers use - see dates.py
+DATE_DECODER = DateDecoder()
+
+
 def parse_date_str(date_str):
-    if not date_str:
-        return None
-
-    formats = [
-        "%Y-%m-%dT%H:%M:%S%z",
-        "%Y-%m-%d"
-    ]
-
-    for format in formats:
-        try:
-            attempt = datetime.strptime(date_str, format)
-            return attempt
-        except ValueError:
+    return DATE_DECODER.decode(date_str)
+
+
+def parse_bill(content: bytes, jurisdiction_area_id):
+    """
+    Builds the bills row for the contents of a bill file. Runs in a parse worker process - see parallel_parse.py
+    """
+    bill_data = json_loads(content)
+
+    if bill_data["subject"]:
+        log.info(f"Subject: {bill_data['subject']}")
+        raise RuntimeError(json.dumps(bill_data, indent=2))
+
+    first_action_date, latest_action_date = action_date_range(bill_data["actions"], DATE_DECODER)
+
+    return dict(
+        id=create_bill_id(bill_data["identifier"], jurisdiction_area_id),
+        title=bill_data["title"],
+        canonical_id=bill_data["identifier"],
+        jurisdiction_area_id=jurisdiction_area_id,
+        jurisdiction_level="state",
+        legislative_session=bill_data["legislative_session"],
+        from_organization=parse_embedded(bill_data["from_organization"]),
+        classification=bill_data["classification"],
+        subject=bill_data["subject"],
+        abstracts=bill_data["abstracts"],
+        other_titles=bill_data["other_titles"],
+        other_identifiers=bill_data["other_identifiers"],
+        actions=bill_data["actions"],
+        sponsorships=bill_data["sponsorships"],
+        related_bills=bill_data["related_bills"],
+        versions=bill_data["versions"],
+        documents=bill_data["documents"],
+        citations=bill_data["citations"],
+        sources=bill_data["sources"],
+        extras=bill_data["extras"],
+        latest_action_date=latest_action_date,
+        first_action_date=first_action_date,
+        updated_at=datetime.now(timezone.utc)
+    )
+
+
+def parse_vote_event(content: bytes, jurisdiction_area_id):
+    """
+    Returns (bill identifier, vote_events row). The votes in the row still have the
+    scraper voter ids - matching to people happens in the writer process.
+    """
+    vote_event_data = json_loads(content)
+
+    vote_bill_data_identifier = vote_event_data["bill_identifier"]
+    return vote_bill_data_identifier, dict(
+        id=create_vote_event_id(vote_event_data["identifier"]),
+        bill_id=create_bill_id(vote_bill_data_identifier, jurisdiction_area_id),
+        identifier=vote_event_data["identifier"],
+        motion_text=vote_event_data["motion_text"],
+        motion_classification=vote_event_data["motion_classification"],
+        start_date=parse_date_str(vote_event_data["start_date"]),
+        result=vote_event_data["result"],
+        chamber=parse_embedded(vote_event_data["organization"])["classification"],
+        legislative_session=vote_event_data["legislative_session"],
+        votes=vote_event_data["votes"],
+        counts=vote_event_data["counts"],
+        sources=vote_event_data["sources"],
+        extras=vote_event_data["extras"]
+    )
+
+
+def ingest_bill_data(session, bill_data_path, workers=None, executor=None, roster_cache=None, full=False,
+                     compact_votes=False) -> dict:
+    """Ingests a scraper output directory or .zip / .tar.gz archive"""
+    source = open_source(bill_data_path)
+    try:
+        return ingest_bill_source(session, source, workers, executor, roster_cache, full, compact_votes)
+    finally:
+        source.close()
+
+
+def ingest_bill_source(session, source, workers=None, executor=None, roster_cache=None, full=False,
+                       compact_votes=False) -> dict:
+    """
+    There are 3 types of json files that we'll need in the source
+    1. Jurisdiction.json file - information about the jurisdiction relevant for the bills
+    2. Bill.json files - information about each bill
+    4. VoteEvent.json files - information about votes related to bills
+
+    There are also organization.json files and event.json files that we are not ingesting
+    at this time.
+
+    Files that haven't changed since they were last ingested are skipped unless full is set,
+    see ingest_manifest.py. With compact_votes the vote rosters are stored in the compact array
+    columns (see vote_codec.py). Returns a summary of what was ingested from the source.
+    """
+    started = time.monotonic()
+    log.info(f"Bill data path: {source.path}")
+
+    # First identify the jurisdiction information for the bill data
+    jurisdiction_files = source.names_by_prefix("jurisdiction")
+    if len(jurisdiction_files) != 1:
+        raise RuntimeError(f"Found {len(jurisdiction_files)} jurisdiction files. Should be 1.")
+    log.info(f"Jurisdiction file: {jurisdiction_files[0]}")
+    jurisdiction_data = json_loads(source.read(jurisdiction_files[0]))
+    jurisdiction_area_id = convert_area_id(jurisdiction_data["id"])
+
+    manifest = load_manifest(session, source)
+
+    # Need to find the person ids for each sponsor and vote which unfortunately is by name. Files are
+    # re-matched whenever the roster changes, the manifest entries record the roster version
+    if roster_cache is not None:
+        people_data = roster_cache.get(session, jurisdiction_area_id)
+    else:
+        people_data = load_roster_index(session, jurisdiction_area_id)
+
+    bill_files = source.names_by_prefix("bill")
+    if full:
+        changed_bill_files, unchanged_bills = bill_files, []
+    else:
+        changed_bill_files, unchanged_bills = split_unchanged(source, bill_files, manifest, people_data.version)
+    log.info(f"{len(changed_bill_files)} new or modified bill files, {len(unchanged_bills)} unchanged")
+
+    # Ids of every bill in the source, whether or not it was rewritten this run
+    bill_ids = {entry.derived_id for entry in unchanged_bills}
+    bill_manifest_rows = []
+    # Ingest bills - parsed in worker processes, written here in batches. Each committed batch also
+    # replaces the bills' rows in bill_sponsor
+    bill_writer = BatchUpserter(session, Bill, on_flush=partial(replace_bill_sponsors, session, people_data))
+    bill_rows = parse_files(
+        partial(parse_fingerprinted, parse_bill), source.parse_items(changed_bill_files), workers,
+        executor=executor, jurisdiction_area_id=jurisdiction_area_id
+    )
+    for bill_file, (bill_hash, bill_row) in zip(changed_bill_files, bill_rows):
+        bill_ids.add(bill_row["id"])
+        bill_manifest_rows.append(manifest_row(source, bill_file, bill_hash, bill_row["id"], people_data.version))
+        if not full and is_unchanged_content(manifest, source, bill_file, bill_hash, people_data.version):
+            log.info(f"Bill file only touched, skipping: {bill_file}")
             continue
 
-    raise RuntimeError(f"Could not parse date '{date_str}'")
+        log.info(f"Handling bill file: {bill_file}")
+        bill_writer.add(bill_row)
+    # Votes reference bills so every bill needs to be written first
+    bill_writer.flush()
+    record_manifest(session, bill_manifest_rows)
+    log.info(f"Upserted {bill_writer.count} bills")
+
+
+    # Ingest votes
+    vote_event_files = source.names_by_prefix("vote_event")
+    if full:
+        changed_vote_event_files, unchanged_vote_events = vote_event_files, []
+    else:
+        changed_vote_event_files, unchanged_vote_events = split_unchanged(
+            source, vote_event_files, manifest, people_data.version)
+    log.info(f"{len(changed_vote_event_files)} new or modified vote event files, {len(unchanged_vote_events)} unchanged")
+
+    vote_event_manifest_rows = []
+    # Each committed batch of vote events also replaces their rows in vote_cast
+    affected_person_ids = set()
+    vote_event_writer = BatchUpserter(
+        session, VoteEvent, on_flush=partial(replace_vote_casts, session, affected_person_ids=affected_person_ids)
+    )
+    vote_event_rows = parse_files(
+        partial(parse_fingerprinted, parse_vote_event), source.parse_items(changed_vote_event_files), workers,
+        executor=executor, jurisdiction_area_id=jurisdiction_area_id
+    )
+    skipped_vote_events = 0
+    for vote_event_file, (vote_event_hash, (vote_bill_data_identifier, vote_event_row)) in zip(
+            changed_vote_event_files, vote_event_rows):
+        if vote_event_row["bill_id"] not in bill_ids:
+            # Not added to the manifest so it is retried once the bill shows up
+            skipped_vote_events += 1
+            log.warning(
+                f"No bill found for vote event {vote_event_file} - Bill ID: {vote_bill_data_identifier}")
+            continue
+
+        vote_event_manifest_rows.append(manifest_row(
+            source, vote_event_file, vote_event_hash, vote_event_row["id"], people_data.version))
+        if not full and is_unchanged_content(
+                manifest, source, vote_event_file, vote_event_hash, people_data.version):
+            log.info(f"Vote file only touched, skipping: {vote_event_file}")
+            continue
+
+        log.info(f"Handling vote file: {vote_event_file}")
+        vote_event_row['votes'] = replace_voter_ids(
+            vote_event_row['votes'],
+            people_data,
+            vote_event_row['chamber'])
+
+        if compact_votes:
+            compact_vote_event_row(vote_event_row)
+        vote_event_writer.add(vote_event_row)
+        log.info(f"Upserting vote: {vote_event_file} for bill {vote_event_row['bill_id']}")
+    vote_event_writer.flush()
+    # Only the people whose votes were written (or unmatched) need their stats recomputed
+    refresh_person_vote_stats(session, affected_person_ids)
+    people_data.save_resolutions(session)
+    record_manifest(session, vote_event_manifest_rows)
+    log.info(f"Upserted {vote_event_writer.count} vote events")
+
+    return {
+        "path": source.path,
+        "jurisdiction_area_id": jurisdiction_area_id,
+        "bills": bill_writer.count,
+        "vote_events": vote_event_writer.count,
+        "skipped_vote_events": skipped_vote_events,
+        "unchanged_files": len(unchanged_bills) + len(unchanged_vote_events),
+        "people": len(people_data),
+        "seconds": round(time.monotonic() - started, 1),
+    }
+
 
 def main():
     log.info("Ingesting bills ")
@@ -57,137 +260,23 @@ def main():
         parser = argparse.ArgumentParser(description="Ingest bills")
 
         # Add arguments
-        parser.add_argument("bill_data_directory_path", type=str, help="Path to directory containing bill data")
+        parser.add_argument("bill_data_path", type=str,
+                            help="Path to directory (or .zip / .tar.gz archive) containing bill data")
+        parser.add_argument("--workers", type=int, default=None,
+                            help="Number of parse worker processes (defaults to cpu count, 1 parses in process)")
+        parser.add_argument("--full", action="store_true",
+                            help="Reprocess every file, even the ones the ingest manifest says are unchanged")
+        parser.add_argument("--compact-votes", action="store_true",
+                            help="Store vote rosters in the compact array columns instead of JSONB (see vote_codec.py)")
 
         # Parse the arguments
         args = parser.parse_args()
 
-        bill_data_directory_path = args.bill_data_directory_path
-        log.info(f"Bill data directory path: {bill_data_directory_path}")
-
-        """
-        There are 3 types of json files that we'll need in the directory
-        1. Jurisdiction.json file - information about the jurisdiction relevant for the bills
-        2. Bill.json files - information about each bill
-        4. VoteEvent.json files - information about votes related to bills
-    
-        There are also organization.json files and event.json files that we are not ingesting 
-        at this time.
-        """
-
-        # First identify the jurisdiction information for the federal bill data
-        jurisdiction_filepaths = get_files_by_prefix("jurisdiction", bill_data_directory_path)
-        if len(jurisdiction_filepaths) != 1:
-            raise RuntimeError(f"Found {len(jurisdiction_filepaths)} jurisdiction files. Should be 1.")
-        log.info(f"Jurisdiction file path: {jurisdiction_filepaths[0]}")
-        with open(jurisdiction_filepaths[0]) as jurisdiction_file:
-            jurisdiction_data = json.load(jurisdiction_file)
-        jurisdiction_area_id = convert_area_id(jurisdiction_data["id"])
-
-        bill_files = get_files_by_prefix("bill", bill_data_directory_path)
-
-        bill_ids = []
-        # Ingest bills
-        for bill_filepath in bill_files:
-            with open(bill_filepath) as bill_file:
-                bill_data = json.load(bill_file)
-                log.info(f"Handling bill file: {bill_filepath}")
-
-                if bill_data["subject"]:
-                    log.info(f"Subject: {bill_data['subject']}")
-                    raise RuntimeError(json.dumps(bill_data, indent=2))
-
-                if bill_data["actions"] and len(bill_data["actions"]) > 0:
-                    latest_action = max(bill_data["actions"], key=lambda x: x["date"])
-                    first_action = min(bill_data["actions"], key=lambda x: x["date"])
-                else:
-                    latest_action = None
-                    first_action = None
-
-                bill = Bill(
-                    id=create_bill_id(bill_data["identifier"], jurisdiction_area_id),
-                    title=bill_data["title"],
-                    canonical_id=bill_data["identifier"],
-                    jurisdiction_area_id=jurisdiction_area_id,
-                    jurisdiction_level="state",
-                    legislative_session=bill_data["legislative_session"],
-                    from_organization=json.loads(bill_data["from_organization"][1:]),
-                    classification=bill_data["classification"],
-                    subject=bill_data["subject"],
-                    abstracts=bill_data["abstracts"],
-                    other_titles=bill_data["other_titles"],
-                    other_identifiers=bill_data["other_identifiers"],
-                    actions=bill_data["actions"],
-                    sponsorships=bill_data["sponsorships"],
-                    related_bills=bill_data["related_bills"],
-                    versions=bill_data["versions"],
-                    documents=bill_data["documents"],
-                    citations=bill_data["citations"],
-                    sources=bill_data["sources"],
-                    extras=bill_data["extras"],
-                    latest_action_date=parse_date_str(latest_action["date"] if latest_action else None),
-                    first_action_date=parse_date_str(first_action["date"] if first_action else None),
-                    updated_at=datetime.now(timezone.utc)
-                )
-
-                upsert_dynamic(session, bill)
-
-                bill_ids.append(bill_data["identifier"])
-
-        # Need to find the person ids for each vote which unfortunately is by name
-        # Keeping just the name info to reduce memory pressure here but we'll need to
-        # hold all of it. At least we can filter by jurisdiction area.
-        people_data = session.exec(
-            select(
-                Person.id,
-                Person.name,
-                Person.first_name,
-                Person.last_name,
-                Person.constituent_area_id,
-                Person.chamber
-            ).where(
-                Person.jurisdiction_area_id == jurisdiction_area_id
-            )
-        ).all()
-        people_data = augment_persons_with_state(people_data)
-
-        # Ingest votes
-        vote_event_files = get_files_by_prefix("vote_event", bill_data_directory_path)
-        for vote_event_filepath in vote_event_files:
-            log.info(f"Handling vote file: {vote_event_filepath}")
-            with open(vote_event_filepath) as vote_event_file:
-                vote_event_data = json.load(vote_event_file)
-
-                vote_bill_data_identifier = vote_event_data["bill_identifier"]
-                if vote_bill_data_identifier in bill_ids:
-                    vote_event_data['votes'] = replace_voter_ids(
-                        vote_event_data['votes'],
-                        people_data,
-                        get_vote_chamber(vote_event_data))
-                    bill_id = create_bill_id(vote_bill_data_identifier, jurisdiction_area_id)
-                    vote_event = VoteEvent(
-                        id=create_vote_event_id(vote_event_data["identifier"]),
-                        bill_id=bill_id,
-                        identifier=vote_event_data["identifier"],
-                        motion_text=vote_event_data["motion_text"],
-                        motion_classification=vote_event_data["motion_classification"],
-                        start_date=parse_date_str(vote_event_data["start_date"]),
-                        result=vote_event_data["result"],
-                        chamber=json.loads(vote_event_data["organization"][1:])["classification"],
-                        legislative_session=vote_event_data["legislative_session"],
-                        votes=vote_event_data["votes"],
-                        counts=vote_event_data["counts"],
-                        sources=vote_event_data["sources"],
-                        extras=vote_event_data["extras"]
-                    )
-
-                    upsert_dynamic(session, vote_event)
-                    log.info(f"Upserted vote: {vote_event_filepath} for bill {bill_id}")
-                else:
-                    log.warning(
-                        f"No bill found for vote event {vote_event_filepath} - Bill ID: {vote_bill_data_identifier}")
+        summary = ingest_bill_data(session, args.bill_data_path, args.workers, full=args.full,
+                                   compact_votes=args.compact_votes)
+        log.info(f"Finished: {summary}")
 
 
 if __name__ == "__main__":
     setup_logging()
-    main()
\ No newline at end of file
+    main()
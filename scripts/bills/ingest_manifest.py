@@ -0,0 +1,98 @@
+"""
+Incremental ingest. Every file that gets ingested is recorded in the ingest_manifest table
+with its size, mtime and content hash. On the next run:
+
+1. Files whose size and mtime match the manifest are skipped without being read
+2. Files that were touched but have the same content hash are parsed but not written again
+3. Everything else (new or modified files) is ingested as usual
+
+Files whose rows depend on name matching against the people roster (vote events, bill sponsors) also
+record the roster version (see vote_matching.roster_version). When people are added or renamed the
+version changes and those files count as changed, so they are matched again.
+
+Manifest rows are only written after the rows they describe have been committed, so a crashed
+run never leaves behind a manifest entry for data that isn't in the db.
+"""
+import os
+import hashlib
+import logging
+from datetime import datetime, timezone
+from sqlmodel import select
+
+from ..database.database import UPSERT_BATCH_SIZE, upsert_rows
+from ..database.models import IngestManifest
+
+log = logging.getLogger(__name__)
+
+
+def content_hash(content: bytes) -> str:
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def load_manifest(session, source) -> dict:
+    """Manifest entries for every file in the source (see bill_sources.py), by path"""
+    # Absolute so that runs from different working directories agree. Archive members are
+    # recorded as <archive path>/<member name>
+    prefix = os.path.abspath(source.path) + os.sep
+    entries = session.exec(
+        select(IngestManifest).where(IngestManifest.path.startswith(prefix))
+    ).all()
+    return {entry.path: entry for entry in entries}
+
+
+def _same_roster(entry, roster_version) -> bool:
+    return roster_version is None or entry.roster_version == roster_version
+
+
+def split_unchanged(source, names: list, manifest: dict, roster_version: str = None) -> tuple:
+    """
+    Returns (changed names, manifest entries of unchanged files). Only looks at size and mtime (and the
+    roster version if given), changed files may still turn out to have the same content once they are hashed.
+    """
+    changed = []
+    unchanged = []
+    for name in names:
+        entry = manifest.get(source.manifest_path(name))
+        if entry is not None and (entry.size, entry.mtime) == source.fingerprint(name) \
+                and _same_roster(entry, roster_version):
+            unchanged.append(entry)
+            continue
+        changed.append(name)
+    return changed, unchanged
+
+
+def parse_fingerprinted(parse_fn, item, **kwargs):
+    """
+    Returns (content hash, parse_fn(content, **kwargs)) for a file path or the contents of an
+    archive member. Meant to be used through partial() with parallel_parse.parse_files
+    """
+    if isinstance(item, bytes):
+        content = item
+    else:
+        with open(item, "rb") as file:
+            content = file.read()
+    return content_hash(content), parse_fn(content, **kwargs)
+
+
+def is_unchanged_content(manifest: dict, source, name: str, file_hash: str, roster_version: str = None) -> bool:
+    entry = manifest.get(source.manifest_path(name))
+    return entry is not None and entry.content_hash == file_hash and _same_roster(entry, roster_version)
+
+
+def manifest_row(source, name: str, file_hash: str, derived_id: str, roster_version: str = None) -> dict:
+    size, mtime = source.fingerprint(name)
+    return dict(
+        path=source.manifest_path(name),
+        size=size,
+        mtime=mtime,
+        content_hash=file_hash,
+        derived_id=derived_id,
+        roster_version=roster_version,
+        updated_at=datetime.now(timezone.utc)
+    )
+
+
+def record_manifest(session, rows: list):
+    for i in range(0, len(rows), UPSERT_BATCH_SIZE):
+        upsert_rows(session, IngestManifest, rows[i:i + UPSERT_BATCH_SIZE])
+    log.info(f"Recorded {len(rows)} files in the ingest manifest")
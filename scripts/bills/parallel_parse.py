@@ -0,0 +1,81 @@
+"""
+Fans json file parsing out to a process pool and streams the parsed rows back in input order.
+
+Parsing (json decoding, date parsing, building row dicts) is the cpu heavy part of bill
+ingest, while writing has to stay in one process so the writer can batch and keep ordering
+(bills before the vote events that reference them).
+"""
+import os
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+
+log = logging.getLogger(__name__)
+
+# Files per task sent to a worker - amortizes the inter-process overhead for small files
+PARSE_CHUNK_SIZE = 32
+
+# How many chunks per worker can be parsed ahead of the writer
+PARSE_PREFETCH_PER_WORKER = 4
+
+
+def _parse_chunk(parse_fn, filepaths):
+    return [parse_fn(filepath) for filepath in filepaths]
+
+
+def _chunked(items, chunk_size):
+    items = iter(items)
+    while chunk := list(islice(items, chunk_size)):
+        yield chunk
+
+
+def _parse_chunks(parse_fn, chunks, workers, executor):
+    in_flight = deque()
+    chunk_iter = iter(chunks)
+
+    for chunk in chunk_iter:
+        in_flight.append(executor.submit(_parse_chunk, parse_fn, chunk))
+        if len(in_flight) >= workers * PARSE_PREFETCH_PER_WORKER:
+            break
+
+    while in_flight:
+        results = in_flight.popleft().result()
+        next_chunk = next(chunk_iter, None)
+        if next_chunk is not None:
+            in_flight.append(executor.submit(_parse_chunk, parse_fn, next_chunk))
+        yield from results
+
+
+def parse_files(parse_fn, filepaths, workers=None, chunk_size=PARSE_CHUNK_SIZE, executor=None, **kwargs):
+    """
+    Yields parse_fn(filepath, **kwargs) for every filepath, in order. parse_fn must be a
+    module level function (so it can be pickled) that returns plain data.
+
+    filepaths can be any iterable (e.g. a generator of archive member contents, see bill_sources.py),
+    it is consumed lazily as chunks are handed out.
+
+    Only a bounded number of chunks are in flight at once so memory stays flat when the
+    writer is slower than the parsers. workers=1 parses in process, which is easier to debug.
+
+    An existing executor can be passed in to share one pool between several concurrent
+    callers (see bills_batch.py), workers then only bounds how many chunks are in flight.
+    """
+    parse_fn = partial(parse_fn, **kwargs) if kwargs else parse_fn
+    workers = workers or os.cpu_count()
+
+    if workers == 1 and executor is None:
+        for filepath in filepaths:
+            yield parse_fn(filepath)
+        return
+
+    chunks = _chunked(filepaths, chunk_size)
+    log.info(f"Parsing files in chunks of {chunk_size} with {workers} workers")
+
+    if executor is not None:
+        yield from _parse_chunks(parse_fn, chunks, workers, executor)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from _parse_chunks(parse_fn, chunks, workers, executor)
@@ -0,0 +1,105 @@
+"""
+Keeps the vote_cast table (one row per person per vote event) in sync with vote_events.
+
+The bill loaders hand every batch of vote events they upsert to replace_vote_casts, which swaps
+out the vote_cast rows of those vote events. Voters that couldn't be matched to a person are only
+in VoteEvent.votes.
+
+Vote events ingested before vote_cast existed can be backfilled (along with person_vote_stats) with:
+python -m scripts.bills.vote_casts
+"""
+import logging
+from sqlalchemy import delete, insert
+from sqlmodel import select
+
+from ..database.database import get_session
+from ..database.models import VoteCast, VoteEvent
+from ..database.vote_codec import VOTE_COLUMNS, vote_event_votes
+from ..logging_config import setup_logging
+from .vote_stats import refresh_person_vote_stats
+
+log = logging.getLogger(__name__)
+
+# Vote events read per query when backfilling
+BACKFILL_BATCH_SIZE = 500
+
+
+def is_person_id(voter_id) -> bool:
+    # Matched voters get the person id, unmatched ones keep the scraper's "~{...}" pseudo id
+    return bool(voter_id) and voter_id.startswith("ocd-person/")
+
+
+def vote_cast_rows(vote_event_row) -> list:
+    """vote_cast rows for a vote_events row dict whose votes have been through replace_voter_ids"""
+    rows = {}
+    for vote in vote_event_votes(vote_event_row):
+        person_id = vote.get("voter_id")
+        # A person can (rarely) show up twice when two voter names match them, the first one wins
+        if not is_person_id(person_id) or person_id in rows:
+            continue
+        rows[person_id] = dict(
+            vote_event_id=vote_event_row["id"],
+            person_id=person_id,
+            option=vote["option"],
+            bill_id=vote_event_row["bill_id"],
+            start_date=vote_event_row["start_date"],
+        )
+    return list(rows.values())
+
+
+def replace_vote_casts(session, vote_event_rows: list, affected_person_ids: set = None) -> int:
+    """
+    Replaces the vote_cast rows of the given vote events. Meant as the on_flush of the vote event
+    BatchUpserter so the vote events exist by the time their vote casts are inserted.
+
+    The people whose vote casts were removed or written are added to affected_person_ids, so their
+    vote stats can be refreshed once the whole run is written (see vote_stats.py)
+    """
+    vote_event_ids = [row["id"] for row in vote_event_rows]
+    rows = [vote_cast for row in vote_event_rows for vote_cast in vote_cast_rows(row)]
+
+    # Matches can change between runs (roster updates) so the old rows are dropped rather than upserted
+    removed_person_ids = session.execute(
+        delete(VoteCast).where(VoteCast.vote_event_id.in_(vote_event_ids)).returning(VoteCast.person_id)
+    ).scalars().all()
+    if affected_person_ids is not None:
+        affected_person_ids.update(removed_person_ids)
+        affected_person_ids.update(row["person_id"] for row in rows)
+    if rows:
+        # executemany - sqlalchemy batches these into multi row inserts
+        session.execute(insert(VoteCast), rows)
+    session.commit()
+    return len(rows)
+
+
+def backfill_vote_casts(session) -> int:
+    """Rebuilds vote_cast for every vote event, reading vote_events in id order"""
+    total = 0
+    affected_person_ids = set()
+    last_id = ""
+    while True:
+        vote_events = session.exec(
+            select(VoteEvent.id, VoteEvent.bill_id, VoteEvent.start_date, VoteEvent.votes,
+                   *(getattr(VoteEvent, column) for column in VOTE_COLUMNS))
+            .where(VoteEvent.id > last_id)
+            .order_by(VoteEvent.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        ).all()
+        if not vote_events:
+            break
+        total += replace_vote_casts(session, [vote_event._asdict() for vote_event in vote_events], affected_person_ids)
+        last_id = vote_events[-1].id
+        log.info(f"Backfilled {total} vote casts, up to vote event {last_id}")
+    refresh_person_vote_stats(session, affected_person_ids)
+    return total
+
+
+def main():
+    with get_session() as session:
+        total = backfill_vote_casts(session)
+    log.info(f"Wrote {total} vote casts")
+
+
+if __name__ == "__main__":
+    setup_logging()
+    main()
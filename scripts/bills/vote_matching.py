@@ -2,11 +2,18 @@
 # match_voters.py
 
 import re
-import json
+import hashlib
 import logging
+import threading
 import unicodedata
-from ..database.models import Person
-from thefuzz import process
+from sqlalchemy import delete
+from sqlmodel import select
+from ..database.database import UPSERT_BATCH_SIZE, upsert_rows
+from ..database.models import Person, VoterNameResolution
+from ..json_codec import parse_embedded
+from collections import defaultdict
+from rapidfuzz import fuzz, process
+from rapidfuzz.utils import default_process
 
 log = logging.getLogger(__name__)
 
@@ -14,7 +21,7 @@ log = logging.getLogger(__name__)
 def get_vote_chamber(vote_event):
     # "organization": "~{\"classification\": \"upper\"}",
     try:
-        return json.loads(vote_event["organization"][1:])['classification']
+        return parse_embedded(vote_event["organization"])['classification']
     except Exception:
         log.warning(f"Unexpected organization value: {vote_event['organization']}")
         return None
@@ -78,13 +85,83 @@ def augment_persons_with_state(persons: list) -> list:
     """
     return_list = []
     for p in persons:
-        p_dict = p._asdict()
+        # Rows from the roster query, or plain dicts
+        p_dict = dict(p) if isinstance(p, dict) else p._asdict()
         constituent_area_id = p_dict.get('constituent_area_id', '')
         p_dict['state'] = get_state_from_area_id(constituent_area_id)
         return_list.append(p_dict)
     return return_list
 
 
+def load_roster(session, jurisdiction_area_id: str) -> list:
+    """
+    People that votes in a jurisdiction can be matched against, augmented with their state.
+    Keeping just the name info to reduce memory pressure here but we'll need to hold all of it.
+    """
+    people_data = session.exec(
+        select(
+            Person.id,
+            Person.name,
+            Person.first_name,
+            Person.last_name,
+            Person.constituent_area_id,
+            Person.chamber
+        ).where(
+            Person.jurisdiction_area_id == jurisdiction_area_id
+        )
+    ).all()
+    return augment_persons_with_state(people_data)
+
+
+def load_roster_index(session, jurisdiction_area_id: str):
+    """RosterIndex for a jurisdiction, with the cached voter name resolutions for the current roster loaded"""
+    roster = RosterIndex(load_roster(session, jurisdiction_area_id), jurisdiction_area_id)
+    roster.load_resolutions(session)
+    return roster
+
+
+def delete_stale_voter_name_resolutions(session):
+    """
+    Drops cached voter name resolutions that were made against a roster that has since changed.
+    Run by the people loaders - stale entries are never read (the roster version no longer matches)
+    but there is no point keeping them around.
+    """
+    jurisdiction_area_ids = session.exec(select(VoterNameResolution.jurisdiction_area_id).distinct()).all()
+    for jurisdiction_area_id in jurisdiction_area_ids:
+        current_version = roster_version(load_roster(session, jurisdiction_area_id))
+        result = session.execute(
+            delete(VoterNameResolution).where(
+                VoterNameResolution.jurisdiction_area_id == jurisdiction_area_id,
+                VoterNameResolution.roster_version != current_version
+            )
+        )
+        if result.rowcount:
+            log.info(f"Roster for {jurisdiction_area_id} changed, dropped {result.rowcount} voter name resolutions")
+    session.commit()
+
+
+class RosterCache:
+    """
+    RosterIndexes by jurisdiction_area_id, loaded once per run. Safe to share between threads -
+    a jurisdiction's roster is only ever queried once even if several threads ask for it at the same time.
+    """
+
+    def __init__(self):
+        self.rosters = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def get(self, session, jurisdiction_area_id: str):
+        with self.lock:
+            jurisdiction_lock = self.locks.setdefault(jurisdiction_area_id, threading.Lock())
+
+        with jurisdiction_lock:
+            if jurisdiction_area_id not in self.rosters:
+                self.rosters[jurisdiction_area_id] = load_roster_index(session, jurisdiction_area_id)
+                log.info(f"Loaded {len(self.rosters[jurisdiction_area_id])} people for {jurisdiction_area_id}")
+            return self.rosters[jurisdiction_area_id]
+
+
 def remove_accents(input_str):
     return ''.join(
         c for c in unicodedata.normalize('NFD', input_str)
@@ -103,78 +180,218 @@ def standardize_voter_name(voter_name: str) -> str:
     return remove_accents(re.sub(r'\(.*?\)', '', voter_name).strip())
 
 
-def _fuzzy_match_name(standardized_name: str, persons: list, threshold: int) -> str | None:
+# Score given to exact name / last name matches
+EXACT_MATCH_SCORE = 100.0
+
+# Person fields that go into the roster version - if any of them change, cached resolutions are stale
+ROSTER_VERSION_FIELDS = ("id", "name", "first_name", "last_name", "state", "chamber")
+
+# Vote chambers we can map to Person.chamber - other values (e.g. "legislature") aren't filtered on
+VOTE_CHAMBER_TO_PERSON_CHAMBER = {
+    "lower": "House",
+    "upper": "Senate"
+}
+
+
+# thefuzz's full_process(force_ascii=True) - drops latin-1 characters before the rapidfuzz default processing
+_LATIN1_TABLE = {i: None for i in range(128, 256)}
+
+
+def _process_name(name: str) -> str:
+    return default_process(name.translate(_LATIN1_TABLE))
+
+
+class RosterPartition:
     """
-    Internal helper to fuzzy match a standardized voter name among a list
-    of Person objects. Returns the matched Person's id or None.
+    The people in one (state, chamber) slice of a roster with everything matching needs precomputed:
+    - exact: lowercased name / last_name -> id of the first person (in roster order) with it
+    - name_map: name variations (first + last, full name) -> id for fuzzy matching, and the
+      processed variations to score against
+    """
+
+    def __init__(self, persons: list):
+        self.size = len(persons)
+        self.exact = {}
+        for p in persons:
+            # This is a little spooky - for Federal votes, they often only include the last name
+            # but it's kinda questionable for me to do this...
+            for key in ("name", "last_name"):
+                if p.get(key):
+                    self.exact.setdefault(p[key].lower(), p["id"])
+
+        self.name_map = {}
+        for p in persons:
+            first = p.get("first_name") or ""
+            last = p.get("last_name") or ""
+            composite = f"{first} {last}".strip()
+            if composite:
+                self.name_map[composite] = p["id"]
+            if p.get("name"):
+                self.name_map[p["name"]] = p["id"]
+        self.possible_names = list(self.name_map)
+        self.processed_names = [_process_name(name) for name in self.possible_names]
+
 
-    :param standardized_name: e.g. 'Baldwin', 'Cruz', 'Case'
-    :param persons: a filtered list of persons to match against,
-                    each person dict can have 'id', 'name', 'first_name', 'last_name'
-    :param threshold: integer fuzzy match threshold
+def _score_in_partition(standardized_names: list, partition: RosterPartition) -> list:
     """
+    Scores standardized voter names (e.g. 'Baldwin', 'Cruz', 'Case') against the persons of a
+    roster partition. Returns (best candidate Person id or None, score) for each name - the
+    caller decides whether the score is good enough.
 
-    if not persons:
-        return None
+    Exact name / last name matches (case-insensitive) win with a score of 100, everything else
+    is scored against all name variations in a single rapidfuzz cdist call.
+    """
+    results = [(None, 0.0)] * len(standardized_names)
+    if not partition.size:
+        return results
+
+    fuzzy = []
+    for i, standardized_name in enumerate(standardized_names):
+        exact_id = partition.exact.get(standardized_name.lower())
+        if exact_id:
+            results[i] = (exact_id, EXACT_MATCH_SCORE)
+        else:
+            fuzzy.append(i)
 
-    standardized_lower = standardized_name.lower()
+    if not fuzzy or not partition.possible_names:
+        return results
 
-    # Check for exact name match first (case insensitive)
+    scores = process.cdist(
+        [_process_name(standardized_names[i]) for i in fuzzy],
+        partition.processed_names,
+        scorer=fuzz.WRatio,
+        workers=-1
+    )
+    best = scores.argmax(axis=1)
+    for i, best_index, row in zip(fuzzy, best, scores):
+        best_name = partition.possible_names[best_index]
+        log.debug(f"Best match for {standardized_names[i]} is {best_name} ({row[best_index]:.1f})")
+        results[i] = (partition.name_map[best_name], float(row[best_index]))
 
-    # 1) Check for exact name match (case-insensitive).
-    #    If found, immediately return that person's ID.
-    for p in persons:
-        # If we find exact name match - just return
-        if "name" in p and p["name"] and p["name"].lower() == standardized_lower:
-            log.info(f"Matched {standardized_name} to {p['name']}")
-            return p['id']
-
-        # This is a little spooky - for Federal votes, they often only include the last name
-        # but it's kinda questionable for me to do this...
-        if "last_name" in p and p["last_name"] and p["last_name"].lower() == standardized_lower:
-            log.info(f"Matched {standardized_name} to {p['last_name']}")
-            return p["id"]
-
-    # 2) Build a mapping from possible name variations to person ID.
-    #    This allows us to fuzzy-match across first+last or full name.
-    name_map = {}
-    for p in persons:
-        pid = p["id"]
-        first = p.get("first_name") or ""
-        last = p.get("last_name") or ""
+    return results
 
-        # a) first_name + last_name
-        if first or last:
-            composite = f"{first} {last}".strip()
-            if composite:  # e.g. "Case" "Smith"
-                name_map[composite] = pid
 
-        # c) If you still want to consider p["name"] as is
-        if p.get("name"):
-            name_map[p["name"]] = pid
+def _accept(result: tuple, threshold: int) -> str | None:
+    person_id, score = result
+    # thefuzz rounded scores to ints before comparing to the threshold
+    return person_id if round(score) >= threshold else None
 
-    # 3) Perform fuzzy matching on all name variations.
-    if not name_map:
-        return None
 
-    possible_names = list(name_map.keys())
-    match_result = process.extractOne(standardized_name, possible_names)
-    if not match_result:
-        return None
+def roster_version(persons: list) -> str:
+    """Hash of everything about a roster that matching looks at"""
+    digest = hashlib.blake2b(digest_size=16)
+    for p in sorted(persons, key=lambda p: p["id"]):
+        digest.update(repr(tuple(p.get(key) for key in ROSTER_VERSION_FIELDS)).encode("utf-8"))
+    return digest.hexdigest()
 
-    best_name, best_score = match_result
-    if best_score >= threshold:
-        log.info(f"Matched {standardized_name} to {best_name}")
-        return name_map[best_name]
 
-    return None
+class RosterIndex:
+    """
+    A roster prepared for matching voter names. Partitions are built the first time a
+    (state, chamber) combination is asked for, and every (voter name, vote chamber) is only
+    resolved once - roll calls repeat the same ~150 names over and over.
+
+    With a jurisdiction_area_id, resolutions are also persisted in the voter_name_resolution
+    table: load_resolutions() pulls in everything known for this roster version up front and
+    save_resolutions() writes back whatever was matched since.
+    """
+
+    def __init__(self, persons: list, jurisdiction_area_id: str = None):
+        self.persons = persons
+        self.person_ids = {p["id"] for p in persons}
+        self.jurisdiction_area_id = jurisdiction_area_id
+        self.version = roster_version(persons)
+        self.partitions = {}
+        self.resolved = {}
+        self.new_resolutions = []
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.persons)
+
+    def __contains__(self, person_id) -> bool:
+        return person_id in self.person_ids
+
+    def partition(self, state: str | None, chamber: str | None) -> RosterPartition:
+        key = (state, chamber)
+        if key not in self.partitions:
+            self.partitions[key] = RosterPartition([
+                p for p in self.persons
+                if (state is None or p["state"] == state) and (chamber is None or p["chamber"] == chamber)
+            ])
+        return self.partitions[key]
+
+    def load_resolutions(self, session):
+        if self.jurisdiction_area_id is None:
+            return
+        resolutions = session.exec(
+            select(VoterNameResolution).where(
+                VoterNameResolution.jurisdiction_area_id == self.jurisdiction_area_id,
+                VoterNameResolution.roster_version == self.version
+            )
+        ).all()
+        for resolution in resolutions:
+            self.resolved[(resolution.voter_name, resolution.chamber)] = (resolution.person_id, resolution.score)
+        log.info(f"Loaded {len(resolutions)} voter name resolutions for {self.jurisdiction_area_id}")
+
+    def save_resolutions(self, session):
+        if self.jurisdiction_area_id is None:
+            return
+        with self.lock:
+            rows, self.new_resolutions = self.new_resolutions, []
+        for i in range(0, len(rows), UPSERT_BATCH_SIZE):
+            upsert_rows(session, VoterNameResolution, rows[i:i + UPSERT_BATCH_SIZE])
+        log.info(f"Saved {len(rows)} new voter name resolutions for {self.jurisdiction_area_id}")
+
+    def match_many(self, voter_names, vote_chamber: str, threshold: int = 80) -> dict:
+        """
+        Resolves voter names to Person ids (or None). Names that haven't been seen before are
+        bucketed by (state, chamber) partition and each bucket is matched in one go.
+        """
+        # Unknown chambers are stored as "" since they are part of the primary key
+        chamber_key = vote_chamber or ""
+
+        buckets = defaultdict(list)
+        for voter_name in set(voter_names):
+            if (voter_name, chamber_key) not in self.resolved:
+                # Only persons in this state (if the name has one) and chamber. Some states use different
+                # mappings like "legislature" -> "City Council" which can be difficult so those aren't filtered
+                partition_key = (get_state_from_name(voter_name), VOTE_CHAMBER_TO_PERSON_CHAMBER.get(vote_chamber))
+                buckets[partition_key].append(voter_name)
+
+        for partition_key, bucket_names in buckets.items():
+            results = _score_in_partition(
+                [standardize_voter_name(voter_name) for voter_name in bucket_names],
+                self.partition(*partition_key)
+            )
+            new_resolutions = []
+            for voter_name, (person_id, score) in zip(bucket_names, results):
+                self.resolved[(voter_name, chamber_key)] = (person_id, score)
+                new_resolutions.append(dict(
+                    jurisdiction_area_id=self.jurisdiction_area_id,
+                    chamber=chamber_key,
+                    voter_name=voter_name,
+                    roster_version=self.version,
+                    person_id=person_id,
+                    score=score
+                ))
+            with self.lock:
+                self.new_resolutions.extend(new_resolutions)
+
+        return {
+            voter_name: _accept(self.resolved[(voter_name, chamber_key)], threshold)
+            for voter_name in voter_names
+        }
+
+    def match(self, voter_name: str, vote_chamber: str, threshold: int = 80) -> str | None:
+        return self.match_many([voter_name], vote_chamber, threshold)[voter_name]
 
 
 def match_voter_to_person(
         voter_name: str,
         voter_state: str,
         vote_chamber: str,
-        persons: list,
+        persons,
         threshold: int = 80
 ) -> str:
     """
@@ -187,29 +404,16 @@ def match_voter_to_person(
     :param voter_name: e.g., 'Baldwin (D-WI)'
     :param voter_state: e.g., 'WI' (parsed from jurisdiction_id)
     :param voter_chamber: e.g. 'lower' (which we need to map to House/Senate)
-    :param persons: List of person dicts, each with keys including 'name' and 'state'.
+    :param persons: RosterIndex, or a list of person dicts each with keys including 'name' and 'state'.
     :param threshold: The fuzzy-match score threshold to accept a match (default 80).
     """
+    roster = persons if isinstance(persons, RosterIndex) else RosterIndex(persons)
+
     # Standardize the name for better fuzzy matching
     standardized_voter = standardize_voter_name(voter_name)
 
-    # First try fuzzy matching among persons in this state
-    if voter_state:
-        persons = filter(lambda p: p["state"] == voter_state, persons)
-
-    # Some states use different mappings like "legislature" -> "City Council" which can be difficult
-    if vote_chamber in ["lower", "upper"]:
-        person_chamber = {
-            "lower": "House",
-            "upper": "Senate"
-        }[vote_chamber]
-        persons = filter(lambda p: p["chamber"] == person_chamber, persons)
-
-    # easier for debugging
-    persons = list(persons)
-
-    # If no match found (or voter_state is None), fall back to ALL persons
-    return _fuzzy_match_name(standardized_voter, persons, threshold)
+    partition = roster.partition(voter_state, VOTE_CHAMBER_TO_PERSON_CHAMBER.get(vote_chamber))
+    return _accept(_score_in_partition([standardized_voter], partition)[0], threshold)
 
 
 def replace_voter_ids(votes: list, persons: list, vote_chamber: str, threshold: int = 80) -> list:
@@ -231,7 +435,7 @@ def replace_voter_ids(votes: list, persons: list, vote_chamber: str, threshold:
       ...
     ]
 
-    persons: [
+    persons (or a RosterIndex built from them, which should be reused across vote events): [
       {
         "id": "ocd-person/...",
         "constituent_area_id": "ocd-division/country:us/state:wi",
@@ -246,20 +450,16 @@ def replace_voter_ids(votes: list, persons: list, vote_chamber: str, threshold:
     :param threshold: The fuzzy match threshold to accept a match.
     :return: The modified list of votes with updated 'voter_id'.
     """
+    roster = persons if isinstance(persons, RosterIndex) else RosterIndex(persons)
+
+    # Every voter name in the vote event is matched in one batch
+    matched_ids = roster.match_many([vote.get('voter_name', '') for vote in votes], vote_chamber, threshold)
+
     updated_votes = []
     for vote in votes:
         voter_name = vote.get('voter_name', '')
 
-        # Try to extract the state code from the vote
-        voter_state = get_state_from_name(voter_name)
-
-        matched_id = match_voter_to_person(
-            voter_name=voter_name,
-            voter_state=voter_state,
-            vote_chamber=vote_chamber,
-            persons=persons,
-            threshold=threshold
-        )
+        matched_id = matched_ids[voter_name]
         if matched_id:
             vote['voter_id'] = matched_id
         else:
@@ -279,9 +479,9 @@ def main():
     """
     # Sample persons data
     persons = [
-        Person(id='ocd-person/d7c97bc3-b7cb-585b-b9e3-def97fcb9db6', constituent_area_id='ocd-division/country:us/state:wi', last_name='Baldwin', first_name='Tammy', name='Tammy Baldwin'),
-        Person(id='ocd-person/80f88c07-5f6d-5ca3-8121-9202259a50f2', constituent_area_id='ocd-division/country:us/state:wy/cd:4', last_name='Barrasso', first_name='John', name='John Barrasso'),
-        Person(id='ocd-person/16a0a125-6ebe-58b3-810f-df10c0e7df1f', constituent_area_id='ocd-division/country:us/state:co', last_name='Bennet', first_name='Michael', name='Michael F. Bennet'),
+        dict(id='ocd-person/d7c97bc3-b7cb-585b-b9e3-def97fcb9db6', constituent_area_id='ocd-division/country:us/state:wi', last_name='Baldwin', first_name='Tammy', name='Tammy Baldwin', chamber='Senate'),
+        dict(id='ocd-person/80f88c07-5f6d-5ca3-8121-9202259a50f2', constituent_area_id='ocd-division/country:us/state:wy/cd:4', last_name='Barrasso', first_name='John', name='John Barrasso', chamber='Senate'),
+        dict(id='ocd-person/16a0a125-6ebe-58b3-810f-df10c0e7df1f', constituent_area_id='ocd-division/country:us/state:co', last_name='Bennet', first_name='Michael', name='Michael F. Bennet', chamber='Senate'),
     ]
 
 
@@ -311,7 +511,7 @@ def main():
     ]
 
     # Replace voter_ids using fuzzy matching + state filtering
-    updated_votes = replace_voter_ids(votes, persons, vote_chamber="upper", voter_state=None, threshold=80)
+    updated_votes = replace_voter_ids(votes, persons, vote_chamber="upper", threshold=80)
 
     # Print out the updated votes
     print("=== Updated Votes ===")
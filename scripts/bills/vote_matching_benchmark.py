@@ -0,0 +1,219 @@
+"""
+Benchmark + accuracy check for vote_matching.py against synthetic rosters, so changes to the
+matching show up as numbers instead of log spelunking.
+
+Rosters look like the real ones: accented and hyphenated names, the same last names in several
+states (and a few in the same chamber), and vote events that use the formats the scrapers produce
+('Baldwin (D-WI)' for federal votes, full names / last names / initials with the odd typo for states).
+A small share of voters aren't in the roster at all, those should come back unmatched.
+
+Usage:
+python -m scripts.bills.vote_matching_benchmark --kind state --sizes 10,100,1000
+"""
+import time
+import random
+import logging
+import argparse
+import unicodedata
+
+from .vote_matching import RosterIndex, get_state_from_area_id, replace_voter_ids
+from ..logging_config import setup_logging
+
+log = logging.getLogger(__name__)
+
+STATES = [
+    "AL", "AK", "AZ", "AR", "CA", "CO", "CT", "DE", "FL", "GA", "HI", "ID", "IL", "IN", "IA", "KS", "KY",
+    "LA", "ME", "MD", "MA", "MI", "MN", "MS", "MO", "MT", "NE", "NV", "NH", "NJ", "NM", "NY", "NC", "ND",
+    "OH", "OK", "OR", "PA", "RI", "SC", "SD", "TN", "TX", "UT", "VT", "VA", "WA", "WV", "WI", "WY"
+]
+
+FIRST_NAMES = [
+    "John", "Mary", "Robert", "Patricia", "Michael", "Linda", "David", "Barbara", "James", "Elizabeth",
+    "José", "María", "Zoë", "Ángel", "Chloé", "Renée", "André", "Tammy", "Raúl", "Nydia", "Ted", "Kirsten"
+]
+
+# Names that make matching hard (shared, accented, hyphenated, multi word) - mixed in with generated
+# ones so a roster has some duplicate last names but not wall to wall
+HARD_LAST_NAMES = [
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+    "Kamlager-Dove", "Ocasio-Cortez", "Watson Coleman", "O'Rourke", "McMorris Rodgers", "Díaz-Balart",
+    "Sánchez", "Velázquez", "Peña", "Müller", "Baldwin", "Bennet", "Cruz", "Case", "Lee", "Young"
+]
+
+LAST_NAME_PREFIXES = ["Ander", "Thomp", "Har", "Wil", "Mar", "Rob", "Ed", "Fitz", "Mac", "Stan", "Brad",
+                      "Whit", "Hol", "Ken", "Row", "Gal", "Pat", "Ash", "Bur", "Carl"]
+LAST_NAME_SUFFIXES = ["son", "ley", "ton", "ford", "wood", "man", "field", "ridge", "berg", "er", "ington"]
+
+# Share of people whose last name comes from HARD_LAST_NAMES
+HARD_LAST_NAME_RATE = 0.3
+
+PARTIES = ["D", "R", "I"]
+
+# Share of voters in a vote event that aren't on the roster
+UNKNOWN_VOTER_RATE = 0.02
+
+# Share of state vote names with a dropped letter
+TYPO_RATE = 0.05
+
+DEFAULT_SIZES = [10, 100, 1000]
+
+
+def _strip_accents(name: str) -> str:
+    return ''.join(c for c in unicodedata.normalize('NFD', name) if unicodedata.category(c) != 'Mn')
+
+
+def _person(rng, person_id, state, chamber, district):
+    first_name = rng.choice(FIRST_NAMES)
+    if rng.random() < HARD_LAST_NAME_RATE:
+        last_name = rng.choice(HARD_LAST_NAMES)
+    else:
+        last_name = rng.choice(LAST_NAME_PREFIXES) + rng.choice(LAST_NAME_SUFFIXES)
+    middle = f" {rng.choice('ABCDEFGHJKLMNPRSTW')}." if rng.random() < 0.2 else ""
+    return {
+        "id": person_id,
+        "name": f"{first_name}{middle} {last_name}",
+        "first_name": first_name,
+        "last_name": last_name,
+        "constituent_area_id": f"ocd-division/country:us/state:{state.lower()}/{district}",
+        "chamber": chamber,
+        "party": rng.choice(PARTIES),
+    }
+
+
+def generate_federal_roster(rng) -> list:
+    """2 senators per state and 435 house members spread over the states"""
+    persons = []
+    for state in STATES:
+        for seat in range(2):
+            persons.append(_person(rng, f"ocd-person/senate-{state}-{seat}", state, "Senate", f"seat:{seat}"))
+    for i in range(435):
+        state = STATES[i % len(STATES)]
+        persons.append(_person(rng, f"ocd-person/house-{i}", state, "House", f"cd:{i // len(STATES) + 1}"))
+    return persons
+
+
+def generate_state_roster(rng, state="PA", senate_size=50, house_size=203) -> list:
+    persons = []
+    for i in range(senate_size):
+        persons.append(_person(rng, f"ocd-person/{state}-upper-{i}", state, "Senate", f"sldu:{i + 1}"))
+    for i in range(house_size):
+        persons.append(_person(rng, f"ocd-person/{state}-lower-{i}", state, "House", f"sldl:{i + 1}"))
+    return persons
+
+
+def _federal_voter_name(rng, person) -> str:
+    return f"{person['last_name']} ({person['party']}-{person['state']})"
+
+
+def _state_voter_name(rng, person) -> str:
+    voter_name = rng.choice([
+        person["name"],
+        person["last_name"],
+        f"{person['first_name'][0]}. {person['last_name']}",
+        _strip_accents(f"{person['first_name']} {person['last_name']}"),
+        person["name"].upper(),
+    ])
+    if rng.random() < TYPO_RATE and len(voter_name) > 5:
+        i = rng.randrange(1, len(voter_name) - 1)
+        voter_name = voter_name[:i] + voter_name[i + 1:]
+    return voter_name
+
+
+def generate_vote_events(rng, persons, kind, num_vote_events) -> list:
+    """
+    Returns (vote_chamber, votes, expected person id per vote) tuples. Every vote event is a roll
+    call of one chamber, like the real data.
+    """
+    voter_name_fn = _federal_voter_name if kind == "federal" else _state_voter_name
+    chambers = {"upper": [p for p in persons if p["chamber"] == "Senate"],
+                "lower": [p for p in persons if p["chamber"] == "House"]}
+
+    vote_events = []
+    for _ in range(num_vote_events):
+        vote_chamber = rng.choice(list(chambers))
+        votes = []
+        expected = []
+        for person in chambers[vote_chamber]:
+            if rng.random() < UNKNOWN_VOTER_RATE:
+                voter_name = f"Unknown{rng.randrange(10 ** 6)} ({rng.choice(PARTIES)}-{rng.choice(STATES)})" \
+                    if kind == "federal" else f"Unknown Member{rng.randrange(10 ** 6)}"
+                expected.append(None)
+            else:
+                voter_name = voter_name_fn(rng, person)
+                expected.append(person["id"])
+            votes.append({
+                "option": rng.choice(["yes", "no", "not voting"]),
+                "voter_name": voter_name,
+                "voter_id": f"~{{\"name\": \"{voter_name}\"}}",
+                "note": ""
+            })
+        vote_events.append((vote_chamber, votes, expected))
+    return vote_events
+
+
+def run_benchmark(kind: str, num_vote_events: int, seed: int = 0, threshold: int = 80) -> dict:
+    rng = random.Random(seed)
+    persons = generate_federal_roster(rng) if kind == "federal" else generate_state_roster(rng)
+    # Same as augment_persons_with_state does for the roster query rows
+    persons = [{**person, "state": get_state_from_area_id(person["constituent_area_id"])} for person in persons]
+    vote_events = generate_vote_events(rng, persons, kind, num_vote_events)
+    num_votes = sum(len(votes) for _, votes, _ in vote_events)
+    unique_names = len({(vote_chamber, vote["voter_name"]) for vote_chamber, votes, _ in vote_events for vote in votes})
+
+    # Same as the loaders - one index for the whole run
+    started = time.perf_counter()
+    roster = RosterIndex(persons)
+    for vote_chamber, votes, _ in vote_events:
+        replace_voter_ids(votes, roster, vote_chamber, threshold=threshold)
+    seconds = time.perf_counter() - started
+
+    true_positives = false_positives = false_negatives = 0
+    for _, votes, expected in vote_events:
+        for vote, expected_id in zip(votes, expected):
+            matched_id = vote["voter_id"] if not vote["voter_id"].startswith("~") else None
+            if matched_id is not None and matched_id == expected_id:
+                true_positives += 1
+            elif matched_id is not None:
+                false_positives += 1
+            if expected_id is not None and matched_id != expected_id:
+                false_negatives += 1
+
+    return {
+        "kind": kind,
+        "vote_events": num_vote_events,
+        "votes": num_votes,
+        "unique_names": unique_names,
+        "seconds": seconds,
+        "matches_per_second": num_votes / seconds if seconds else float("inf"),
+        "precision": true_positives / (true_positives + false_positives) if true_positives + false_positives else 0.0,
+        "recall": true_positives / (true_positives + false_negatives) if true_positives + false_negatives else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark voter matching against synthetic rosters")
+    parser.add_argument("--kind", choices=["federal", "state", "both"], default="both")
+    parser.add_argument("--sizes", type=str, default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help="Comma separated numbers of vote events to match")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threshold", type=int, default=80)
+    args = parser.parse_args()
+
+    kinds = ["federal", "state"] if args.kind == "both" else [args.kind]
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    log.info(f"{'kind':<8} {'events':>7} {'votes':>9} {'unique':>7} {'seconds':>9} {'votes/s':>10} {'precision':>9} {'recall':>7}")
+    for kind in kinds:
+        for size in sizes:
+            result = run_benchmark(kind, size, args.seed, args.threshold)
+            log.info(
+                f"{result['kind']:<8} {result['vote_events']:>7} {result['votes']:>9} {result['unique_names']:>7} {result['seconds']:>9.2f} "
+                f"{result['matches_per_second']:>10.0f} {result['precision']:>9.3f} {result['recall']:>7.3f}"
+            )
+
+
+if __name__ == "__main__":
+    setup_logging()
+    # Per-match logging would dominate the timings
+    logging.getLogger(RosterIndex.__module__).setLevel(logging.ERROR)
+    main()
@@ -0,0 +1,93 @@
+"""
+Per person voting statistics (yes / no / missed counts, missed vote rate, per session totals) in
+person_vote_stats, so a profile page reads one row by primary key instead of aggregating vote_events.
+
+Stats are recomputed from vote_cast, but only for the people whose vote casts were written or removed
+in a run (see vote_casts.replace_vote_casts). Recomputing rather than adding deltas means re-ingesting
+a vote event, or a voter being matched to someone else, can't make the counts drift.
+"""
+import logging
+from datetime import datetime, timezone
+from sqlalchemy import delete, func
+from sqlmodel import select
+
+from ..database.database import UPSERT_BATCH_SIZE, upsert_rows
+from ..database.models import PersonVoteStats, VoteCast, VoteEvent
+
+log = logging.getLogger(__name__)
+
+# Options that count as a missed vote
+MISSED_OPTIONS = ("absent", "not voting", "excused")
+
+STAT_KEYS = ("total", "yes", "no", "missed", "other")
+
+
+def _empty_stats() -> dict:
+    return {key: 0 for key in STAT_KEYS}
+
+
+def get_person_vote_stats(session, person_id: str):
+    return session.get(PersonVoteStats, person_id)
+
+
+def _aggregate(session, person_ids: list) -> dict:
+    """person id -> (stats, per session stats, first vote date, last vote date)"""
+    option = VoteCast.option
+    rows = session.exec(
+        select(
+            VoteCast.person_id,
+            VoteEvent.legislative_session,
+            func.count(),
+            func.count().filter(option == "yes"),
+            func.count().filter(option == "no"),
+            func.count().filter(option.in_(MISSED_OPTIONS)),
+            func.min(VoteCast.start_date),
+            func.max(VoteCast.start_date),
+        )
+        .join(VoteEvent, VoteEvent.id == VoteCast.vote_event_id)
+        .where(VoteCast.person_id.in_(person_ids))
+        .group_by(VoteCast.person_id, VoteEvent.legislative_session)
+    ).all()
+
+    aggregates = {}
+    for person_id, legislative_session, total, yes, no, missed, first_date, last_date in rows:
+        stats, sessions, first_vote_date, last_vote_date = aggregates.get(
+            person_id, (_empty_stats(), {}, first_date, last_date))
+        session_stats = dict(total=total, yes=yes, no=no, missed=missed, other=total - yes - no - missed)
+        sessions[legislative_session] = session_stats
+        for key in STAT_KEYS:
+            stats[key] += session_stats[key]
+        aggregates[person_id] = (stats, sessions, min(first_vote_date, first_date), max(last_vote_date, last_date))
+    return aggregates
+
+
+def refresh_person_vote_stats(session, person_ids) -> int:
+    """Recomputes person_vote_stats for the given people, people without any vote casts are removed"""
+    person_ids = sorted(person_ids)
+    for i in range(0, len(person_ids), UPSERT_BATCH_SIZE):
+        batch = person_ids[i:i + UPSERT_BATCH_SIZE]
+        aggregates = _aggregate(session, batch)
+
+        rows = []
+        for person_id, (stats, sessions, first_vote_date, last_vote_date) in aggregates.items():
+            rows.append(dict(
+                person_id=person_id,
+                total_votes=stats["total"],
+                yes_count=stats["yes"],
+                no_count=stats["no"],
+                missed_count=stats["missed"],
+                other_count=stats["other"],
+                missed_vote_rate=stats["missed"] / stats["total"],
+                sessions=sessions,
+                first_vote_date=first_vote_date,
+                last_vote_date=last_vote_date,
+                updated_at=datetime.now(timezone.utc)
+            ))
+        upsert_rows(session, PersonVoteStats, rows)
+
+        no_votes = [person_id for person_id in batch if person_id not in aggregates]
+        if no_votes:
+            session.execute(delete(PersonVoteStats).where(PersonVoteStats.person_id.in_(no_votes)))
+            session.commit()
+    log.info(f"Refreshed vote stats for {len(person_ids)} people")
+    return len(person_ids)
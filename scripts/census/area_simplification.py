@@ -0,0 +1,124 @@
+"""
+Post-load job that builds lower resolution copies of area geometries into the
+area_simplified table, plus a read helper that picks the right copy for a map zoom level.
+
+Full TIGER geometries can be megabytes each (zip codes, state house districts) which is
+way more detail than a map can draw at state or county zoom.
+
+Each polygon is simplified on its own, not as part of a coverage, so the border two neighbouring
+areas share is simplified twice and the copies don't line up exactly: at the coarse tiers there
+can be thin gaps / overlaps between e.g. adjacent zip codes. Draw neighbouring areas from the full
+geometry (or a fine tier) when that matters.
+
+Usage (rebuilds every classification):
+python -m scripts.census.area_simplification
+"""
+import argparse
+import logging
+from sqlalchemy import delete, literal
+from sqlalchemy.sql import func, select, insert
+
+from ..database.models import Area, AreaSimplified
+from ..database.database import get_session
+from ..logging_config import setup_logging
+
+log = logging.getLogger(__name__)
+
+# Simplification tolerances in degrees, coarsest first.
+# Very roughly ~1km, ~100m and ~10m at U.S. latitudes
+SIMPLIFICATION_TOLERANCES = [0.01, 0.001, 0.0001]
+
+# Degrees per pixel at zoom 0 for 256px web mercator tiles
+DEGREES_PER_PIXEL_ZOOM_0 = 360 / 256
+
+
+def build_simplified_areas(session, classification=None):
+    """
+    (Re)builds every simplification tier for the areas of the given classification, or
+    all areas if no classification is given. ST_SimplifyPreserveTopology keeps each polygon
+    valid (no self intersections / collapsed rings) at every tolerance.
+
+    The areas' old rows are deleted first so tiers for tolerances that are no longer in
+    SIMPLIFICATION_TOLERANCES don't linger. Everything is one transaction, readers see the old
+    tiers until the new ones are committed.
+    """
+    delete_stmt = delete(AreaSimplified)
+    if classification:
+        delete_stmt = delete_stmt.where(
+            AreaSimplified.area_id.in_(select(Area.id).where(Area.classification == classification))
+        )
+    session.execute(delete_stmt)
+
+    for tolerance in SIMPLIFICATION_TOLERANCES:
+        log.info(f"Simplifying {classification or 'all'} areas at tolerance {tolerance}")
+
+        select_stmt = select(
+            Area.id,
+            literal(tolerance),
+            func.ST_SimplifyPreserveTopology(Area.geometry, tolerance)
+        )
+        if classification:
+            select_stmt = select_stmt.where(Area.classification == classification)
+
+        session.execute(insert(AreaSimplified).from_select(
+            ["area_id", "tolerance", "geometry"],
+            select_stmt
+        ))
+    session.commit()
+
+
+def tolerance_for_zoom(zoom: float) -> float | None:
+    """
+    Returns the coarsest tier that is still finer than a pixel at the given
+    zoom level, or None if the full resolution geometry is needed.
+    """
+    degrees_per_pixel = DEGREES_PER_PIXEL_ZOOM_0 / (2 ** zoom)
+    for tolerance in SIMPLIFICATION_TOLERANCES:
+        if tolerance <= degrees_per_pixel:
+            return tolerance
+    return None
+
+
+def select_area_geojson(area_ids: list, zoom: float = None, tolerance: float = None):
+    """
+    Select statement for (id, geojson) of the given areas at the tier matching the requested
+    zoom level (or explicit tolerance). Falls back to the full geometry when the area has no
+    simplified copy yet or when the zoom needs full resolution.
+    """
+    if tolerance is None and zoom is not None:
+        tolerance = tolerance_for_zoom(zoom)
+
+    if tolerance is None:
+        return select(Area.id, func.ST_AsGeoJSON(Area.geometry)).where(Area.id.in_(area_ids))
+
+    return select(
+        Area.id,
+        func.ST_AsGeoJSON(func.coalesce(AreaSimplified.geometry, Area.geometry))
+    ).outerjoin(
+        AreaSimplified,
+        (AreaSimplified.area_id == Area.id) & (AreaSimplified.tolerance == tolerance)
+    ).where(
+        Area.id.in_(area_ids)
+    )
+
+
+def get_area_geojson(session, area_ids: list, zoom: float = None, tolerance: float = None) -> dict:
+    rows = session.execute(select_area_geojson(area_ids, zoom=zoom, tolerance=tolerance)).all()
+    return {area_id: geojson for area_id, geojson in rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build simplified area geometries")
+    parser.add_argument("--classification", type=str, default=None,
+                        help="Only rebuild areas with this classification e.g. zipcode")
+    args = parser.parse_args()
+
+    with get_session() as session:
+        build_simplified_areas(session, args.classification)
+
+    log.info("Finished")
+
+
+if __name__ == "__main__":
+    setup_logging()
+    main()
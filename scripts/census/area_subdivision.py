@@ -0,0 +1,128 @@
+"""
+Maintains the area_subdivided table - every area geometry split with ST_Subdivide into
+pieces of at most SUBDIVIDE_MAX_VERTICES vertices - and the query helpers that use it.
+
+Big vertex-heavy polygons (Alaska, Texas congressional districts, coastal zip codes) have
+bounding boxes that cover nearly everything and exact tests that walk tens of thousands of
+vertices, so intersecting against the raw areas.geometry column is slow. The subdivided pieces
+have tight bounding boxes for the GiST index to work with and cheap exact tests.
+
+Usage (rebuilds every classification):
+python -m scripts.census.area_subdivision --max-vertices 256
+"""
+import argparse
+import logging
+from sqlalchemy import delete, distinct, text
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql import func, select, insert
+
+from ..database.models import Area, AreaSubdivided
+from ..database.database import get_session
+from ..logging_config import setup_logging
+
+log = logging.getLogger(__name__)
+
+SUBDIVIDE_MAX_VERTICES = 256
+
+
+def build_subdivided_areas(session, classification=None, max_vertices=SUBDIVIDE_MAX_VERTICES):
+    """
+    Replaces the subdivided pieces for the areas of the given classification, or all
+    areas if no classification is given.
+    """
+    log.info(f"Subdividing {classification or 'all'} areas with max {max_vertices} vertices")
+
+    delete_stmt = delete(AreaSubdivided)
+    select_stmt = select(
+        Area.id,
+        Area.classification,
+        func.ST_Subdivide(Area.geometry, max_vertices)
+    )
+    if classification:
+        delete_stmt = delete_stmt.where(AreaSubdivided.classification == classification)
+        select_stmt = select_stmt.where(Area.classification == classification)
+
+    session.execute(delete_stmt)
+    session.execute(
+        insert(AreaSubdivided).from_select(["area_id", "classification", "geometry"], select_stmt)
+    )
+    session.commit()
+
+    # Planner stats matter a lot for picking the GiST index after a big rewrite
+    session.execute(text(f"ANALYZE {AreaSubdivided.__tablename__}"))
+    session.commit()
+
+
+def check_subdivided_areas(session, classifications):
+    """
+    Raises if some areas of the given classifications have no subdivided pieces. The query helpers
+    below only look at area_subdivided, so those areas would silently never match anything
+    """
+    area_counts = dict(session.exec(
+        select(Area.classification, func.count())
+        .where(Area.classification.in_(classifications))
+        .group_by(Area.classification)
+    ).all())
+    subdivided_counts = dict(session.exec(
+        select(AreaSubdivided.classification, func.count(distinct(AreaSubdivided.area_id)))
+        .where(AreaSubdivided.classification.in_(classifications))
+        .group_by(AreaSubdivided.classification)
+    ).all())
+
+    for classification, area_count in sorted(area_counts.items()):
+        subdivided_count = subdivided_counts.get(classification, 0)
+        if subdivided_count < area_count:
+            raise RuntimeError(
+                f"Only {subdivided_count} of {area_count} {classification} areas are subdivided. Run "
+                f"python -m scripts.census.area_subdivision --classification {classification} first"
+            )
+
+
+def select_intersecting_area_ids(area_id: str, classification: str):
+    """
+    Select statement for the ids of areas with the given classification that
+    intersect the area with id area_id, e.g. every zip code touching a district.
+    Both areas need to be in area_subdivided, see check_subdivided_areas
+    """
+    target = aliased(AreaSubdivided)
+    candidate = aliased(AreaSubdivided)
+    return select(distinct(candidate.area_id)).join(
+        target,
+        func.ST_Intersects(candidate.geometry, target.geometry)
+    ).where(
+        target.area_id == area_id,
+        candidate.classification == classification
+    )
+
+
+def select_area_ids_containing_point(lat: float, lon: float, classification: str = None):
+    """
+    Select statement for the ids of areas (optionally of one classification)
+    that contain the given point.
+    """
+    point = func.ST_SetSRID(func.ST_MakePoint(lon, lat), 4326)
+    stmt = select(distinct(AreaSubdivided.area_id)).where(
+        func.ST_Intersects(AreaSubdivided.geometry, point)
+    )
+    if classification:
+        stmt = stmt.where(AreaSubdivided.classification == classification)
+    return stmt
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build subdivided area geometries")
+    parser.add_argument("--classification", type=str, default=None,
+                        help="Only rebuild areas with this classification e.g. zipcode")
+    parser.add_argument("--max-vertices", type=int, default=SUBDIVIDE_MAX_VERTICES,
+                        help="Max vertices per subdivided piece")
+    args = parser.parse_args()
+
+    with get_session() as session:
+        build_subdivided_areas(session, args.classification, args.max_vertices)
+
+    log.info("Finished")
+
+
+if __name__ == "__main__":
+    setup_logging()
+    main()
@@ -1,3 +1,17 @@
+import logging
+from contextlib import contextmanager
+
+from ..database.database import BatchUpserter
+from ..database.models import Area, AreaSimplified, AreaSubdivided
+from ..database.shadow_reload import shadow_reload
+
+log = logging.getLogger(__name__)
+
+RELOAD_HELP = "Bulk load into a shadow table and atomically swap it in instead of upserting in place"
+
+# Areas per upsert statement. Lower than the default since every row carries a full geometry
+AREA_UPSERT_BATCH_SIZE = 25
+
 
 def district_number_helper(classification, state_info, district_number):
     # Some edge cases here
@@ -12,4 +26,23 @@ def district_number_helper(classification, state_info, district_number):
     try:
         return str(int(district_number)).lstrip("0")
     except ValueError:
-        return str(district_number).lstrip("0")
\ No newline at end of file
+        return str(district_number).lstrip("0")
+
+@contextmanager
+def area_writer(session, classification, reload=False):
+    """
+    Yields a function that writes an areas row dict. By default areas are upserted in place,
+    in batches. With reload every area of the classification is replaced via a shadow table
+    swap once the block exits - see database/shadow_reload.py
+    """
+    if not reload:
+        writer = BatchUpserter(session, Area, AREA_UPSERT_BATCH_SIZE)
+        yield writer.add
+        writer.flush()
+        return
+
+    log.info(f"Reloading all {classification} areas")
+    # Simplified / subdivided copies of areas that are gone from the new vintage are deleted with the swap
+    with shadow_reload(session, Area, Area.classification == classification,
+                       derived_models=(AreaSimplified, AreaSubdivided)) as loader:
+        yield loader.add
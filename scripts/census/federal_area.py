@@ -10,8 +10,10 @@ import logging
 from sqlalchemy.sql import func
 import json
 
-from scripts.database.database import upsert_dynamic, get_session
+from scripts.database.database import upsert_rows, get_session
 from ..logging_config import setup_logging
+from .area_simplification import build_simplified_areas
+from .area_subdivision import build_subdivided_areas
 from ..database.models import Area
 
 log = logging.getLogger(__name__)
@@ -54,7 +56,7 @@ def download_national_data():
     record = sf.record(0)
     shape = sf.shape(0)
 
-    return Area(
+    return dict(
         id=f"ocd-division/country:us",
         classification="country",
         name="United States of America",
@@ -82,7 +84,11 @@ def main():
 
         national_area = download_national_data()
 
-        upsert_dynamic(session, national_area)
+        upsert_rows(session, Area, [national_area])
+
+        build_simplified_areas(session, "country")
+
+        build_subdivided_areas(session, "country")
 
 if __name__ == "__main__":
     setup_logging()
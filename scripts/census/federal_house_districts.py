@@ -5,6 +5,7 @@ source and ingest into postgres
 
 import shapefile
 import logging
+import argparse
 import requests
 import os
 import zipfile
@@ -12,11 +13,13 @@ from sqlalchemy.sql import func
 import json
 import shutil
 
-from scripts.census.census_utils import district_number_helper
-from scripts.database.database import upsert_dynamic, get_session
-from scripts.database.models import Area
+from scripts.census.census_utils import district_number_helper, area_writer, RELOAD_HELP
+from scripts.database.database import get_session
 from scripts.reference_data_helper import get_fips_state_mapping
 from ..logging_config import setup_logging
+from .area_simplification import build_simplified_areas
+from .area_subdivision import build_subdivided_areas
+from ..spatial_order import hilbert_order
 
 log = logging.getLogger(__name__)
 
@@ -59,12 +62,18 @@ def download_congressional_district_data(file_number):
     shapefile_path = os.path.join(DATA_DIR, f"tl_2024_{file_number}_cd119.shp")
     sf = shapefile.Reader(shapefile_path)
 
-    num_records = len(sf.records())
+    records = sf.records()
 
     fips_mapping = get_fips_state_mapping()
 
-    for i in range(num_records):
-        record = sf.record(i)
+    # Write spatially adjacent areas next to each other on disk - see spatial_order.py
+    spatial_order = hilbert_order(
+        [float(record[12]) for record in records],
+        [float(record[11]) for record in records]
+    )
+
+    for i in spatial_order:
+        record = records[i]
         shape = sf.shape(i)
 
         state_fips_code = record[0]
@@ -90,7 +99,7 @@ def download_congressional_district_data(file_number):
         else:
             ocd_id = f"ocd-division/country:us/state:{state_info.get('abbreviation').lower()}/cd:{district_number.lower()}"
 
-        yield Area(
+        yield dict(
             id=ocd_id,
             classification=classification,
             name=f"{state_info.get('name')} {record[4]}",
@@ -114,6 +123,9 @@ def cleanup():
     pass
 
 def main():
+    parser = argparse.ArgumentParser(description="Ingest federal house districts")
+    parser.add_argument("--reload", action="store_true", help=RELOAD_HELP)
+    args = parser.parse_args()
 
     log.info("Downloading federal house districts")
 
@@ -127,14 +139,19 @@ def main():
 
         total_ids = []
 
-        for zip_file_number in numbers:
-            for area in download_congressional_district_data(zip_file_number):
-                upsert_dynamic(session, area)
-                total_ids.append(area)
-                log.info(f"Completed jurisdiction: {area.name}")
+        with area_writer(session, "federal_house_district", args.reload) as write_area:
+            for zip_file_number in numbers:
+                for area in download_congressional_district_data(zip_file_number):
+                    write_area(area)
+                    total_ids.append(area)
+                    log.info(f"Completed jurisdiction: {area['name']}")
 
         log.info(f"Areas downloaded {len(total_ids)}")
 
+        build_simplified_areas(session, "federal_house_district")
+
+        build_subdivided_areas(session, "federal_house_district")
+
         cleanup()
 
         log.info("Finished")
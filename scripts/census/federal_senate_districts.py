@@ -4,6 +4,7 @@ source and ingest into postgres
 """
 import shapefile
 import logging
+import argparse
 import requests
 import os
 import zipfile
@@ -11,10 +12,13 @@ import json
 from sqlalchemy.sql import func
 import shutil
 
-from scripts.database.database import get_session, upsert_dynamic
-from scripts.database.models import Area
+from scripts.database.database import get_session
 from scripts.reference_data_helper import get_fips_state_mapping
 from ..logging_config import setup_logging
+from .area_simplification import build_simplified_areas
+from .area_subdivision import build_subdivided_areas
+from ..spatial_order import hilbert_order
+from .census_utils import area_writer, RELOAD_HELP
 
 log = logging.getLogger(__name__)
 
@@ -45,12 +49,18 @@ def download_state_data():
     shapefile_path = os.path.join(DATA_DIR, 'tl_2024_us_state.shp')
     sf = shapefile.Reader(shapefile_path)
 
-    num_records = len(sf.records())
+    records = sf.records()
 
     fips_mapping = get_fips_state_mapping()
 
-    for i in range(num_records):
-        record = sf.record(i)
+    # Write spatially adjacent areas next to each other on disk - see spatial_order.py
+    spatial_order = hilbert_order(
+        [float(record[14]) for record in records],
+        [float(record[13]) for record in records]
+    )
+
+    for i in spatial_order:
+        record = records[i]
         shape = sf.shape(i)
 
         state_fips_code = record[2]
@@ -65,7 +75,7 @@ def download_state_data():
         else:
             ocd_id = f"ocd-division/country:us/state:{state_info.get('abbreviation').lower()}"
 
-        yield Area(
+        yield dict(
             id=ocd_id,
             classification="federal_senate_district",
             name=f"{state_info.get('name')}",
@@ -89,6 +99,9 @@ def cleanup():
     shutil.rmtree(DATA_DIR)
 
 def main():
+    parser = argparse.ArgumentParser(description="Ingest federal senate districts")
+    parser.add_argument("--reload", action="store_true", help=RELOAD_HELP)
+    args = parser.parse_args()
 
     log.info("Downloading federal senate districts")
 
@@ -98,13 +111,18 @@ def main():
 
         total_ids = []
         # There is only a single state zip file
-        for area in download_state_data():
-            upsert_dynamic(session, area)
-            total_ids.append(area.id)
-            log.info(f"Completed area {area.name}")
+        with area_writer(session, "federal_senate_district", args.reload) as write_area:
+            for area in download_state_data():
+                write_area(area)
+                total_ids.append(area["id"])
+                log.info(f"Completed area {area['name']}")
 
         log.info(f"Areas downloaded {len(total_ids)}")
 
+        build_simplified_areas(session, "federal_senate_district")
+
+        build_subdivided_areas(session, "federal_senate_district")
+
         cleanup()
 
         log.info("Finished")
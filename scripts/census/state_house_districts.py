@@ -6,6 +6,7 @@ source and ingest into postgres
 
 import shapefile
 import logging
+import argparse
 import requests
 import os
 import zipfile
@@ -14,11 +15,13 @@ from collections import Counter
 import json
 import shutil
 
-from ..database.models import Area
-from ..database.database import get_session, upsert_dynamic
+from ..database.database import get_session
 from ..logging_config import setup_logging
+from .area_simplification import build_simplified_areas
+from .area_subdivision import build_subdivided_areas
+from ..spatial_order import hilbert_order
 from ..reference_data_helper import get_fips_state_mapping
-from .census_utils import district_number_helper
+from .census_utils import district_number_helper, area_writer, RELOAD_HELP
 
 log = logging.getLogger(__name__)
 
@@ -61,12 +64,18 @@ def download_state_district_data(file_number):
     shapefile_path = os.path.join(DATA_DIR, f"tl_2024_{file_number}_sldl.shp")
     sf = shapefile.Reader(shapefile_path)
 
-    num_records = len(sf.records())
+    records = sf.records()
 
     fips_mapping = get_fips_state_mapping()
 
-    for i in range(num_records):
-        record = sf.record(i)
+    # Write spatially adjacent areas next to each other on disk - see spatial_order.py
+    spatial_order = hilbert_order(
+        [float(record[12]) for record in records],
+        [float(record[11]) for record in records]
+    )
+
+    for i in spatial_order:
+        record = records[i]
         shape = sf.shape(i)
 
         state_fips_code = record[0]
@@ -83,7 +92,7 @@ def download_state_district_data(file_number):
 
         ocd_id = f"ocd-division/country:us/state:{state_info.get('abbreviation').lower()}/sldl:{district_number.lower()}"
 
-        yield Area(
+        yield dict(
             id=ocd_id,
             classification=classification,
             name=f"{state_info.get('name')} {record[4]}",
@@ -108,6 +117,9 @@ def cleanup():
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Ingest state house districts")
+    parser.add_argument("--reload", action="store_true", help=RELOAD_HELP)
+    args = parser.parse_args()
 
     log.info("Downloading state house districts")
 
@@ -122,18 +134,23 @@ def main():
 
         total_ids = []
 
-        for zip_file_number in numbers:
-            log.info(f"Downloading file {zip_file_number}")
-            for area in download_state_district_data(zip_file_number):
-                upsert_dynamic(session, area)
-                total_ids.append(area.id)
-                log.info(f"Completed area {area.name}")
+        with area_writer(session, "state_house_district", args.reload) as write_area:
+            for zip_file_number in numbers:
+                log.info(f"Downloading file {zip_file_number}")
+                for area in download_state_district_data(zip_file_number):
+                    write_area(area)
+                    total_ids.append(area["id"])
+                    log.info(f"Completed area {area['name']}")
 
         counts = Counter(total_ids)
         duplicates = [item for item, count in counts.items() if count > 1]
 
         log.info(f"Areas downloaded {len(total_ids)}. duplicate ids: {duplicates}")
 
+        build_simplified_areas(session, "state_house_district")
+
+        build_subdivided_areas(session, "state_house_district")
+
         cleanup()
 
         log.info("Finished")
@@ -7,6 +7,7 @@ from collections import Counter
 
 import shapefile
 import logging
+import argparse
 import requests
 import os
 import zipfile
@@ -15,18 +16,20 @@ from typing import Generator
 from sqlalchemy.sql import func
 import json
 
-from ..database.models import Area
-from ..database.database import get_session, upsert_dynamic
+from ..database.database import get_session
 from ..logging_config import setup_logging
+from .area_simplification import build_simplified_areas
+from .area_subdivision import build_subdivided_areas
+from ..spatial_order import hilbert_order
 from ..reference_data_helper import get_fips_state_mapping
-from .census_utils import district_number_helper
+from .census_utils import district_number_helper, area_writer, RELOAD_HELP
 
 log = logging.getLogger(__name__)
 
 DATA_DIR = os.path.join(os.getcwd(), '_data', "state_senate_districts")
 
 
-def download_state_district_data(file_number) -> Generator[Area, None, None]:
+def download_state_district_data(file_number) -> Generator[dict, None, None]:
     download_base_url = "https://www2.census.gov/geo/tiger/TIGER2024/SLDU/"
 
     zip_filepath = os.path.join(DATA_DIR, f"tl_2024_{file_number}_sldu.zip")
@@ -61,12 +64,18 @@ def download_state_district_data(file_number) -> Generator[Area, None, None]:
     shapefile_path = os.path.join(DATA_DIR, f"tl_2024_{file_number}_sldu.shp")
     sf = shapefile.Reader(shapefile_path)
 
-    num_records = len(sf.records())
+    records = sf.records()
 
     fips_mapping = get_fips_state_mapping()
 
-    for i in range(num_records):
-        record = sf.record(i)
+    # Write spatially adjacent areas next to each other on disk - see spatial_order.py
+    spatial_order = hilbert_order(
+        [float(record[12]) for record in records],
+        [float(record[11]) for record in records]
+    )
+
+    for i in spatial_order:
+        record = records[i]
         shape = sf.shape(i)
 
         if record[1] == "ZZZ":
@@ -85,7 +94,7 @@ def download_state_district_data(file_number) -> Generator[Area, None, None]:
         else:
             ocd_id = f"ocd-division/country:us/state:{state_info.get('abbreviation').lower()}/sldu:{district_number.lower()}"
 
-        yield Area(
+        yield dict(
             id=ocd_id,
             classification=classification,
             name=f"{state_info.get('name')} {record[4]}", # "Pennsylvania Senate District 1"
@@ -110,6 +119,9 @@ def cleanup():
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Ingest state senate districts")
+    parser.add_argument("--reload", action="store_true", help=RELOAD_HELP)
+    args = parser.parse_args()
 
     # Setup
     with get_session() as session:
@@ -122,18 +134,23 @@ def main():
 
         total_ids = []
 
-        for zip_file_number in numbers:
-            log.info(f"Downloading file {zip_file_number}")
-            for area in download_state_district_data(zip_file_number):
-                upsert_dynamic(session, area)
-                total_ids.append(area.id)
-                log.info(f"Completed area {area.name}")
+        with area_writer(session, "state_senate_district", args.reload) as write_area:
+            for zip_file_number in numbers:
+                log.info(f"Downloading file {zip_file_number}")
+                for area in download_state_district_data(zip_file_number):
+                    write_area(area)
+                    total_ids.append(area["id"])
+                    log.info(f"Completed area {area['name']}")
 
         counts = Counter(total_ids)
         duplicates = [item for item, count in counts.items() if count > 1]
 
         log.info(f"Areas downloaded {len(total_ids)}. duplicate ids: {duplicates}")
 
+        build_simplified_areas(session, "state_senate_district")
+
+        build_subdivided_areas(session, "state_senate_district")
+
         cleanup()
 
         log.info("Finished")
@@ -1,9 +1,10 @@
 import logging
-from sqlalchemy.sql import select, func
+from sqlalchemy.sql import distinct, select
 
 from ..logging_config import setup_logging
 from ..database.models import Person, Area, PersonArea
-from ..database.database import get_session, upsert_dynamic
+from ..database.database import BatchUpserter, get_session
+from .area_subdivision import check_subdivided_areas, select_intersecting_area_ids
 
 log = logging.getLogger(__name__)
 
@@ -22,31 +23,38 @@ def connect_zip_codes(session):
 
     num_people = len(people)
 
+    # The intersections below only see subdivided areas, so a missing or stale subdivision would
+    # leave people without zip codes instead of failing
+    constituent_classifications = session.exec(
+        select(distinct(Area.classification)).where(Area.id.in_(select(Person.constituent_area_id)))
+    ).scalars().all()
+    check_subdivided_areas(session, ["zipcode", *constituent_classifications])
+
+    association_writer = BatchUpserter(session, PersonArea)
+
     for i, person in enumerate(people):
-        constituent_area = session.exec(
-            select(Area).where(Area.id == person.constituent_area_id)
+        constituent_area_id = session.exec(
+            select(Area.id).where(Area.id == person.constituent_area_id)
         ).scalars().one_or_none()
 
-        if not constituent_area:
+        if not constituent_area_id:
             raise RuntimeError(f"No constituent area found for {person.name}")
 
-        zip_code_areas = session.exec(
-            select(Area).where(
-                Area.classification == "zipcode",
-                func.ST_Intersects(Area.geometry, constituent_area.geometry)
-            )
+        # Intersect the subdivided pieces rather than the raw geometries - see area_subdivision.py
+        zip_code_area_ids = session.exec(
+            select_intersecting_area_ids(constituent_area_id, "zipcode")
         ).scalars().all()
 
-        log.info(f"Connecting person {person.name} to zip codes. {i}/{num_people}. Zip Codes: {len(zip_code_areas)}")
+        log.info(f"Connecting person {person.name} to zip codes. {i}/{num_people}. Zip Codes: {len(zip_code_area_ids)}")
 
-        for zip_area in zip_code_areas:
-            association = PersonArea(
+        for zip_area_id in zip_code_area_ids:
+            # Write to db
+            association_writer.add(dict(
                 person_id=person.id,
-                area_id=zip_area.id,
+                area_id=zip_area_id,
                 relationship_type="constituent_area_zip_code"
-            )
-            # Write to db
-            upsert_dynamic(session, association)
+            ))
+    association_writer.flush()
 
     session.commit()
     session.close()
@@ -1,4 +1,5 @@
 import logging
+import argparse
 import os
 import zipfile
 import json
@@ -7,9 +8,12 @@ import shapefile
 import shutil
 from sqlalchemy.sql import func, select
 
-from ..database.models import Area, Person, PersonArea
-from ..database.database import get_session, upsert_dynamic
+from ..database.database import get_session
 from ..logging_config import setup_logging
+from .area_simplification import build_simplified_areas
+from .area_subdivision import build_subdivided_areas
+from ..spatial_order import hilbert_order
+from .census_utils import area_writer, RELOAD_HELP
 
 log = logging.getLogger(__name__)
 
@@ -48,21 +52,28 @@ def download_zip_codes():
 
     sf = shapefile.Reader(shapefile_path)
 
-    num_records = len(sf.records())
+    records = sf.records()
+    num_records = len(records)
 
     log.info(f"Num records: {num_records}")
 
-    for i in range(num_records):
-        record = sf.record(i)
+    # Write spatially adjacent areas next to each other on disk - see spatial_order.py
+    spatial_order = hilbert_order(
+        [float(record[9]) for record in records],
+        [float(record[8]) for record in records]
+    )
+
+    for count, i in enumerate(spatial_order):
+        record = records[i]
         shape = sf.shape(i)
 
         zip_code = record[0]
 
-        if i % 100 == 0:
-            log.info(f"Finished {i} zip codes")
+        if count % 100 == 0:
+            log.info(f"Finished {count} zip codes")
 
         ocd_id = f"ocd-division/country:us/zipcode:{zip_code}"
-        yield Area(
+        yield dict(
             id=ocd_id,
             classification="zipcode",
             name=f"Zip Code {zip_code}",
@@ -85,14 +96,22 @@ def cleanup():
     shutil.rmtree(DATA_DIR)
 
 def main():
+    parser = argparse.ArgumentParser(description="Ingest zip codes")
+    parser.add_argument("--reload", action="store_true", help=RELOAD_HELP)
+    args = parser.parse_args()
     log.info("Ingesting zip codes")
 
     # Setup
     with get_session() as session:
         os.makedirs(DATA_DIR, exist_ok=True)
 
-        for area in download_zip_codes():
-            upsert_dynamic(session, area)
+        with area_writer(session, "zipcode", args.reload) as write_area:
+            for area in download_zip_codes():
+                write_area(area)
+
+        build_simplified_areas(session, "zipcode")
+
+        build_subdivided_areas(session, "zipcode")
 
         # cleanup()
 
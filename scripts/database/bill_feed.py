@@ -0,0 +1,53 @@
+"""
+Latest bills feed, newest latest_action_date first, for one jurisdiction.
+
+Pages are fetched with a keyset (the (latest_action_date, id) of the last row of the previous page)
+instead of OFFSET, so page 1000 costs the same as page 1: the ix_bills_feed index is walked backwards
+from the cursor and stops after limit rows. Only the feed columns are selected, never the wide JSONB ones.
+Bills without any actions have no latest_action_date and are not part of the feed.
+
+rows, cursor = get_bill_feed_page(session, "ocd-division/country:us/state:pa")
+rows, cursor = get_bill_feed_page(session, "ocd-division/country:us/state:pa", after=cursor)
+
+Rows come back as named tuples e.g. row.id, row.title
+
+ix_bills_feed is added to an existing bills table by the migrations (see migrations.py)
+"""
+import logging
+from sqlalchemy import tuple_
+from sqlalchemy.sql import select
+
+from .models import Bill
+
+log = logging.getLogger(__name__)
+
+FEED_PAGE_SIZE = 50
+
+BILL_FEED_COLUMNS = (
+    Bill.id,
+    Bill.canonical_id,
+    Bill.title,
+    Bill.legislative_session,
+    Bill.jurisdiction_level,
+    Bill.latest_action_date,
+    Bill.first_action_date,
+)
+
+
+def select_bill_feed(jurisdiction_area_id: str, limit: int = FEED_PAGE_SIZE, after: tuple = None):
+    """after is the (latest_action_date, id) cursor of the previous page"""
+    stmt = (
+        select(*BILL_FEED_COLUMNS)
+        # Same predicate as the partial index so the planner can use it
+        .where(Bill.jurisdiction_area_id == jurisdiction_area_id, Bill.latest_action_date.isnot(None))
+    )
+    if after is not None:
+        stmt = stmt.where(tuple_(Bill.latest_action_date, Bill.id) < tuple_(*after))
+    return stmt.order_by(Bill.latest_action_date.desc(), Bill.id.desc()).limit(limit)
+
+
+def get_bill_feed_page(session, jurisdiction_area_id: str, limit: int = FEED_PAGE_SIZE, after: tuple = None) -> tuple:
+    """Returns (rows, cursor for the next page). The cursor is None on the last page"""
+    rows = session.execute(select_bill_feed(jurisdiction_area_id, limit, after)).all()
+    cursor = (rows[-1].latest_action_date, rows[-1].id) if len(rows) == limit else None
+    return rows, cursor
@@ -0,0 +1,200 @@
+"""
+Benchmark for bill_feed.py: OFFSET paging over full Bill rows (what the feed used to do) vs keyset
+paging over the slim projection, at increasing page depths.
+
+The synthetic bills go into their own schema (bill_feed_benchmark) with the same tables and indexes as
+the real ones, so nothing in public is touched. The schema is dropped afterwards unless --keep is passed.
+
+Usage:
+python -m scripts.database.bill_feed_benchmark --rows 1000000
+"""
+import time
+import logging
+import argparse
+import statistics
+
+from sqlalchemy import text
+from sqlmodel import Session, SQLModel, select
+
+from .database import get_engine
+from .models import Area, Bill
+from .bill_feed import FEED_PAGE_SIZE, get_bill_feed_page
+from ..json_codec import dumps as json_dumps
+from ..logging_config import setup_logging
+
+log = logging.getLogger(__name__)
+
+BENCHMARK_SCHEMA = "bill_feed_benchmark"
+
+DEFAULT_ROWS = 1_000_000
+DEFAULT_JURISDICTIONS = 50
+DEFAULT_DEPTHS = [1, 10, 100, 1000]
+
+# Rows per insert statement when generating bills
+INSERT_BATCH_SIZE = 100_000
+
+# Timed runs per page, the median is reported
+REPEATS = 5
+
+# Share of bills without actions (no latest_action_date)
+NO_ACTIONS_RATE = 0.01
+
+# Stand in for the JSONB columns that make real bill rows wide
+SAMPLE_ACTIONS = [
+    {
+        "description": f"Referred to Committee on Appropriations and Budget, step {i}",
+        "date": "2024-03-01T00:00:00+00:00",
+        "classification": ["referral-committee"],
+        "organization_id": "~{\"classification\": \"lower\"}",
+        "related_entities": [],
+    }
+    for i in range(20)
+]
+
+
+def jurisdiction_area_id(i: int) -> str:
+    return f"ocd-division/country:us/state:benchmark{i}"
+
+
+def create_benchmark_tables(engine, num_rows: int, num_jurisdictions: int):
+    with engine.connect() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {BENCHMARK_SCHEMA} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {BENCHMARK_SCHEMA}"))
+        # schema_translate_map points the models' unqualified tables (and indexes) at the benchmark schema
+        conn = conn.execution_options(schema_translate_map={None: BENCHMARK_SCHEMA})
+        SQLModel.metadata.create_all(conn, tables=[Area.__table__, Bill.__table__])
+
+        conn.execute(text(f"""
+            INSERT INTO {BENCHMARK_SCHEMA}.areas
+                (id, classification, name, land_area, water_area, centroid_lat, centroid_lon, geometry)
+            SELECT 'ocd-division/country:us/state:benchmark' || i, 'state', 'Benchmark ' || i, 0, 0, 0, 0,
+                ST_GeomFromText('POINT(0 0)', 4326)
+            FROM generate_series(0, :num_jurisdictions - 1) i
+        """), {"num_jurisdictions": num_jurisdictions})
+
+        for start in range(0, num_rows, INSERT_BATCH_SIZE):
+            end = min(start + INSERT_BATCH_SIZE, num_rows)
+            conn.execute(text(f"""
+                INSERT INTO {BENCHMARK_SCHEMA}.bills (
+                    id, title, canonical_id, jurisdiction_area_id, jurisdiction_level, legislative_session,
+                    from_organization, classification, subject, abstracts, other_titles, other_identifiers,
+                    actions, sponsorships, related_bills, versions, documents, citations, sources, extras,
+                    latest_action_date, first_action_date, updated_at
+                )
+                SELECT
+                    'ocd-bill/' || md5(i::text),
+                    'An act relating to ' || md5(i::text),
+                    'HB ' || i,
+                    'ocd-division/country:us/state:benchmark' || (i % :num_jurisdictions),
+                    'state',
+                    '2024',
+                    '{{"classification": "lower"}}', '["bill"]', '[]', '[]', '[]', '[]',
+                    CAST(:actions AS JSONB), '[]', '[]', '[]', '[]', '[]', '[]', '{{}}',
+                    CASE WHEN random() < :no_actions_rate THEN NULL
+                        ELSE TIMESTAMP '2020-01-01' + random() * INTERVAL '1500 days' END,
+                    TIMESTAMP '2020-01-01',
+                    now()
+                FROM generate_series(:start, :end - 1) i
+            """), {
+                "num_jurisdictions": num_jurisdictions,
+                "actions": json_dumps(SAMPLE_ACTIONS),
+                "no_actions_rate": NO_ACTIONS_RATE,
+                "start": start,
+                "end": end,
+            })
+            conn.commit()
+            log.info(f"Inserted {end} / {num_rows} bills")
+
+    # Index only scans need the visibility map, which VACUUM sets. Can't run inside a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"VACUUM ANALYZE {BENCHMARK_SCHEMA}.bills"))
+
+
+def _median_seconds(fn) -> float:
+    timings = []
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def _feed_order(stmt, jurisdiction_id):
+    return (
+        stmt.where(Bill.jurisdiction_area_id == jurisdiction_id, Bill.latest_action_date.isnot(None))
+        .order_by(Bill.latest_action_date.desc(), Bill.id.desc())
+    )
+
+
+def run_benchmark(engine, depths: list, jurisdiction_id: str) -> list:
+    results = []
+    with engine.connect() as conn:
+        conn = conn.execution_options(schema_translate_map={None: BENCHMARK_SCHEMA})
+        with Session(bind=conn) as session:
+            for depth in depths:
+                offset = (depth - 1) * FEED_PAGE_SIZE
+
+                def offset_page():
+                    return session.exec(
+                        _feed_order(select(Bill), jurisdiction_id).offset(offset).limit(FEED_PAGE_SIZE)
+                    ).all()
+
+                # Cursor of the page before, as if the reader had paged down to here
+                cursor = None
+                if offset:
+                    previous = session.exec(
+                        _feed_order(select(Bill.latest_action_date, Bill.id), jurisdiction_id)
+                        .offset(offset - 1).limit(1)
+                    ).one_or_none()
+                    if previous is None:
+                        log.info(f"Page {depth} is past the end of the feed, stopping")
+                        break
+                    cursor = tuple(previous)
+
+                def keyset_page():
+                    return get_bill_feed_page(session, jurisdiction_id, FEED_PAGE_SIZE, after=cursor)
+
+                # Both must return the same bills
+                offset_ids = [bill.id for bill in offset_page()]
+                keyset_ids = [row.id for row in keyset_page()[0]]
+                if offset_ids != keyset_ids:
+                    raise RuntimeError(f"Keyset page {depth} doesn't match the offset page")
+
+                session.expunge_all()
+                results.append({
+                    "page": depth,
+                    "offset_ms": _median_seconds(offset_page) * 1000,
+                    "keyset_ms": _median_seconds(keyset_page) * 1000,
+                })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offset vs keyset paging of the bill feed")
+    parser.add_argument("--rows", type=int, default=DEFAULT_ROWS)
+    parser.add_argument("--jurisdictions", type=int, default=DEFAULT_JURISDICTIONS)
+    parser.add_argument("--depths", type=str, default=",".join(str(depth) for depth in DEFAULT_DEPTHS),
+                        help="Comma separated page numbers to time")
+    parser.add_argument("--keep", action="store_true", help=f"Don't drop the {BENCHMARK_SCHEMA} schema afterwards")
+    args = parser.parse_args()
+
+    engine = get_engine()
+    try:
+        create_benchmark_tables(engine, args.rows, args.jurisdictions)
+        results = run_benchmark(engine, [int(depth) for depth in args.depths.split(",")], jurisdiction_area_id(0))
+
+        log.info(f"{args.rows} bills, {args.jurisdictions} jurisdictions, {FEED_PAGE_SIZE} bills per page")
+        log.info(f"{'page':>6} {'offset ms':>10} {'keyset ms':>10}")
+        for result in results:
+            log.info(f"{result['page']:>6} {result['offset_ms']:>10.2f} {result['keyset_ms']:>10.2f}")
+    finally:
+        if not args.keep:
+            with engine.connect() as conn:
+                conn.execute(text(f"DROP SCHEMA IF EXISTS {BENCHMARK_SCHEMA} CASCADE"))
+                conn.commit()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    main()
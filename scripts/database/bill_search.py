@@ -0,0 +1,61 @@
+"""
+Keyword search over bills using the generated Bill.search_vector column and its GIN index, instead of
+ILIKE over title and the abstracts / other_titles JSONB (a sequential scan).
+
+The query is parsed with websearch_to_tsquery so the usual search box syntax works:
+"school funding" -charter or "tax credit"
+
+Results are ranked with ts_rank_cd (title matches weigh the most) and paged with a (rank, id) keyset:
+
+rows, cursor = search_bills(session, "school funding", "ocd-division/country:us/state:pa")
+rows, cursor = search_bills(session, "school funding", "ocd-division/country:us/state:pa", after=cursor)
+
+Rows come back as named tuples e.g. row.id, row.title, row.rank
+
+search_vector and its index are added to an existing bills table by the migrations (see migrations.py)
+"""
+import logging
+from sqlalchemy import func, literal_column, tuple_
+from sqlalchemy.sql import select
+
+from .models import BILL_SEARCH_VECTOR_SQL, Bill
+
+log = logging.getLogger(__name__)
+
+SEARCH_PAGE_SIZE = 50
+
+SEARCH_CONFIG = "english"
+
+
+def select_bill_search(query: str, jurisdiction_area_id: str = None, limit: int = SEARCH_PAGE_SIZE,
+                       after: tuple = None):
+    """after is the (rank, id) cursor of the previous page"""
+    ts_query = func.websearch_to_tsquery(literal_column(f"'{SEARCH_CONFIG}'"), query)
+    rank = func.ts_rank_cd(Bill.search_vector, ts_query)
+
+    stmt = (
+        select(
+            Bill.id,
+            Bill.canonical_id,
+            Bill.title,
+            Bill.jurisdiction_area_id,
+            Bill.legislative_session,
+            Bill.latest_action_date,
+            rank.label("rank"),
+        )
+        # @@ is what the GIN index answers, ranking only happens for the matching bills
+        .where(Bill.search_vector.op("@@")(ts_query))
+    )
+    if jurisdiction_area_id:
+        stmt = stmt.where(Bill.jurisdiction_area_id == jurisdiction_area_id)
+    if after is not None:
+        stmt = stmt.where(tuple_(rank, Bill.id) < tuple_(*after))
+    return stmt.order_by(rank.desc(), Bill.id.desc()).limit(limit)
+
+
+def search_bills(session, query: str, jurisdiction_area_id: str = None, limit: int = SEARCH_PAGE_SIZE,
+                 after: tuple = None) -> tuple:
+    """Returns (rows, cursor for the next page). The cursor is None on the last page"""
+    rows = session.execute(select_bill_search(query, jurisdiction_area_id, limit, after)).all()
+    cursor = (rows[-1].rank, rows[-1].id) if len(rows) == limit else None
+    return rows, cursor
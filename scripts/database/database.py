@@ -8,6 +8,9 @@ from dotenv import load_dotenv
 from urllib.parse import quote
 import os
 
+from ..json_codec import dumps as json_dumps, loads as json_loads
+from .migrations import migrate
+
 log = logging.getLogger(__name__)
 
 # Load dotenv variables
@@ -27,21 +30,42 @@ connection_params = {
     'database': 'repcheck'
 }
 
-def get_engine():
+# Rows per statement for the batched upserts
+UPSERT_BATCH_SIZE = 200
+
+# Existing tables only need to be migrated once per process, not for every engine
+_migrated = False
+
+
+def get_engine(pool_size: int = 5):
     # Create an engine using SQLModel
     database_url = (
         f"postgresql+psycopg2://{connection_params['username']}:{connection_params['password']}"
         f"@{connection_params['host']}:{connection_params['port']}/{connection_params['database']}"
     )
-    engine = create_engine(database_url)
+    # JSONB columns are (de)serialized with the fast codec
+    # pool_size only matters when sessions are used from several threads (e.g. bills_batch)
+    engine = create_engine(
+        database_url,
+        json_serializer=json_dumps,
+        json_deserializer=json_loads,
+        pool_size=pool_size,
+        pool_pre_ping=True
+    )
     # Ensure all tables exist!
     SQLModel.metadata.create_all(engine)
+    # And have the columns / indexes added to them since they were created, see migrations.py
+    global _migrated
+    if not _migrated:
+        migrate(engine)
+        _migrated = True
     return engine
 
 
 @contextmanager
-def get_session():
-    engine = get_engine()
+def get_session(engine=None):
+    # Pass an engine to share its connection pool between sessions
+    engine = engine or get_engine()
     session = Session(engine)
     try:
         yield session
@@ -61,9 +85,10 @@ def upsert_dynamic(session, data):
     # Prepare the insert statement
     stmt = insert(model).values(data)
 
-    # Automatically exclude primary keys from the `SET` clause
+    # Automatically exclude primary keys (and generated columns, which postgres computes) from the `SET` clause
     update_fields = {col.name: getattr(stmt.excluded, col.name)
-                     for col in mapper.columns if col.name not in primary_keys and col.name != "created_at"}
+                     for col in mapper.columns
+                     if col.name not in primary_keys and col.name != "created_at" and col.computed is None}
 
     stmt = stmt.on_conflict_do_update(
         index_elements=primary_keys,
@@ -71,3 +96,104 @@ def upsert_dynamic(session, data):
     )
     session.execute(stmt)
     session.commit()
+
+
+# Column names and required (non nullable, no default) columns per model - see check_rows
+_row_schemas = {}
+
+
+def _row_schema(model):
+    if model not in _row_schemas:
+        columns = set()
+        required = set()
+        for column in model.__table__.columns:
+            if column.computed is not None:
+                continue
+            columns.add(column.name)
+            if not column.nullable and column.default is None and column.server_default is None \
+                    and column.autoincrement is not True:
+                required.add(column.name)
+        _row_schemas[model] = (columns, required)
+    return _row_schemas[model]
+
+
+def check_rows(model, rows):
+    """
+    Stand in for model validation when loaders write plain row dicts: every row has the same keys (a multi
+    row insert needs that anyway), all of them are columns of the model and no required column is missing.
+    Checks the keys once per batch, not the values of every row
+    """
+    columns, required = _row_schema(model)
+    keys = rows[0].keys()
+    unknown = keys - columns
+    missing = required - keys
+    if unknown or missing:
+        raise RuntimeError(f"Bad {model.__tablename__} rows - unknown columns: {sorted(unknown)}, missing: {sorted(missing)}")
+    for row in rows:
+        if row.keys() != keys:
+            raise RuntimeError(f"{model.__tablename__} rows have different columns: {sorted(keys ^ row.keys())}")
+
+
+# Same as upsert_dynamic but for a batch of plain dicts of column values in a single statement, which skips
+# building model instances. This is what the loaders use, upsert_dynamic is for the odd one off model instance
+def deduplicate_rows(model, rows) -> list:
+    """Keeps the last row for each primary key, like upserting the rows one at a time would"""
+    primary_keys = [key.name for key in inspect(model).primary_key]
+    deduplicated_rows = {}
+    for row in rows:
+        deduplicated_rows[tuple(row[key] for key in primary_keys)] = row
+    return list(deduplicated_rows.values())
+
+
+def upsert_rows(session, model, rows):
+    if not rows:
+        return
+    check_rows(model, rows)
+
+    mapper = inspect(model)
+    primary_keys = [key.name for key in mapper.primary_key]
+
+    # Postgres refuses to update the same row twice in one statement
+    stmt = insert(model).values(deduplicate_rows(model, rows))
+
+    # Generated columns (e.g. Bill.search_vector) can't be set, postgres recomputes them
+    update_fields = {col.name: getattr(stmt.excluded, col.name)
+                     for col in mapper.columns
+                     if col.name not in primary_keys and col.name != "created_at" and col.computed is None}
+
+    stmt = stmt.on_conflict_do_update(
+        index_elements=primary_keys,
+        set_=update_fields,
+    )
+    session.execute(stmt)
+    session.commit()
+
+
+class BatchUpserter:
+    """
+    Collects row dicts for a model and upserts them UPSERT_BATCH_SIZE at a time.
+    on_flush is called with each batch once it has been committed, e.g. to write rows derived from it
+    """
+
+    def __init__(self, session, model, batch_size=UPSERT_BATCH_SIZE, on_flush=None):
+        self.session = session
+        self.model = model
+        self.batch_size = batch_size
+        self.on_flush = on_flush
+        self.rows = []
+        self.count = 0
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        # Two files for the same key in one batch (e.g. a re-scraped vote event) - the last one wins, and
+        # on_flush sees the same rows that were written so it doesn't derive rows from both
+        rows = deduplicate_rows(self.model, self.rows)
+        upsert_rows(self.session, self.model, rows)
+        if self.on_flush is not None and rows:
+            self.on_flush(rows)
+        self.count += len(rows)
+        self.rows = []
@@ -0,0 +1,81 @@
+"""
+Brings an existing database up to date with the models. create_all only creates missing tables, so
+columns and indexes that were added to a model after its table was created are added here.
+
+Every step looks in the catalog first and only runs its DDL (which locks the table) when something is
+missing, so against an up to date database this is a few cheap queries. get_engine runs it once per
+process, it can also be run by hand before a deploy:
+
+python -m scripts.database.migrations
+
+Adding a stored generated column (bills.search_vector) rewrites the table, so expect the first run
+against a big bills table to take a while.
+"""
+import logging
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+
+from .models import Bill, VoteEvent
+from ..logging_config import setup_logging
+
+log = logging.getLogger(__name__)
+
+# Columns added to models after their tables were first created - (model, column name)
+ADDED_COLUMNS = [
+    (VoteEvent, "vote_option_codes"),
+    (VoteEvent, "vote_voter_ids"),
+    (VoteEvent, "vote_voter_names"),
+    (Bill, "search_vector"),
+]
+
+# Indexes added to models after their tables were first created - (model, index name). Built after the
+# columns above since they can depend on them
+ADDED_INDEXES = [
+    (Bill, "ix_bills_feed"),
+    (Bill, "ix_bills_search_vector"),
+]
+
+
+def _model_index(model, index_name: str):
+    for index in model.__table__.indexes:
+        if index.name == index_name:
+            return index
+    raise RuntimeError(f"{model.__tablename__} has no index {index_name}")
+
+
+def migrate(engine):
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        existing_columns = {}
+        for model, column_name in ADDED_COLUMNS:
+            table_name = model.__tablename__
+            if table_name not in existing_columns:
+                existing_columns[table_name] = {column["name"] for column in inspector.get_columns(table_name)}
+            if column_name in existing_columns[table_name]:
+                continue
+
+            # Renders the type and, for generated columns, the GENERATED ALWAYS AS clause from the model
+            column_ddl = CreateColumn(model.__table__.c[column_name]).compile(dialect=engine.dialect)
+            log.info(f"Adding column {table_name}.{column_name}")
+            conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS {column_ddl}"))
+
+        for model, index_name in ADDED_INDEXES:
+            table_name = model.__tablename__
+            if index_name in {index["name"] for index in inspector.get_indexes(table_name)}:
+                continue
+            log.info(f"Creating index {index_name} on {table_name}")
+            _model_index(model, index_name).create(conn)
+
+
+def main():
+    from .database import get_engine
+
+    # get_engine migrates
+    engine = get_engine()
+    engine.dispose()
+    log.info("Finished")
+
+
+if __name__ == "__main__":
+    setup_logging()
+    main()
@@ -1,8 +1,9 @@
 from sqlmodel import SQLModel, Field, Relationship
 from geoalchemy2 import Geometry
 from datetime import datetime, timezone
-from sqlalchemy import Column, ARRAY, Text, BigInteger, DOUBLE_PRECISION, DateTime, text
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import Column, ARRAY, Text, BigInteger, SmallInteger, DOUBLE_PRECISION, DateTime, Computed, Index, text
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
+from sqlalchemy.orm import deferred
 from typing import List, Optional, Dict
 
 class PersonArea(SQLModel, table=True):
@@ -13,6 +14,13 @@ class PersonArea(SQLModel, table=True):
     relationship_type: str # For ex: constituent_zip_code
 
 
+# Geometry columns are deferred so that select(Area) etc. doesn't pull (potentially multi-megabyte)
+# geometries over the wire unless they are accessed or explicitly undeferred.
+# See projections.py for attribute only queries
+_area_geometry_column = Column("geometry", Geometry("GEOMETRY", srid=4326), nullable=False)
+_precinct_geometry_column = Column("geometry", Geometry("GEOMETRY", srid=4326), nullable=False)
+
+
 class Area(SQLModel, table=True):
     __tablename__ = 'areas'
 
@@ -33,11 +41,37 @@ class Area(SQLModel, table=True):
     water_area: int = Field(sa_column=Column(BigInteger()))
     centroid_lat: float = Field(sa_column=Column(DOUBLE_PRECISION()))
     centroid_lon: float = Field(sa_column=Column(DOUBLE_PRECISION()))
+    geometry: Geometry = Field(sa_column=_area_geometry_column)
+
+    __mapper_args__ = {"properties": {"geometry": deferred(_area_geometry_column)}}
+
+    class Config:
+        arbitrary_types_allowed = True
+
+class AreaSimplified(SQLModel, table=True):
+    __tablename__ = "area_simplified"
+
+    # Lower resolution copies of Area.geometry for map views that don't need full TIGER detail
+    area_id: str = Field(foreign_key="areas.id", primary_key=True)
+    tolerance: float = Field(sa_column=Column(DOUBLE_PRECISION(), primary_key=True)) # degrees
     geometry: Geometry = Field(sa_column=Column(Geometry("GEOMETRY", srid=4326), nullable=False))
 
     class Config:
         arbitrary_types_allowed = True
 
+class AreaSubdivided(SQLModel, table=True):
+    __tablename__ = "area_subdivided"
+
+    # Area.geometry cut into pieces of at most N vertices (ST_Subdivide) so that
+    # intersection queries get useful bounding boxes and short exact tests
+    id: Optional[int] = Field(default=None, sa_column=Column(BigInteger(), primary_key=True, autoincrement=True))
+    area_id: str = Field(foreign_key="areas.id", index=True)
+    classification: str = Field(index=True)
+    geometry: Geometry = Field(sa_column=Column(Geometry("GEOMETRY", srid=4326, spatial_index=True), nullable=False))
+
+    class Config:
+        arbitrary_types_allowed = True
+
 class PrecinctElectionResultArea(SQLModel, table=True):
     __tablename__ = "precinct_election_result_area"
     precinct_id: str = Field(primary_key=True, nullable=False)
@@ -47,10 +81,12 @@ class PrecinctElectionResultArea(SQLModel, table=True):
     votes_total: int = Field(sa_column=Column(BigInteger()))
     pct_dem_lead: float = Field(sa_column=Column(DOUBLE_PRECISION()))
     official_boundary: Optional[bool]
-    geometry: Geometry = Field(sa_column=Column(Geometry("GEOMETRY", srid=4326), nullable=False))
+    geometry: Geometry = Field(sa_column=_precinct_geometry_column)
     centroid_lat: float = Field(sa_column=Column(DOUBLE_PRECISION()))
     centroid_lon: float = Field(sa_column=Column(DOUBLE_PRECISION()))
 
+    __mapper_args__ = {"properties": {"geometry": deferred(_precinct_geometry_column)}}
+
     class Config:
         arbitrary_types_allowed = True
 
@@ -73,6 +109,16 @@ class Person(SQLModel, table=True):
     sources: Optional[List[Dict]] = Field(default=None, sa_column=Column(JSONB))
 
 
+# Weighted full text search document for bills, kept up to date by postgres on every insert / update
+# (see scripts/database/bill_search.py). Title matches rank above abstracts, which rank above other titles
+BILL_SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(jsonb_to_tsvector('english', jsonb_path_query_array(coalesce(abstracts, '[]'), '$[*].abstract'), '[\"string\"]'), 'B') || "
+    "setweight(jsonb_to_tsvector('english', jsonb_path_query_array(coalesce(other_titles, '[]'), '$[*].title'), '[\"string\"]'), 'C')"
+)
+_bill_search_vector_column = Column("search_vector", TSVECTOR, Computed(BILL_SEARCH_VECTOR_SQL, persisted=True))
+
+
 class Bill(SQLModel, table=True):
     __tablename__ = 'bills'
 
@@ -102,6 +148,23 @@ class Bill(SQLModel, table=True):
     updated_at: datetime = Field(default=None, sa_column=Column(DateTime))
     created_at: datetime = Field(sa_column_kwargs={"server_default": text("CURRENT_TIMESTAMP")})
     jurisdiction_level: str
+    search_vector: Optional[str] = Field(default=None, sa_column=_bill_search_vector_column)
+
+    # Only needed by searches, which use it in sql
+    __mapper_args__ = {"properties": {"search_vector": deferred(_bill_search_vector_column)}}
+
+    __table_args__ = (
+        # Latest bills feed (see scripts/database/bill_feed.py). The feed's small columns ride along in
+        # INCLUDE. title is left out since a long one would go over the btree row size limit, it is read
+        # from the heap for just the rows on the page (the wide JSONB columns never are)
+        Index(
+            "ix_bills_feed",
+            "jurisdiction_area_id", "latest_action_date", "id",
+            postgresql_include=["canonical_id", "legislative_session", "first_action_date", "jurisdiction_level"],
+            postgresql_where=text("latest_action_date IS NOT NULL"),
+        ),
+        Index("ix_bills_search_vector", "search_vector", postgresql_using="gin"),
+    )
 
 
 class VoteEvent(SQLModel, table=True):
@@ -121,3 +184,81 @@ class VoteEvent(SQLModel, table=True):
     sources: List[Dict] = Field(default=None, sa_column=Column(JSONB))
     extras: Dict = Field(default=None, sa_column=Column(JSONB))
 
+    # Optional compact form of votes (which is then NULL), see scripts/database/vote_codec.py
+    vote_option_codes: Optional[List[int]] = Field(default=None, sa_column=Column(ARRAY(SmallInteger)))
+    vote_voter_ids: Optional[List[str]] = Field(default=None, sa_column=Column(ARRAY(Text)))
+    vote_voter_names: Optional[List[str]] = Field(default=None, sa_column=Column(ARRAY(Text)))
+
+
+class VoteCast(SQLModel, table=True):
+    __tablename__ = "vote_cast"
+
+    # One row per matched voter in VoteEvent.votes so that voting records are an index range scan
+    # instead of unnesting every vote event. Written by the bill loaders, see scripts/bills/vote_casts.py
+    vote_event_id: str = Field(foreign_key="vote_events.id", primary_key=True)
+    person_id: str = Field(foreign_key="people.id", primary_key=True)
+    option: str # yes, no, not voting, ...
+    bill_id: str = Field(foreign_key="bills.id", nullable=False)
+    start_date: datetime
+
+    __table_args__ = (
+        Index("ix_vote_cast_person_id_start_date", "person_id", "start_date"),
+        Index("ix_vote_cast_bill_id", "bill_id"),
+    )
+
+
+class BillSponsor(SQLModel, table=True):
+    __tablename__ = "bill_sponsor"
+
+    # Bill.sponsorships resolved to people, written by the bill loaders. See scripts/bills/bill_sponsors.py
+    bill_id: str = Field(foreign_key="bills.id", primary_key=True)
+    person_id: str = Field(foreign_key="people.id", primary_key=True, index=True)
+    classification: str = Field(primary_key=True) # primary, cosponsor, ... "" if the scraper has none
+    primary: bool
+
+
+class PersonVoteStats(SQLModel, table=True):
+    __tablename__ = "person_vote_stats"
+
+    # Aggregates of a person's vote_cast rows for profile pages, refreshed by the bill loaders for the
+    # people whose votes changed. See scripts/bills/vote_stats.py
+    person_id: str = Field(foreign_key="people.id", primary_key=True)
+    total_votes: int
+    yes_count: int
+    no_count: int
+    missed_count: int # absent, not voting, excused
+    other_count: int # abstain, paired, ...
+    missed_vote_rate: float = Field(sa_column=Column(DOUBLE_PRECISION()))
+    # legislative session -> {"total": .., "yes": .., "no": .., "missed": .., "other": ..}
+    sessions: Dict = Field(default=None, sa_column=Column(JSONB))
+    first_vote_date: Optional[datetime] = Field(default=None, sa_column=Column(DateTime))
+    last_vote_date: Optional[datetime] = Field(default=None, sa_column=Column(DateTime))
+    updated_at: datetime = Field(default=None, sa_column=Column(DateTime))
+
+
+class IngestManifest(SQLModel, table=True):
+    __tablename__ = "ingest_manifest"
+
+    # One row per scraper output file that has been ingested, so re-runs can skip files that haven't changed.
+    # See scripts/bills/ingest_manifest.py
+    path: str = Field(primary_key=True, nullable=False)
+    size: int = Field(sa_column=Column(BigInteger()))
+    mtime: float = Field(sa_column=Column(DOUBLE_PRECISION()))
+    content_hash: str
+    derived_id: str # id of the row the file was ingested into e.g. the bill id
+    roster_version: Optional[str] = None # people roster the file's names were matched against, if any
+    updated_at: datetime = Field(default=None, sa_column=Column(DateTime))
+
+
+class VoterNameResolution(SQLModel, table=True):
+    __tablename__ = "voter_name_resolution"
+
+    # Cache of voter name -> person matches (see scripts/bills/vote_matching.py). roster_version is a hash
+    # of the jurisdiction's roster so entries stop being used as soon as the people in it change
+    jurisdiction_area_id: str = Field(foreign_key="areas.id", primary_key=True)
+    chamber: str = Field(primary_key=True) # vote chamber e.g. lower, "" if unknown
+    voter_name: str = Field(primary_key=True)
+    roster_version: str = Field(primary_key=True)
+    person_id: Optional[str] = None # best candidate, even if its score is under the match threshold
+    score: float = Field(sa_column=Column(DOUBLE_PRECISION()))
+    created_at: datetime = Field(sa_column_kwargs={"server_default": text("CURRENT_TIMESTAMP")})
@@ -0,0 +1,61 @@
+"""
+Attribute only queries for the geometry tables. Geometries are deferred on the models
+but these skip the ORM entirely for code that only needs ids, names and centroids.
+
+Rows come back as named tuples e.g. row.id, row.centroid_lat
+"""
+from sqlalchemy.sql import select
+
+from .models import Area, PrecinctElectionResultArea
+
+AREA_SUMMARY_COLUMNS = (
+    Area.id,
+    Area.classification,
+    Area.name,
+    Area.abbrev,
+    Area.fips_code,
+    Area.district_number,
+    Area.centroid_lat,
+    Area.centroid_lon,
+)
+
+PRECINCT_SUMMARY_COLUMNS = (
+    PrecinctElectionResultArea.precinct_id,
+    PrecinctElectionResultArea.state,
+    PrecinctElectionResultArea.votes_dem,
+    PrecinctElectionResultArea.votes_rep,
+    PrecinctElectionResultArea.votes_total,
+    PrecinctElectionResultArea.pct_dem_lead,
+    PrecinctElectionResultArea.centroid_lat,
+    PrecinctElectionResultArea.centroid_lon,
+)
+
+
+def select_area_summaries(area_ids: list = None, classification: str = None):
+    stmt = select(*AREA_SUMMARY_COLUMNS)
+    if area_ids is not None:
+        stmt = stmt.where(Area.id.in_(area_ids))
+    if classification:
+        stmt = stmt.where(Area.classification == classification)
+    return stmt
+
+
+def get_area_summaries(session, area_ids: list = None, classification: str = None) -> list:
+    return session.execute(select_area_summaries(area_ids, classification)).all()
+
+
+def get_area_summary(session, area_id: str):
+    return session.execute(
+        select(*AREA_SUMMARY_COLUMNS).where(Area.id == area_id)
+    ).one_or_none()
+
+
+def select_precinct_summaries(state: str = None):
+    stmt = select(*PRECINCT_SUMMARY_COLUMNS)
+    if state:
+        stmt = stmt.where(PrecinctElectionResultArea.state == state)
+    return stmt
+
+
+def get_precinct_summaries(session, state: str = None) -> list:
+    return session.execute(select_precinct_summaries(state)).all()
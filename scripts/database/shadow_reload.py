@@ -0,0 +1,401 @@
+"""
+Zero downtime full reloads. Instead of upserting in place for hours (readers see a mix of
+old and new rows, and the table is bloated afterwards) we:
+
+1. Create an empty <table>_shadow with the same columns but no indexes or keys
+2. Bulk insert the new rows into the shadow table at full speed
+3. Check the row counts look sane
+4. Copy over any rows that are not part of the reload (e.g. other area classifications), still
+   without indexes
+5. Build the primary key and indexes once, at the end
+6. Swap the shadow table in for the real one in a single transaction. Under the lock only the kept
+   rows written since step 4 are caught up, rows of derived tables (e.g. area_simplified) that point
+   at keys the reload dropped are deleted, and the swap is refused if any other table still points
+   at them. Foreign keys from other tables are validated after the lock is released
+
+Tables with serial / identity columns are not supported since the sequence is owned by
+the original table and is dropped with it.
+"""
+import re
+import hashlib
+import logging
+from contextlib import contextmanager
+
+from sqlalchemy import Column, MetaData, and_, exists, func, not_, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql.visitors import replacement_traverse
+from sqlmodel import inspect
+
+from .database import check_rows
+
+log = logging.getLogger(__name__)
+
+SHADOW_SUFFIX = "_shadow"
+
+# Postgres silently truncates longer identifiers
+MAX_IDENTIFIER_LENGTH = 63
+
+# Rows per insert statement into the shadow table
+SHADOW_BATCH_SIZE = 500
+
+# Refuse to swap if the reload would shrink the reloaded rows below this fraction of what is there now
+MIN_ROW_RATIO = 0.9
+
+
+def shadow_object_name(name: str) -> str:
+    """
+    Name of the shadow copy of a table, index or constraint. Names that would go over the identifier
+    limit are shortened with a hash of the full name so two long names can't end up the same
+    """
+    shadow_name = f"{name}{SHADOW_SUFFIX}"
+    if len(shadow_name) <= MAX_IDENTIFIER_LENGTH:
+        return shadow_name
+    digest = hashlib.md5(name.encode()).hexdigest()[:8]
+    return f"{name[:MAX_IDENTIFIER_LENGTH - len(SHADOW_SUFFIX) - len(digest) - 1]}_{digest}{SHADOW_SUFFIX}"
+
+
+def shadow_table_name(model) -> str:
+    return shadow_object_name(model.__tablename__)
+
+
+_shadow_metadata = MetaData()
+
+
+def get_shadow_table(model):
+    """SQLAlchemy Table for the shadow copy - only used to build statements, never to create it"""
+    shadow_name = shadow_table_name(model)
+    if shadow_name in _shadow_metadata.tables:
+        return _shadow_metadata.tables[shadow_name]
+    return model.__table__.to_metadata(_shadow_metadata, name=shadow_name)
+
+
+def _adapt_to_shadow(model, expression):
+    # Point an expression on the real table (e.g. Area.classification == "zipcode") at the shadow table
+    shadow = get_shadow_table(model)
+
+    def replace(element):
+        if isinstance(element, Column) and element.table is model.__table__:
+            return shadow.c[element.name]
+        return None
+
+    return replacement_traverse(expression, {}, replace)
+
+
+def create_shadow_table(session, model):
+    """Creates an empty shadow copy of the model's table"""
+    table_name = model.__tablename__
+    shadow_name = shadow_table_name(model)
+    log.info(f"Creating shadow table {shadow_name}")
+
+    session.execute(text(f"DROP TABLE IF EXISTS {shadow_name}"))
+    # No INCLUDING INDEXES - indexes and keys are built after the load
+    session.execute(text(f"CREATE TABLE {shadow_name} (LIKE {table_name} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED)"))
+    session.commit()
+
+
+def _key_match(model, table, other_table):
+    return and_(*[table.c[key.name] == other_table.c[key.name] for key in inspect(model).primary_key])
+
+
+def _copy_kept_rows(session, model, replace_where) -> int:
+    """
+    Copies the rows that aren't being reloaded into the shadow table as they are right now. A loaded row
+    with the same key wins, like it would with an upsert. Generated columns are computed again on insert.
+    Returns the oldest transaction id that wasn't visible to the copy, rows written by that transaction
+    or a later one are caught up in _catch_up_kept_rows
+    """
+    table = model.__table__
+    shadow = get_shadow_table(model)
+    columns = [column.name for column in table.columns if column.computed is None]
+
+    copy_xid = session.execute(text("SELECT txid_snapshot_xmin(txid_current_snapshot())")).scalar()
+    result = session.execute(
+        insert(shadow).from_select(
+            columns,
+            select(*[table.c[column] for column in columns])
+            .where(not_(replace_where), ~exists().where(_key_match(model, shadow, table)))
+        )
+    )
+    session.commit()
+    log.info(f"Copied {result.rowcount} rows that weren't reloaded into {shadow_table_name(model)}")
+    return copy_xid
+
+
+def _catch_up_kept_rows(session, model, replace_where, copy_xid: int):
+    # Runs under the swap lock. Rows whose xmin (the transaction that wrote this version of the row) is
+    # copy_xid or newer changed since the copy. age() compares the 32 bit xids safely across wraparound
+    table = model.__table__
+    table_name = model.__tablename__
+    shadow = get_shadow_table(model)
+    primary_keys = [key.name for key in inspect(model).primary_key]
+    columns = [column.name for column in table.columns if column.computed is None]
+
+    stmt = insert(shadow).from_select(
+        columns,
+        select(*[table.c[column] for column in columns]).where(
+            not_(replace_where),
+            text(f"age({table_name}.xmin) <= age(CAST(:copy_xid AS xid))").bindparams(copy_xid=str(copy_xid % 2 ** 32))
+        )
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=primary_keys,
+        set_={column: stmt.excluded[column] for column in columns if column not in primary_keys},
+        # Loaded rows still win
+        where=not_(_adapt_to_shadow(model, replace_where))
+    )
+    changed = session.execute(stmt).rowcount
+
+    # Kept rows deleted since the copy
+    deleted = session.execute(
+        shadow.delete().where(
+            not_(_adapt_to_shadow(model, replace_where)),
+            ~exists().where(_key_match(model, table, shadow))
+        )
+    ).rowcount
+    log.info(f"Caught up {changed} changed and {deleted} deleted rows that weren't reloaded")
+
+
+def insert_shadow_rows(session, model, instances):
+    """instances are row dicts (see database.check_rows) or model instances"""
+    if not instances:
+        return
+    rows = [
+        instance if isinstance(instance, dict) else instance.dict(exclude_unset=True, exclude={"created_at"})
+        for instance in instances
+    ]
+    check_rows(model, rows)
+    session.execute(insert(get_shadow_table(model)).values(rows))
+    session.commit()
+
+
+def drop_shadow_table(session, model):
+    session.rollback()
+    session.execute(text(f"DROP TABLE IF EXISTS {shadow_table_name(model)}"))
+    session.commit()
+
+
+def _remove_duplicate_keys(session, model):
+    # The loaders have upsert semantics (last write wins) but the shadow table has no primary
+    # key to conflict on yet, so keep only the most recently inserted row for each key
+    shadow_name = shadow_table_name(model)
+    primary_keys = [key.name for key in inspect(model).primary_key]
+    key_match = " AND ".join(f"a.{key} = b.{key}" for key in primary_keys)
+    result = session.execute(text(
+        f"DELETE FROM {shadow_name} a USING {shadow_name} b WHERE {key_match} AND a.ctid < b.ctid"
+    ))
+    if result.rowcount:
+        log.warning(f"Removed {result.rowcount} duplicate rows from {shadow_name}")
+
+
+def _build_keys_and_indexes(session, model) -> dict:
+    """Returns shadow index / constraint name -> the name it takes over after the swap"""
+    table_name = model.__tablename__
+    shadow_name = shadow_table_name(model)
+
+    # Primary key / unique constraints (which bring their own index) and foreign keys
+    constraints = session.execute(text(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = CAST(:table_name AS regclass) AND contype IN ('p', 'u', 'f')"
+    ), {"table_name": table_name}).all()
+    shadow_constraints = {}
+    for constraint_name, definition in constraints:
+        log.info(f"Adding constraint {constraint_name} to {shadow_name}")
+        shadow_constraint_name = shadow_object_name(constraint_name)
+        session.execute(text(
+            f"ALTER TABLE {shadow_name} ADD CONSTRAINT {shadow_constraint_name} {definition}"
+        ))
+        shadow_constraints[shadow_constraint_name] = constraint_name
+
+    # Every other index e.g. the spatial index
+    indexes = session.execute(text(
+        "SELECT CAST(indexrelid AS regclass)::text, pg_get_indexdef(indexrelid) FROM pg_index "
+        "WHERE indrelid = CAST(:table_name AS regclass) "
+        "AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = pg_index.indexrelid)"
+    ), {"table_name": table_name}).all()
+    shadow_indexes = {}
+    for index_name, definition in indexes:
+        log.info(f"Building index {index_name} on {shadow_name}")
+        shadow_index_name = shadow_object_name(index_name)
+        definition = re.sub(
+            r"^(CREATE (?:UNIQUE )?INDEX )(\S+)( ON (?:ONLY )?)(\S+)",
+            lambda m: f"{m.group(1)}{shadow_index_name}{m.group(3)}{shadow_name}",
+            definition
+        )
+        session.execute(text(definition))
+        shadow_indexes[shadow_index_name] = index_name
+
+    session.commit()
+    session.execute(text(f"ANALYZE {shadow_name}"))
+    session.commit()
+    return {"constraints": shadow_constraints, "indexes": shadow_indexes}
+
+
+def _validate_row_counts(session, model, replace_where=None, min_row_ratio=MIN_ROW_RATIO):
+    shadow = get_shadow_table(model)
+    old_count_stmt = select(func.count()).select_from(model.__table__)
+    new_count_stmt = select(func.count()).select_from(shadow)
+    if replace_where is not None:
+        old_count_stmt = old_count_stmt.where(replace_where)
+        new_count_stmt = new_count_stmt.where(_adapt_to_shadow(model, replace_where))
+
+    old_count = session.execute(old_count_stmt).scalar()
+    new_count = session.execute(new_count_stmt).scalar()
+    log.info(f"Reloaded {model.__tablename__} rows: {old_count} -> {new_count}")
+
+    if new_count == 0:
+        raise RuntimeError(f"Shadow table for {model.__tablename__} has no reloaded rows")
+
+    if new_count < old_count * min_row_ratio:
+        raise RuntimeError(
+            f"Shadow table for {model.__tablename__} has {new_count} rows but there are currently "
+            f"{old_count}. Refusing to swap (min ratio {min_row_ratio})"
+        )
+
+
+def _referencing_constraints(session, table_name: str) -> list:
+    """Foreign keys on other tables that point at this one as (table, name, definition, columns, referenced columns)"""
+    return session.execute(text(
+        "SELECT CAST(c.conrelid AS regclass)::text, c.conname, pg_get_constraintdef(c.oid), "
+        "ARRAY(SELECT a.attname FROM unnest(c.conkey) WITH ORDINALITY k(attnum, n) "
+        "JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.attnum ORDER BY k.n), "
+        "ARRAY(SELECT a.attname FROM unnest(c.confkey) WITH ORDINALITY k(attnum, n) "
+        "JOIN pg_attribute a ON a.attrelid = c.confrelid AND a.attnum = k.attnum ORDER BY k.n) "
+        "FROM pg_constraint c WHERE c.confrelid = CAST(:table_name AS regclass) AND c.contype = 'f'"
+    ), {"table_name": table_name}).all()
+
+
+def _handle_removed_keys(session, model, referencing_constraints: list, derived_models):
+    """
+    Runs under the swap lock. Rows of derived tables that point at rows the reload drops are deleted,
+    any other table pointing at one means the swap would orphan real data so it is refused
+    """
+    table_name = model.__tablename__
+    shadow_name = shadow_table_name(model)
+    key_match = " AND ".join(f"s.{key.name} = t.{key.name}" for key in inspect(model).primary_key)
+    removed = session.execute(text(
+        f"CREATE TEMP TABLE removed_keys ON COMMIT DROP AS "
+        f"SELECT t.* FROM {table_name} t WHERE NOT EXISTS (SELECT 1 FROM {shadow_name} s WHERE {key_match})"
+    )).rowcount
+    if not removed:
+        return
+    log.info(f"The reload removes {removed} {table_name} rows")
+
+    derived_tables = {derived_model.__tablename__ for derived_model in derived_models}
+    for referencing_table, constraint_name, _, columns, referenced_columns in referencing_constraints:
+        references_removed = (
+            f"({', '.join(columns)}) IN (SELECT {', '.join(referenced_columns)} FROM removed_keys)"
+        )
+        if referencing_table in derived_tables:
+            deleted = session.execute(text(f"DELETE FROM {referencing_table} WHERE {references_removed}")).rowcount
+            log.info(f"Deleted {deleted} {referencing_table} rows of removed {table_name} rows")
+        elif session.execute(text(f"SELECT 1 FROM {referencing_table} WHERE {references_removed} LIMIT 1")).first():
+            session.rollback()
+            raise RuntimeError(
+                f"Rows in {referencing_table} reference {table_name} rows that are not in the reload "
+                f"({constraint_name}), keeping the old table"
+            )
+
+
+def _swap_tables(session, model, shadow_names: dict, replace_where=None, copy_xid=None, derived_models=()):
+    """shadow_names is what _build_keys_and_indexes returned, copy_xid what _copy_kept_rows returned"""
+    table_name = model.__tablename__
+    shadow_name = shadow_table_name(model)
+    log.info(f"Swapping {shadow_name} in for {table_name}")
+
+    referencing_constraints = _referencing_constraints(session, table_name)
+
+    # Everything below happens in one transaction - readers block on the lock for a moment
+    # and then see the new table. Writers block too, so the caught up rows are the final ones
+    session.execute(text(f"LOCK TABLE {table_name} IN ACCESS EXCLUSIVE MODE"))
+    if replace_where is not None:
+        _catch_up_kept_rows(session, model, replace_where, copy_xid)
+    _handle_removed_keys(session, model, referencing_constraints, derived_models)
+
+    # They go away with the old table
+    for referencing_table, constraint_name, *_ in referencing_constraints:
+        session.execute(text(f"ALTER TABLE {referencing_table} DROP CONSTRAINT {constraint_name}"))
+
+    session.execute(text(f"DROP TABLE {table_name}"))
+    session.execute(text(f"ALTER TABLE {shadow_name} RENAME TO {table_name}"))
+    for shadow_index_name, index_name in shadow_names["indexes"].items():
+        session.execute(text(f"ALTER INDEX {shadow_index_name} RENAME TO {index_name}"))
+    for shadow_constraint_name, constraint_name in shadow_names["constraints"].items():
+        session.execute(text(
+            f"ALTER TABLE {table_name} RENAME CONSTRAINT {shadow_constraint_name} TO {constraint_name}"
+        ))
+
+    # NOT VALID so the swap doesn't have to scan the referencing tables while holding the lock. New
+    # writes are still checked, and _handle_removed_keys made sure the existing rows are fine
+    for referencing_table, constraint_name, definition, *_ in referencing_constraints:
+        session.execute(text(
+            f"ALTER TABLE {referencing_table} ADD CONSTRAINT {constraint_name} {definition} NOT VALID"
+        ))
+    session.commit()
+
+    # Doesn't block readers or writers
+    for referencing_table, constraint_name, *_ in referencing_constraints:
+        try:
+            session.execute(text(f"ALTER TABLE {referencing_table} VALIDATE CONSTRAINT {constraint_name}"))
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise RuntimeError(
+                f"Swapped {table_name} but {constraint_name} on {referencing_table} doesn't validate"
+            ) from e
+
+
+def finish_shadow_reload(session, model, replace_where=None, min_row_ratio=MIN_ROW_RATIO, derived_models=()):
+    """
+    derived_models are tables built from this one (e.g. AreaSimplified for Area), their rows for keys
+    that aren't in the reload are deleted along with the swap instead of blocking it
+    """
+    _remove_duplicate_keys(session, model)
+    session.commit()
+    _validate_row_counts(session, model, replace_where, min_row_ratio)
+    copy_xid = _copy_kept_rows(session, model, replace_where) if replace_where is not None else None
+    shadow_names = _build_keys_and_indexes(session, model)
+    _swap_tables(session, model, shadow_names, replace_where, copy_xid, derived_models)
+
+
+class ShadowLoader:
+    """Buffers row dicts (or model instances) and bulk inserts them into the shadow table"""
+
+    def __init__(self, session, model, batch_size=SHADOW_BATCH_SIZE):
+        self.session = session
+        self.model = model
+        self.batch_size = batch_size
+        self.buffer = []
+        self.count = 0
+
+    def add(self, instance):
+        self.buffer.append(instance)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        insert_shadow_rows(self.session, self.model, self.buffer)
+        self.count += len(self.buffer)
+        self.buffer = []
+
+
+@contextmanager
+def shadow_reload(session, model, replace_where=None, min_row_ratio=MIN_ROW_RATIO, derived_models=()):
+    """
+    with shadow_reload(session, Area, Area.classification == "zipcode") as loader:
+        for area in download_zip_codes():
+            loader.add(area)
+
+    The swap happens when the block exits without an exception, otherwise the shadow table is dropped.
+    See finish_shadow_reload for derived_models
+    """
+    create_shadow_table(session, model)
+    loader = ShadowLoader(session, model)
+    try:
+        yield loader
+        loader.flush()
+        log.info(f"Loaded {loader.count} rows into {shadow_table_name(model)}")
+        finish_shadow_reload(session, model, replace_where, min_row_ratio, derived_models)
+    except BaseException:
+        log.warning(f"Reload of {model.__tablename__} failed, dropping shadow table")
+        drop_shadow_table(session, model)
+        raise
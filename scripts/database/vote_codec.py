@@ -0,0 +1,83 @@
+"""
+Compact storage for VoteEvent.votes. Instead of one JSONB object per voter
+
+{"option": "yes", "voter_name": "Baldwin (D-WI)", "voter_id": "ocd-person/...", "note": ""}
+
+a vote event can store three arrays aligned by position:
+
+vote_option_codes  SMALLINT[]  index into VOTE_OPTIONS
+vote_voter_ids     TEXT[]      person id, NULL for voters that weren't matched
+vote_voter_names   TEXT[]      scraper name of every voter, matched or not
+
+Every voter keeps the name the scraper gave them so decoding gives back the votes list that was
+encoded, with one exception: notes aren't stored. Vote lists with a non-empty note (or an unknown
+option) stay JSONB, and every decoded vote gets "note": "" - also when the encoded vote had no note
+key at all. Likewise an unmatched voter without a voter_id decodes with the scraper's pseudo id.
+"""
+import json
+
+VOTE_OPTIONS = ["yes", "no", "not voting", "absent", "excused", "abstain", "paired", "other"]
+VOTE_OPTION_CODES = {option: code for code, option in enumerate(VOTE_OPTIONS)}
+
+VOTE_COLUMNS = ("vote_option_codes", "vote_voter_ids", "vote_voter_names")
+
+
+def _scraper_voter_id(voter_name: str) -> str:
+    # The pseudo id the scrapers give voters e.g. ~{"name": "Camera Bartolotta"}
+    return "~" + json.dumps({"name": voter_name}, ensure_ascii=False)
+
+
+def encode_votes(votes: list):
+    """Compact columns for a votes list that has been through replace_voter_ids, None if it can't be encoded"""
+    option_codes = []
+    voter_ids = []
+    voter_names = []
+    for vote in votes:
+        code = VOTE_OPTION_CODES.get(vote["option"])
+        if code is None or vote.get("note"):
+            return None
+
+        voter_id = vote.get("voter_id")
+        if voter_id and voter_id.startswith("ocd-person/"):
+            voter_ids.append(voter_id)
+        elif voter_id is None or voter_id == _scraper_voter_id(vote["voter_name"]):
+            voter_ids.append(None)
+        else:
+            # Some other kind of id that wouldn't survive the round trip
+            return None
+        voter_names.append(vote["voter_name"])
+        option_codes.append(code)
+
+    return dict(vote_option_codes=option_codes, vote_voter_ids=voter_ids, vote_voter_names=voter_names)
+
+
+def decode_votes(option_codes: list, voter_ids: list, voter_names: list) -> list:
+    """Back to the VoteEvent.votes format, notes are always "" (see the module docstring)"""
+    votes = []
+    for code, voter_id, voter_name in zip(option_codes, voter_ids, voter_names):
+        if voter_id is None:
+            voter_id = _scraper_voter_id(voter_name)
+        votes.append({"option": VOTE_OPTIONS[code], "voter_name": voter_name, "voter_id": voter_id, "note": ""})
+    return votes
+
+
+def compact_vote_event_row(row: dict) -> dict:
+    """
+    Moves a vote_events row dict's votes into the compact columns when possible. The compact columns
+    are always set so that every row in an upsert batch has the same keys
+    """
+    encoded = encode_votes(row["votes"])
+    if encoded is None:
+        row.update(dict.fromkeys(VOTE_COLUMNS))
+    else:
+        row.update(encoded)
+        row["votes"] = None
+    return row
+
+
+def vote_event_votes(row) -> list:
+    """The votes of a vote_events row (dict or query row) whichever way they are stored"""
+    row = row if isinstance(row, dict) else row._asdict()
+    if row["votes"] is not None:
+        return row["votes"]
+    return decode_votes(row["vote_option_codes"], row["vote_voter_ids"], row["vote_voter_names"])
@@ -0,0 +1,83 @@
+"""
+Date decoding for scraper output. Almost every date is ISO 8601 ("2024-05-23T18:02:00+00:00" or
+"2024-05-23"), which datetime.fromisoformat handles in C without the strptime format guessing.
+
+A DateDecoder remembers the format that worked last, so a source that uses some other format only
+pays for the misses on its first date. Use one decoder per source (e.g. one per loader module).
+
+Action dates can be turned into a numpy datetime64 array so first / latest action (and anything else
+over a bill's timeline) are array operations instead of comparing strings.
+"""
+import logging
+from datetime import datetime, timezone
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# Formats tried (after fromisoformat) for dates that aren't ISO 8601
+FALLBACK_FORMATS = ("%m/%d/%Y", "%m/%d/%Y %H:%M:%S", "%B %d, %Y")
+
+# Stands for datetime.fromisoformat in place of a strptime format
+ISO_FORMAT = None
+
+
+def _parse(date_str: str, date_format):
+    if date_format is ISO_FORMAT:
+        return datetime.fromisoformat(date_str)
+    return datetime.strptime(date_str, date_format)
+
+
+class DateDecoder:
+    def __init__(self, formats=FALLBACK_FORMATS):
+        self.formats = [ISO_FORMAT, *formats]
+        self.format = ISO_FORMAT
+
+    def decode(self, date_str: str):
+        """datetime for the string (time zone aware if it has an offset), None for empty strings"""
+        if not date_str:
+            return None
+
+        try:
+            return _parse(date_str, self.format)
+        except ValueError:
+            pass
+
+        for date_format in self.formats:
+            if date_format == self.format:
+                continue
+            try:
+                value = _parse(date_str, date_format)
+            except ValueError:
+                continue
+            log.debug(f"Switching date format to {date_format or 'iso'} for '{date_str}'")
+            self.format = date_format
+            return value
+
+        raise RuntimeError(f"Could not parse date '{date_str}'")
+
+    def decode_many(self, date_strs) -> list:
+        return [self.decode(date_str) for date_str in date_strs]
+
+
+def to_datetime64(datetimes) -> np.ndarray:
+    """
+    datetime64[s] array for a list of datetimes (None becomes NaT). datetime64 has no time zones so
+    aware datetimes are converted to UTC, naive ones are taken to be UTC already
+    """
+    return np.array([
+        value.astimezone(timezone.utc).replace(tzinfo=None) if value is not None and value.tzinfo else value
+        for value in datetimes
+    ], dtype="datetime64[s]")
+
+
+def action_date_range(actions: list, decoder: DateDecoder) -> tuple:
+    """
+    (first, latest) action dates of a bill as the decoded datetimes, (None, None) if no action has a
+    date. Ties go to the earliest action in the list, same as min() / max()
+    """
+    dates = [date for date in decoder.decode_many(action.get("date") for action in actions or []) if date is not None]
+    if not dates:
+        return None, None
+    timeline = to_datetime64(dates)
+    return dates[int(timeline.argmin())], dates[int(timeline.argmax())]
@@ -1,49 +1,109 @@
 import os
+import io
+import csv
+import shutil
 import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import requests
 import gzip
+from contextlib import contextmanager, nullcontext
 from shapely.geometry import shape
 
 from sqlalchemy.sql import func
-import subprocess
-import json
 from uuid import uuid5, NAMESPACE_OID
 
-from ..database.database import upsert_dynamic, get_session
+from ..database.database import BatchUpserter, upsert_rows, get_session
 from ..logging_config import setup_logging
 from ..database.models import PrecinctElectionResultArea
+from ..database.shadow_reload import (
+    shadow_reload, create_shadow_table, insert_shadow_rows, finish_shadow_reload, drop_shadow_table
+)
+from .topojson import iter_topojson_features, read_topology
+from ..spatial_order import cluster_table
+from ..json_codec import loads as json_loads
 
 log = logging.getLogger(__name__)
 
 DATA_DIR = os.path.join(os.getcwd(), "_data", "election_data")
 
+# Name of the precinct object inside the nytimes topology
+TOPOJSON_OBJECT_NAME = "tiles"
+
+TOPOJSON_URL = "https://int.nyt.com/newsgraphics/elections/map-data/2024/national/precincts-with-results.topojson.gz"
+CSV_URL = "https://int.nyt.com/newsgraphics/elections/map-data/2024/national/precincts-with-results.csv.gz"
+
+# Decompression / download buffer size - keeps memory flat regardless of file size
+CHUNK_SIZE = 1024 * 1024
+
+# Rows per upsert statement for the sharded ingest
+SHARD_BATCH_SIZE = 500
+
+# Max number of error messages each shard reports back
+SHARD_ERROR_SAMPLE_SIZE = 10
+
 
 def ungzip(filepath, output_filepath):
-    # Open the .gz file and write its decompressed content to the output file
+    # Open the .gz file and copy its decompressed content to the output file a chunk at a time
     with gzip.open(filepath, 'rb') as gz_file:
         with open(output_filepath, 'wb') as out_file:
-            out_file.write(gz_file.read())
+            shutil.copyfileobj(gz_file, out_file, CHUNK_SIZE)
 
-def download_nytimes_data():
 
-    topojson_url = "https://int.nyt.com/newsgraphics/elections/map-data/2024/national/precincts-with-results.topojson.gz"
-    csv_url = "https://int.nyt.com/newsgraphics/elections/map-data/2024/national/precincts-with-results.csv.gz"
+@contextmanager
+def open_gzip_stream(url):
+    """
+    Streams a gzipped http response and yields a binary file object of the decompressed
+    bytes. Neither the compressed nor decompressed file is ever fully held in memory or
+    written to disk, both are read CHUNK_SIZE bytes at a time as the consumer reads.
+    """
+    with requests.get(url, stream=True) as response:
+        response.raise_for_status()
+        # Undo any transport level encoding - we want the raw .gz bytes
+        response.raw.decode_content = True
+        with gzip.GzipFile(fileobj=response.raw, mode="rb") as gz_file:
+            yield io.BufferedReader(gz_file, buffer_size=CHUNK_SIZE)
+
 
-    topo_json_response = requests.get(topojson_url)
-    csv_response = requests.get(csv_url)
+def iter_gzip_lines(url):
+    """Yields decoded text lines from a gzipped newline-delimited http resource"""
+    with open_gzip_stream(url) as stream:
+        yield from io.TextIOWrapper(stream, encoding="utf-8")
 
-    # Ensure we can fetch
-    topo_json_response.raise_for_status()
-    csv_response.raise_for_status()
 
+def iter_gzip_ndjson(url):
+    """Yields one decoded object per line of a gzipped newline-delimited json resource, blank lines are skipped"""
+    for line in iter_gzip_lines(url):
+        if line.strip():
+            yield json_loads(line)
+
+
+def iter_gzip_csv_rows(url):
+    """Yields a dict per row of a gzipped csv resource (e.g. CSV_URL), keyed by the header row"""
+    with open_gzip_stream(url) as stream:
+        yield from csv.DictReader(io.TextIOWrapper(stream, encoding="utf-8", newline=""))
+
+
+def download_file(url, filepath):
+    with requests.get(url, stream=True) as response:
+        response.raise_for_status()
+        with open(filepath, "wb") as file_out:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                if chunk:
+                    file_out.write(chunk)
+
+
+def download_nytimes_data():
+    """
+    Downloads and un-gzips the raw nytimes files to disk. Only needed when we want
+    to keep a local copy - ingest reads straight from the http stream.
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
     topo_gzip_filepath = os.path.join(DATA_DIR, "precincts-with-results.topojson.gz")
     csv_gzip_filepath = os.path.join(DATA_DIR, "precincts-with-results.csv.gz")
 
-    with open(topo_gzip_filepath, "wb") as topojson_file_raw:
-        topojson_file_raw.write(topo_json_response.content)
-
-    with open(csv_gzip_filepath, "wb") as csv_file_raw:
-        csv_file_raw.write(csv_response.content)
+    download_file(TOPOJSON_URL, topo_gzip_filepath)
+    download_file(CSV_URL, csv_gzip_filepath)
 
     # Un-gzip
     topojson_filepath = os.path.join(DATA_DIR, "precincts-with-results.topojson")
@@ -54,59 +114,226 @@ def download_nytimes_data():
     return topojson_filepath, csv_filepath
 
 
-def ingest_geojson(geojson_lines_filepath):
+def build_precinct(props, geometry):
+    # Compute the centroid
+    centroid = geometry.centroid
+
+    return dict(
+        precinct_id=str(uuid5(NAMESPACE_OID, props["GEOID"])),
+        state=props["state"],
+        votes_dem=props["votes_dem"],
+        votes_rep=props["votes_rep"],
+        votes_total=props["votes_total"],
+        pct_dem_lead=props["pct_dem_lead"],
+        official_boundary=props["official_boundary"],
+        geometry=func.ST_GeomFromWKB(geometry.wkb, 4326),
+        centroid_lat=centroid.y,
+        centroid_lon=centroid.x
+    )
+
+
+def ingest_precincts(features, reload=False):
+    """
+    Upserts precincts from an iterable of (properties, shapely geometry) tuples. With reload
+    the whole table is replaced via a shadow table swap instead - see database/shadow_reload.py
+    """
     counter = 0
     with get_session() as session:
-        with open(geojson_lines_filepath, "r") as geojson_file_raw:
-            for line in geojson_file_raw:
-                precinct_geojson = json.loads(line)
+        with shadow_reload(session, PrecinctElectionResultArea) if reload else nullcontext() as loader:
+            writer = loader or BatchUpserter(session, PrecinctElectionResultArea)
+            for props, geometry in features:
+                if geometry is None:
+                    log.warning(f"Skipping precinct {props.get('GEOID')} without geometry")
+                    continue
 
-                props = precinct_geojson["properties"]
+                writer.add(build_precinct(props, geometry))
 
-                # Convert GeoJSON to Shapely MultiPolygon
-                multipolygon = shape(precinct_geojson["geometry"])
+                counter += 1
+                if counter % 100 == 0:
+                    log.info(f"Ingested {counter} precincts")
+            # The shadow loader flushes itself when the block exits
+            if not loader:
+                writer.flush()
 
-                # Compute the centroid
-                centroid = multipolygon.centroid
+    log.info(f"Finished ingesting {counter} precincts")
 
-                precinct = PrecinctElectionResultArea(
-                    precinct_id=str(uuid5(NAMESPACE_OID, props["GEOID"])),
-                    state=props["state"],
-                    votes_dem=props["votes_dem"],
-                    votes_rep=props["votes_rep"],
-                    votes_total=props["votes_total"],
-                    pct_dem_lead=props["pct_dem_lead"],
-                    official_boundary=props["official_boundary"],
-                    geometry=func.ST_GeomFromGeoJSON(json.dumps(precinct_geojson["geometry"])),
-                    centroid_lat=centroid.y,
-                    centroid_lon=centroid.x
-                )
 
+def iter_geojson_lines(geojson_lines_filepath):
+    with open(geojson_lines_filepath, "r") as geojson_file_raw:
+        for line in geojson_file_raw:
+            precinct_geojson = json_loads(line)
+            # Convert GeoJSON to Shapely MultiPolygon
+            yield precinct_geojson["properties"], shape(precinct_geojson["geometry"])
 
-                upsert_dynamic(session, precinct)
 
-                counter += 1
-                if counter % 100 == 0:
-                    log.info(f"Ingested {counter} precincts")
+def ingest_geojson(geojson_lines_filepath, reload=False):
+    ingest_precincts(iter_geojson_lines(geojson_lines_filepath), reload)
 
-def main():
-    os.makedirs(DATA_DIR, exist_ok=True)
 
-    # log.info("Downloading precinct election data")
-    # topojson_filepath, csv_filepath = download_nytimes_data()
+def compute_byte_shards(filepath, num_shards):
+    """
+    Splits a newline-delimited file into at most num_shards (start, end) byte ranges.
+    Every boundary is moved forward to the byte after a newline so no line is split.
+    """
+    file_size = os.path.getsize(filepath)
+    boundaries = [0]
+    with open(filepath, "rb") as f:
+        for i in range(1, num_shards):
+            f.seek(file_size * i // num_shards)
+            f.readline()
+            boundary = f.tell()
+            if boundary > boundaries[-1] and boundary < file_size:
+                boundaries.append(boundary)
+    boundaries.append(file_size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def write_precinct_batch(session, batch, reload=False):
+    if reload:
+        insert_shadow_rows(session, PrecinctElectionResultArea, batch)
+    else:
+        upsert_rows(session, PrecinctElectionResultArea, batch)
+
+
+def ingest_geojson_shard(geojson_lines_filepath, start, end, reload=False):
+    """
+    Ingests the lines in [start, end) of the file with its own db connection.
+    Runs in a worker process so it only returns a small summary dict.
+    With reload rows are plain inserts into the already created shadow table.
+    """
+    report = {"start": start, "end": end, "ingested": 0, "errors": 0, "error_samples": []}
+    batch = []
+    with get_session() as session:
+        with open(geojson_lines_filepath, "rb") as geojson_file_raw:
+            geojson_file_raw.seek(start)
+            position = start
+            while position < end:
+                line = geojson_file_raw.readline()
+                if not line:
+                    break
+                position += len(line)
+
+                try:
+                    precinct_geojson = json_loads(line)
+                    batch.append(build_precinct(precinct_geojson["properties"], shape(precinct_geojson["geometry"])))
+                except Exception as e:
+                    report["errors"] += 1
+                    if len(report["error_samples"]) < SHARD_ERROR_SAMPLE_SIZE:
+                        report["error_samples"].append(f"byte {position - len(line)}: {e!r}")
+                    continue
+
+                if len(batch) >= SHARD_BATCH_SIZE:
+                    write_precinct_batch(session, batch, reload)
+                    report["ingested"] += len(batch)
+                    batch = []
+
+            if batch:
+                write_precinct_batch(session, batch, reload)
+                report["ingested"] += len(batch)
+
+    return report
+
+
+def ingest_geojson_sharded(geojson_lines_filepath, workers=None, reload=False, cluster=False):
+    """
+    Parallel version of ingest_geojson - each worker process ingests one byte range of the file.
+    The shards land in the table in whatever order the workers finish their batches, with cluster
+    the table is rewritten in spatial index order afterwards (an exclusive lock while it runs)
+    """
+    if reload:
+        with get_session() as session:
+            create_shadow_table(session, PrecinctElectionResultArea)
+
+    workers = workers or os.cpu_count()
+    # A few shards per worker so that one slow (e.g. dense urban) shard doesn't hold up the run
+    shards = compute_byte_shards(geojson_lines_filepath, workers * 4)
+    total_bytes = os.path.getsize(geojson_lines_filepath)
+    log.info(f"Ingesting {geojson_lines_filepath} in {len(shards)} shards with {workers} workers")
+
+    ingested = 0
+    errors = 0
+    bytes_done = 0
+    error_samples = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(ingest_geojson_shard, geojson_lines_filepath, start, end, reload)
+                for start, end in shards
+            ]
+            for future in as_completed(futures):
+                report = future.result()
+                ingested += report["ingested"]
+                errors += report["errors"]
+                bytes_done += report["end"] - report["start"]
+                error_samples.extend(report["error_samples"])
+                log.info(f"Ingested {ingested} precincts ({errors} errors) - {bytes_done / max(total_bytes, 1):.0%} of file")
+
+        for error_sample in error_samples:
+            log.warning(f"Precinct ingest error at {error_sample}")
+        log.info(f"Finished sharded ingest: {ingested} precincts, {errors} errors")
+
+        if reload:
+            with get_session() as session:
+                finish_shadow_reload(session, PrecinctElectionResultArea)
+    except BaseException:
+        if reload:
+            with get_session() as session:
+                drop_shadow_table(session, PrecinctElectionResultArea)
+        raise
+
+    if cluster and ingested:
+        with get_session() as session:
+            cluster_table(session, PrecinctElectionResultArea.__tablename__)
+
+    return {"ingested": ingested, "errors": errors, "error_samples": error_samples}
+
+
+def ingest_topology(topology, arcs, reload=False):
+    features = iter_topojson_features(topology, TOPOJSON_OBJECT_NAME, spatially_ordered=True, arcs=arcs)
+    ingest_precincts(features, reload)
+
+
+def ingest_topojson(topojson_filepath, reload=False):
+    # Decodes the topology in process rather than converting to geojson lines first
+    with open(topojson_filepath, "rb") as topojson_file:
+        topology, arcs = read_topology(topojson_file, TOPOJSON_OBJECT_NAME)
+    ingest_topology(topology, arcs, reload)
+
+
+def ingest_topojson_url(topojson_url, reload=False):
+    # Parsed incrementally straight off of the decompressed http stream, the arcs go into flat
+    # arrays as they are read so the document is never held as a whole
+    with open_gzip_stream(topojson_url) as stream:
+        topology, arcs = read_topology(stream, TOPOJSON_OBJECT_NAME)
+    ingest_topology(topology, arcs, reload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest nytimes precinct election results")
+    parser.add_argument("--geojson-lines", type=str, default=None,
+                        help="Ingest an existing newline-delimited geojson file instead of streaming the topojson")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of worker processes for --geojson-lines (defaults to cpu count)")
+    parser.add_argument("--reload", action="store_true",
+                        help="Bulk load into a shadow table and atomically swap it in instead of upserting in place")
+    parser.add_argument("--cluster", action="store_true",
+                        help="CLUSTER the precinct table on its spatial index after loading")
+    args = parser.parse_args()
 
-    geojson_lines_filepath = os.path.join(DATA_DIR, "precincts-with-results.geojson")
-    # # convert to geojson lines
-    # # This runs a npm/node module as a cli, which is.. idk.. not great
-    # # nytimes wanted to use topojson likely to reduce storage space usage
-    # # but its kinda annoying cuz python tooling is not very mature for it
-    # subprocess.run(
-    #     ["topo2geo", "--newline-delimited", f"tiles={geojson_lines_filepath}", "-i", topojson_filepath]
-    # )
+    sharded = args.geojson_lines and args.workers != 1
+    if sharded:
+        ingest_geojson_sharded(args.geojson_lines, args.workers, args.reload, args.cluster)
+    elif args.geojson_lines:
+        ingest_geojson(args.geojson_lines, args.reload)
+    else:
+        log.info("Streaming precinct election data")
+        ingest_topojson_url(TOPOJSON_URL, args.reload)
 
-    ingest_geojson(geojson_lines_filepath)
+    if args.cluster and not sharded:
+        with get_session() as session:
+            cluster_table(session, PrecinctElectionResultArea.__tablename__)
 
 
 if __name__ == "__main__":
     setup_logging()
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,274 @@
+"""
+Minimal TopoJSON reader so we don't need to shell out to the `topo2geo` node cli
+to turn the nytimes precinct topology into newline-delimited geojson.
+
+TopoJSON spec: https://github.com/topojson/topojson-specification
+
+The gist of the format:
+- All line work lives in a single top level "arcs" array that polygons share
+- When the topology is quantized (has a "transform") each arc is delta-encoded
+  integer positions, so we need a running sum + scale/translate to get lon/lat
+- Geometries reference arcs by index, where a negative index ~i means arc i reversed
+
+A topology is one json document, read_topology parses it incrementally so the arcs (nearly all of
+the file) go straight into flat arrays instead of nested python lists.
+"""
+import logging
+from array import array
+from itertools import chain
+
+import ijson
+import numpy as np
+from shapely.geometry import Point, MultiPoint, LineString, MultiLineString, Polygon, MultiPolygon
+
+from ..spatial_order import hilbert_order
+
+log = logging.getLogger(__name__)
+
+
+class DecodedArcs:
+    """
+    All of the arcs of a topology decoded into a single (N, 2) coordinate array.
+    Individual arcs are views into that array so we never copy the line work per polygon.
+    """
+
+    def __init__(self, coordinates: np.ndarray, offsets: np.ndarray):
+        self.coordinates = coordinates
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def arc(self, index: int) -> np.ndarray:
+        # ~index == -index - 1, which is how topojson encodes a reversed arc
+        if index < 0:
+            index = ~index
+            return self.coordinates[self.offsets[index]:self.offsets[index + 1]][::-1]
+        return self.coordinates[self.offsets[index]:self.offsets[index + 1]]
+
+    def bounds(self) -> np.ndarray:
+        """(num_arcs, 4) array of minx, miny, maxx, maxy for every arc"""
+        starts = self.offsets[:-1]
+        non_empty = starts < self.offsets[1:]
+        bounds = np.full((len(self), 4), np.nan)
+        if non_empty.any():
+            bounds[non_empty, :2] = np.minimum.reduceat(self.coordinates, starts[non_empty], axis=0)
+            bounds[non_empty, 2:] = np.maximum.reduceat(self.coordinates, starts[non_empty], axis=0)
+        return bounds
+
+
+def decode_arcs(topology: dict) -> DecodedArcs:
+    arcs = topology.get("arcs", [])
+    lengths = np.fromiter((len(arc) for arc in arcs), dtype=np.int64, count=len(arcs))
+
+    # Only x/y matter to us - some topologies carry extra dimensions per position
+    flat = np.fromiter(
+        chain.from_iterable((position[0], position[1]) for arc in arcs for position in arc),
+        dtype=np.float64,
+        count=int(lengths.sum()) * 2
+    ).reshape(-1, 2)
+
+    return _decode_positions(flat, lengths, topology.get("transform"))
+
+
+def _decode_positions(flat: np.ndarray, lengths: np.ndarray, transform: dict = None) -> DecodedArcs:
+    # flat is the (N, 2) x/y positions of every arc back to back, lengths the positions per arc
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    if not transform:
+        return DecodedArcs(flat, offsets)
+
+    # Delta decoding - a running sum over the whole array, then subtract the running total
+    # from right before each arc started so every arc restarts from its own first position
+    running = np.cumsum(flat, axis=0)
+    starts = offsets[:-1]
+    arc_bases = np.zeros((len(lengths), 2), dtype=np.float64)
+    arc_bases[starts > 0] = running[starts[starts > 0] - 1]
+    decoded = running - np.repeat(arc_bases, lengths, axis=0)
+
+    scale = np.asarray(transform["scale"], dtype=np.float64)
+    translate = np.asarray(transform["translate"], dtype=np.float64)
+    return DecodedArcs(decoded * scale + translate, offsets)
+
+
+def read_topology(stream, object_name: str) -> tuple:
+    """
+    Parses a topology from a binary stream without holding the whole document. Returns (topology, arcs)
+    where arcs is the DecodedArcs and topology has everything else that iter_topojson_features needs:
+    type, transform and objects, of which only object_name is kept (the others are None).
+    """
+    topology = {"objects": {}}
+    object_prefix = f"objects.{object_name}"
+    # Positions as x, y, x, y... and the number of positions of every arc
+    positions = array("d")
+    lengths = array("q")
+    arc_start = 0
+    position_size = 0
+    builder = None
+    builder_prefix = None
+
+    for prefix, event, value in ijson.parse(stream, use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == builder_prefix and event in ("end_map", "end_array"):
+                if builder_prefix == object_prefix:
+                    topology["objects"][object_name] = builder.value
+                else:
+                    topology[builder_prefix] = builder.value
+                builder = None
+        elif prefix == "arcs.item.item.item":
+            # Only x/y matter to us - some topologies carry extra dimensions per position
+            if position_size < 2:
+                positions.append(value)
+            position_size += 1
+        elif prefix == "arcs.item.item" and event == "start_array":
+            position_size = 0
+        elif prefix == "arcs.item":
+            if event == "start_array":
+                arc_start = len(positions)
+            elif event == "end_array":
+                lengths.append((len(positions) - arc_start) // 2)
+        elif prefix == "type" and event == "string":
+            topology["type"] = value
+        elif prefix == "objects" and event == "map_key":
+            topology["objects"].setdefault(value, None)
+        elif prefix in ("transform", object_prefix) and event in ("start_map", "start_array"):
+            builder = ijson.ObjectBuilder()
+            builder_prefix = prefix
+            builder.event(event, value)
+
+    flat = np.frombuffer(positions, dtype=np.float64).reshape(-1, 2)
+    arcs = _decode_positions(flat, np.frombuffer(lengths, dtype=np.int64), topology.get("transform"))
+    return topology, arcs
+
+
+def _decode_position(position, transform):
+    # Point positions are quantized but not delta-encoded
+    if not transform:
+        return position[0], position[1]
+    return (
+        position[0] * transform["scale"][0] + transform["translate"][0],
+        position[1] * transform["scale"][1] + transform["translate"][1]
+    )
+
+
+def stitch_arcs(arc_indexes: list, arcs: DecodedArcs) -> np.ndarray:
+    """
+    Join a list of arc references into one coordinate sequence. Consecutive arcs
+    share their boundary position so we drop the first position of every arc after the first.
+    """
+    pieces = [arcs.arc(arc_indexes[0])]
+    for arc_index in arc_indexes[1:]:
+        pieces.append(arcs.arc(arc_index)[1:])
+    return np.concatenate(pieces) if len(pieces) > 1 else pieces[0]
+
+
+def _polygon(rings: list, arcs: DecodedArcs) -> Polygon:
+    shell = stitch_arcs(rings[0], arcs)
+    holes = [stitch_arcs(ring, arcs) for ring in rings[1:]]
+    return Polygon(shell, holes)
+
+
+def to_shapely(geometry: dict, arcs: DecodedArcs, transform: dict = None):
+    geometry_type = geometry.get("type")
+
+    if geometry_type == "Polygon":
+        return _polygon(geometry["arcs"], arcs)
+
+    if geometry_type == "MultiPolygon":
+        return MultiPolygon([_polygon(rings, arcs) for rings in geometry["arcs"]])
+
+    if geometry_type == "LineString":
+        return LineString(stitch_arcs(geometry["arcs"], arcs))
+
+    if geometry_type == "MultiLineString":
+        return MultiLineString([stitch_arcs(line, arcs) for line in geometry["arcs"]])
+
+    if geometry_type == "Point":
+        return Point(_decode_position(geometry["coordinates"], transform))
+
+    if geometry_type == "MultiPoint":
+        return MultiPoint([_decode_position(p, transform) for p in geometry["coordinates"]])
+
+    # Null geometries are allowed in topojson (type is missing / None)
+    if geometry_type is None:
+        return None
+
+    raise RuntimeError(f"Unsupported topojson geometry type: {geometry_type}")
+
+
+def _flatten_arc_indexes(arc_references):
+    # Polygon arcs are nested one level deeper than linestrings and multipolygons one more
+    if isinstance(arc_references, int):
+        yield ~arc_references if arc_references < 0 else arc_references
+        return
+    for arc_reference in arc_references:
+        yield from _flatten_arc_indexes(arc_reference)
+
+
+def bbox_centers(geometries: list, arcs: DecodedArcs, transform: dict = None) -> tuple:
+    """
+    Bounding box center (x, y) of each geometry computed from the per-arc bounds,
+    without assembling any polygons.
+    """
+    arc_bounds = arcs.bounds()
+    centers = np.full((len(geometries), 2), np.nan)
+    for i, geometry in enumerate(geometries):
+        if "arcs" in geometry:
+            indexes = np.fromiter(_flatten_arc_indexes(geometry["arcs"]), dtype=np.int64)
+            if len(indexes) == 0:
+                continue
+            geometry_bounds = arc_bounds[indexes]
+            minx, miny = np.nanmin(geometry_bounds[:, :2], axis=0)
+            maxx, maxy = np.nanmax(geometry_bounds[:, 2:], axis=0)
+            centers[i] = ((minx + maxx) / 2, (miny + maxy) / 2)
+        elif geometry.get("coordinates"):
+            positions = geometry["coordinates"]
+            if geometry["type"] == "Point":
+                positions = [positions]
+            points = np.array([_decode_position(p, transform) for p in positions])
+            centers[i] = points.min(axis=0) / 2 + points.max(axis=0) / 2
+    return centers[:, 0], centers[:, 1]
+
+
+def iter_topojson_features(topology: dict, object_name: str, spatially_ordered: bool = False,
+                           arcs: DecodedArcs = None):
+    """
+    Yields (properties, shapely geometry) tuples for each geometry in the named
+    topology object. GeometryCollections are flattened, which matches what topo2geo
+    does for the nytimes data ("tiles" is a GeometryCollection of precincts).
+
+    With spatially_ordered the geometries are yielded along a hilbert curve of their
+    bounding box centers rather than in file order.
+
+    arcs are the already decoded arcs when the topology came from read_topology.
+    """
+    if topology.get("type") != "Topology":
+        raise RuntimeError(f"Unexpected topojson type: {topology.get('type')}")
+
+    if object_name not in topology["objects"]:
+        raise RuntimeError(f"Object {object_name} not found in topology. Found: {list(topology['objects'])}")
+
+    if arcs is None:
+        arcs = decode_arcs(topology)
+    transform = topology.get("transform")
+    log.info(f"Decoded {len(arcs)} arcs ({len(arcs.coordinates)} positions)")
+
+    geometries = []
+    stack = [topology["objects"][object_name]]
+    while stack:
+        geometry = stack.pop()
+        if geometry.get("type") == "GeometryCollection":
+            # Reversed so that we yield in file order
+            stack.extend(reversed(geometry["geometries"]))
+            continue
+        geometries.append(geometry)
+
+    if spatially_ordered:
+        order = hilbert_order(*bbox_centers(geometries, arcs, transform))
+    else:
+        order = range(len(geometries))
+
+    for i in order:
+        geometry = geometries[i]
+        yield geometry.get("properties") or {}, to_shapely(geometry, arcs, transform)
@@ -0,0 +1,66 @@
+"""
+Shared json encoding/decoding for the loaders. Uses orjson (or msgspec) when it is
+installed since the stdlib json module ends up being a big chunk of ingest cpu time,
+and falls back to the stdlib otherwise.
+"""
+import json
+from functools import lru_cache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+if orjson is not None:
+    BACKEND = "orjson"
+
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(obj) -> str:
+        # orjson returns bytes but sqlalchemy / psycopg2 expect str
+        return orjson.dumps(obj).decode("utf-8")
+
+elif msgspec is not None:
+    BACKEND = "msgspec"
+    _decoder = msgspec.json.Decoder()
+    _encoder = msgspec.json.Encoder()
+
+    def loads(data):
+        return _decoder.decode(data)
+
+    def dumps(obj) -> str:
+        return _encoder.encode(obj).decode("utf-8")
+
+else:
+    BACKEND = "json"
+
+    def loads(data):
+        return json.loads(data)
+
+    def dumps(obj) -> str:
+        return json.dumps(obj)
+
+
+@lru_cache(maxsize=4096)
+def _parse_embedded_cached(value: str):
+    return loads(value[1:])
+
+
+def parse_embedded(value: str):
+    """
+    Openstates scraper output references other objects with embedded json strings
+    prefixed by a tilde, e.g. "organization": "~{\"classification\": \"upper\"}"
+
+    The same handful of references repeat across every bill / vote event so results
+    are memoized - callers must treat the returned dict as read only.
+    """
+    if not value or not value.startswith("~"):
+        raise ValueError(f"Not an embedded reference: {value}")
+    return _parse_embedded_cached(value)
@@ -8,8 +8,9 @@ import os
 import shutil
 import logging
 
-from ..database.database import upsert_dynamic, get_session
+from ..database.database import BatchUpserter, get_session
 from ..database.models import Person
+from ..bills.vote_matching import delete_stale_voter_name_resolutions
 from ..logging_config import setup_logging
 from ..reference_data_helper import get_fips_state_mapping
 from .people_utils import clone_repository, find_current_role
@@ -105,7 +106,7 @@ def parse_people_data(repo_dir):
             if is_special_case(current_role):
                 continue
 
-            yield Person(
+            yield dict(
                 id=person_data["id"],
                 jurisdiction_area_id="ocd-division/country:us",
                 constituent_area_id=constituent_area_id,
@@ -138,8 +139,15 @@ def main():
         # Data lives in a GH repository
         clone_repository(REPO_URL, REPO_DIR)
 
+        person_writer = BatchUpserter(session, Person)
         for person in parse_people_data(REPO_DIR):
-            upsert_dynamic(session, person)
+            person_writer.add(person)
+        person_writer.flush()
+        log.info(f"Upserted {person_writer.count} people")
+
+        # Matches made against the old rosters are no longer valid
+        delete_stale_voter_name_resolutions(session)
+
 
 if __name__ == "__main__":
     setup_logging()
@@ -9,8 +9,9 @@ import os
 import shutil
 
 from .people_utils import clone_repository, find_current_role
-from ..database.database import get_session, upsert_dynamic
+from ..database.database import BatchUpserter, get_session
 from ..database.models import Person
+from ..bills.vote_matching import delete_stale_voter_name_resolutions
 from ..logging_config import setup_logging
 from ..utils import convert_area_id
 from ..reference_data_helper import get_state_district_mapping
@@ -146,7 +147,7 @@ def parse_people_data(repo_dir):
                 if is_special_case(state_abbreviation, person_data, current_role):
                     continue
 
-                yield Person(
+                yield dict(
                     id=person_data["id"],
                     jurisdiction_area_id=convert_area_id(current_role['jurisdiction']),
                     constituent_area_id=constituent_area_id,
@@ -181,8 +182,14 @@ def main():
         # Data lives in a GH repository
         clone_repository(REPO_URL, REPO_DIR)
 
+        person_writer = BatchUpserter(session, Person)
         for person in parse_people_data(REPO_DIR):
-            upsert_dynamic(session, person)
+            person_writer.add(person)
+        person_writer.flush()
+        log.info(f"Upserted {person_writer.count} people")
+
+        # Matches made against the old rosters are no longer valid
+        delete_stale_voter_name_resolutions(session)
 
         cleanup(REPO_DIR)
 
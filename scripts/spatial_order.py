@@ -0,0 +1,100 @@
+"""
+Helpers for writing spatially adjacent rows next to each other on disk.
+
+The loaders otherwise insert in whatever order the source files happen to be in
+(fips code, precinct GEOID, ...) which scatters neighbors across heap pages and makes
+intersection scans do a lot more random I/O than needed.
+
+Usage (re-cluster a table on its spatial index after a big load):
+python -m scripts.spatial_order --table areas
+"""
+import argparse
+import logging
+
+import numpy as np
+from sqlalchemy import text
+
+from .database.database import get_session
+from .logging_config import setup_logging
+
+log = logging.getLogger(__name__)
+
+# Bits per axis of the hilbert curve grid (2^16 x 2^16 cells)
+HILBERT_ORDER = 16
+
+# geoalchemy2 names spatial indexes idx_<table>_<column>
+SPATIAL_INDEXES = {
+    "areas": "idx_areas_geometry",
+    "precinct_election_result_area": "idx_precinct_election_result_area_geometry",
+}
+
+
+def hilbert_keys(lons, lats, order: int = HILBERT_ORDER) -> np.ndarray:
+    """
+    Vectorized hilbert curve distance for each (lon, lat) point. Points are scaled to
+    the bounding box of the input so the full curve resolution is used.
+    """
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    n = 1 << order
+
+    def scale(values):
+        low, high = np.nanmin(values), np.nanmax(values)
+        span = high - low if high > low else 1.0
+        return np.clip(((np.nan_to_num(values, nan=low) - low) / span * (n - 1)).astype(np.int64), 0, n - 1)
+
+    x = scale(lons)
+    y = scale(lats)
+    keys = np.zeros(len(x), dtype=np.int64)
+
+    s = n >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        keys += s * s * ((3 * rx.astype(np.int64)) ^ ry.astype(np.int64))
+
+        # Rotate the quadrant so the curve stays continuous
+        flip = ~ry & rx
+        x = np.where(flip, (n - 1) - x, x)
+        y = np.where(flip, (n - 1) - y, y)
+        swap = ~ry
+        x, y = np.where(swap, y, x), np.where(swap, x, y)
+
+        s >>= 1
+
+    return keys
+
+
+def hilbert_order(lons, lats) -> list:
+    """Indexes of the input points sorted along the hilbert curve"""
+    if len(lons) == 0:
+        return []
+    return np.argsort(hilbert_keys(lons, lats), kind="stable").tolist()
+
+
+def cluster_table(session, table_name: str):
+    """
+    Physically rewrites the table in its spatial index order. Takes an exclusive lock
+    on the table for the duration so this is meant to be run right after a bulk load.
+    """
+    index_name = SPATIAL_INDEXES[table_name]
+    log.info(f"Clustering {table_name} using {index_name}")
+    session.execute(text(f"CLUSTER {table_name} USING {index_name}"))
+    session.execute(text(f"ANALYZE {table_name}"))
+    session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cluster a table on its spatial index")
+    parser.add_argument("--table", type=str, required=True, choices=list(SPATIAL_INDEXES))
+    args = parser.parse_args()
+
+    with get_session() as session:
+        cluster_table(session, args.table)
+
+    log.info("Finished")
+
+
+if __name__ == "__main__":
+    setup_logging()
+    main()
@@ -0,0 +1,4 @@
+import os
+
+# scripts.database.database reads it at import time, nothing in the tests connects
+os.environ.setdefault("POSTGRES_DB_PASSWORD", "")
@@ -0,0 +1,58 @@
+import gzip
+import io
+
+import pytest
+
+from scripts.elections import nytimes_precincts
+
+
+class FakeResponse:
+    def __init__(self, body: bytes):
+        self.raw = io.BytesIO(gzip.compress(body))
+
+    def raise_for_status(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    def serve(body: bytes):
+        def get(url, stream=False):
+            assert stream
+            return FakeResponse(body)
+        monkeypatch.setattr(nytimes_precincts.requests, "get", get)
+    return serve
+
+
+def test_iter_gzip_ndjson(serve):
+    serve(b'{"GEOID": "01001-1", "votes_dem": 12}\n\n{"GEOID": "01001-2", "name": "M\xc3\xbcnster"}\n')
+    rows = list(nytimes_precincts.iter_gzip_ndjson("https://example.com/precincts.ndjson.gz"))
+    assert rows == [{"GEOID": "01001-1", "votes_dem": 12}, {"GEOID": "01001-2", "name": "Münster"}]
+
+
+def test_iter_gzip_csv_rows(serve):
+    serve(b'GEOID,state,votes_dem\r\n01001-1,AL,12\r\n"01001-2","AL","3"\r\n')
+    rows = list(nytimes_precincts.iter_gzip_csv_rows("https://example.com/precincts.csv.gz"))
+    assert rows == [
+        {"GEOID": "01001-1", "state": "AL", "votes_dem": "12"},
+        {"GEOID": "01001-2", "state": "AL", "votes_dem": "3"},
+    ]
+
+
+def test_iter_gzip_csv_rows_multiline_field(serve):
+    serve(b'GEOID,note\n01001-1,"two\nlines"\n')
+    rows = list(nytimes_precincts.iter_gzip_csv_rows("https://example.com/precincts.csv.gz"))
+    assert rows == [{"GEOID": "01001-1", "note": "two\nlines"}]
+
+
+def test_iter_gzip_lines_streams_in_chunks(serve, monkeypatch):
+    monkeypatch.setattr(nytimes_precincts, "CHUNK_SIZE", 16)
+    lines = [f'{{"GEOID": "{i}"}}\n' for i in range(1000)]
+    serve("".join(lines).encode())
+    assert list(nytimes_precincts.iter_gzip_lines("https://example.com/precincts.ndjson.gz")) == lines
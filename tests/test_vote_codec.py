@@ -0,0 +1,29 @@
+from scripts.database.vote_codec import compact_vote_event_row, decode_votes, encode_votes, vote_event_votes
+
+VOTES = [
+    {"option": "yes", "voter_name": "Baldwin (D-WI)", "voter_id": "ocd-person/1", "note": ""},
+    {"option": "not voting", "voter_name": "Camera Bartolotta", "voter_id": '~{"name": "Camera Bartolotta"}', "note": ""},
+]
+
+
+def test_round_trip():
+    encoded = encode_votes(VOTES)
+    assert encoded["vote_voter_ids"] == ["ocd-person/1", None]
+    decoded = decode_votes(encoded["vote_option_codes"], encoded["vote_voter_ids"], encoded["vote_voter_names"])
+    assert decoded == VOTES
+
+
+def test_missing_note_decodes_as_empty():
+    votes = [{key: value for key, value in vote.items() if key != "note"} for vote in VOTES]
+    row = compact_vote_event_row({"votes": votes})
+    assert row["votes"] is None
+    assert vote_event_votes(row) == VOTES
+
+
+def test_note_is_not_encoded():
+    votes = [dict(VOTES[0], note="Paired with Smith"), VOTES[1]]
+    assert encode_votes(votes) is None
+    row = compact_vote_event_row({"votes": votes})
+    assert row["votes"] == votes
+    assert row["vote_option_codes"] is None
+    assert vote_event_votes(row) == votes